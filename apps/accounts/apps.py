@@ -7,4 +7,5 @@ class AccountsConfig(AppConfig):
 
 
     def ready(self):
+        import apps.accounts.jobs
         import apps.accounts.signals
\ No newline at end of file
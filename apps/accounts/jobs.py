@@ -0,0 +1,71 @@
+from django.utils import timezone
+
+from apps.jobs.registry import JobError, RetryJob, register
+from services.plaid import PlaidService, PlaidUnavailable
+
+from .models import BankAccount
+from .services import (SyncScheduler, TransactionSync, access_token_hash,
+                       link_bank_accounts)
+
+LINK_PLAID_ITEM = 'accounts.link_plaid_item'
+
+
+def stored_access_token(job) -> str:
+    """
+    The access token a job was queued for. Payloads only hold its hash, so
+    the token is found among the ones stored on the profile and accounts.
+    """
+    tokens = {job.user.profile.last_plaid_token, *BankAccount.objects.filter(
+        user=job.user, access_token__isnull=False
+    ).values_list('access_token', flat=True)}
+    for token in tokens - {None, ''}:
+        if access_token_hash(token) == job.payload['token_hash']:
+            return token
+    raise JobError("The access token of the linked Plaid item is no longer stored")
+
+
+@register(LINK_PLAID_ITEM)
+def link_plaid_item(job) -> dict:
+    """
+    Onboard a newly linked Plaid item: store its bank accounts, then ingest
+    their transaction history, reporting `transactions_ingested` as pages land.
+    Safe to re-run, as accounts and transactions are both upserted.
+    """
+    import plaid
+
+    access_token = stored_access_token(job)
+    try:
+        link_bank_accounts(job.user, access_token)
+    except PlaidUnavailable as e:
+        raise RetryJob(str(e), delay=PlaidService.breaker.reset_seconds)
+    except Exception as e:
+        if PlaidService.is_transient(e):
+            raise RetryJob(f"Plaid is unavailable: {e}")
+        if isinstance(e, plaid.ApiException):
+            raise JobError(f"Failed to retrieve accounts: {e.status} {e.body}")
+        raise
+
+    bank_accounts = BankAccount.objects.filter(user=job.user, access_token=access_token)
+    syncs = TransactionSync.for_accounts(bank_accounts.exclude(
+        sync_status__in=[BankAccount.SYNC_DONE, BankAccount.SYNC_FAILED]
+    ))
+    SyncScheduler().run(syncs, on_page=lambda sync, counts: job.report_progress(
+        transactions_ingested=counts['added'] + counts['modified']
+    ))
+
+    if bank_accounts.filter(sync_status=BankAccount.SYNC_RUNNING).exists():
+        # Claimed by `sync_transactions`; check back once it has had time to finish
+        raise RetryJob("Transaction sync is running in another process",
+                       delay=BankAccount.SYNC_RETRY_BASE_SECONDS)
+    if failed := bank_accounts.filter(sync_status=BankAccount.SYNC_FAILED).first():
+        raise JobError(f"Transaction sync failed: {failed.last_sync_error}")
+    if pending := bank_accounts.filter(sync_status=BankAccount.SYNC_PENDING) \
+            .order_by('next_sync_at').first():
+        # Plaid is still preparing the history; come back when the account is due
+        raise RetryJob(
+            f"Transaction sync pending: {pending.last_sync_error}",
+            delay=max((pending.next_sync_at - timezone.now()).total_seconds(), 0)
+            if pending.next_sync_at else None
+        )
+
+    return {'bank_accounts': bank_accounts.count()}
@@ -0,0 +1,82 @@
+import time
+from datetime import date, timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.accounts.models import BankAccount
+from apps.accounts.services import SyncScheduler, TransactionSync, format_stats
+from services.plaid import PlaidService
+
+
+class StubPlaidClient:
+    """Local stand-in for /transactions/sync with a fixed response latency"""
+
+    def __init__(self, pages: int, page_size: int, latency: float):
+        self.pages = pages
+        self.page_size = page_size
+        self.latency = latency
+
+    def transactions_sync(self, request, **kwargs):
+        time.sleep(self.latency)
+        page = int(request.cursor or 0)
+        added = [
+            {
+                'transaction_id': f"{request.access_token}-{page}-{i}",
+                'account_id': request.access_token,
+                'amount': 10 + i,
+                'merchant_name': f"Merchant {i % 20}",
+                'date': date.today() - timedelta(days=page * self.page_size + i),
+            }
+            for i in range(self.page_size)
+        ]
+        return mock.Mock(to_dict=lambda: {
+            'added': added, 'modified': [], 'removed': [],
+            'next_cursor': str(page + 1),
+            'has_more': page + 1 < self.pages,
+        })
+
+
+class Command(BaseCommand):
+    help = 'Compare sequential and concurrent Plaid sync against a local stub API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5, help='Number of linked Plaid items')
+        parser.add_argument('--pages', type=int, default=4, help='Pages of history per item')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--latency', type=float, default=0.3, help='Stub response time (seconds)')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 5],
+            help='Worker pool sizes to compare'
+        )
+
+    def handle(self, *args, **options):
+        client = StubPlaidClient(options['pages'], options['page_size'], options['latency'])
+
+        for workers in options['concurrency']:
+            # Every run writes into a transaction that is rolled back afterwards
+            with transaction.atomic(), mock.patch.object(PlaidService, 'client', client):
+                syncs = self.create_items(options['items'])
+                PlaidService.stats.reset()
+                started = time.perf_counter()
+                results = SyncScheduler(max_workers=workers, request_interval=0).run(syncs)
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+
+            added = sum(totals['added'] for totals in results.values())
+            self.stdout.write(
+                f"{workers} worker(s): {elapsed:.2f}s for {options['items']} items, "
+                f"{added} transactions"
+            )
+            self.stdout.write(format_stats(PlaidService.stats.snapshot()))
+
+    @staticmethod
+    def create_items(count: int) -> list[TransactionSync]:
+        user = get_user_model().objects.create(username='plaid-sync-benchmark')
+        accounts = BankAccount.objects.bulk_create([
+            BankAccount(user=user, name=f"Account {i}", account_id=f"item-{i}", access_token=f"item-{i}")
+            for i in range(count)
+        ])
+        return TransactionSync.for_accounts(BankAccount.objects.filter(id__in=[a.id for a in accounts]))
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import BankAccount
+from apps.accounts.services import SyncScheduler, TransactionSync, format_stats
+from services.plaid import PlaidService
+
+
+class Command(BaseCommand):
+    help = 'Sync new, modified and removed Plaid transactions for bank accounts that are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='Only sync bank accounts belonging to this user id'
+        )
+        parser.add_argument(
+            '--concurrency', type=int,
+            help='Number of Plaid items synced at once (defaults to PLAID_SYNC_CONCURRENCY)'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Sync every linked account, including failed ones and ones not yet due'
+        )
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Keep running and sync accounts as they become due'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=30.0,
+            help='Seconds between checks for due accounts in watch mode'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.sync(options)
+            if not options['watch']:
+                break
+            time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS('Successfully synced transactions'))
+
+    def sync(self, options):
+        if options['all']:
+            bank_accounts = BankAccount.objects.exclude(access_token__isnull=True)
+        else:
+            bank_accounts = BankAccount.objects.due_for_sync()
+        if options['user']:
+            bank_accounts = bank_accounts.filter(user_id=options['user'])
+
+        syncs = TransactionSync.for_accounts(bank_accounts)
+        results = SyncScheduler(max_workers=options['concurrency']).run(syncs)
+
+        for sync, totals in results.items():
+            self.stdout.write(
+                f"{sync} ({sync.status}): {totals['added']} added, "
+                f"{totals['modified']} modified, {totals['removed']} removed"
+            )
+        if results:
+            self.stdout.write(format_stats(PlaidService.stats.snapshot()))
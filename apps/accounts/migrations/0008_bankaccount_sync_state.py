@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_alter_profile_currency"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bankaccount",
+            name="last_sync_error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="bankaccount",
+            name="last_synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="bankaccount",
+            name="next_sync_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the account is next due for a transaction sync",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="bankaccount",
+            name="sync_attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Failed sync attempts since the last successful sync",
+            ),
+        ),
+        migrations.AddField(
+            model_name="bankaccount",
+            name="sync_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0008_bankaccount_sync_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bankaccount",
+            name="sync_not_ready_polls",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Syncs deferred since the last successful sync because Plaid was preparing the history",
+            ),
+        ),
+    ]
@@ -1,5 +1,10 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
 from model_utils import FieldTracker
 
 
@@ -38,7 +43,112 @@ class Profile(models.Model):
         return self.user.username
 
 
+class BankAccountQuerySet(models.QuerySet):
+    def due_for_sync(self):
+        """Linked accounts whose next transaction sync is due"""
+        return self.exclude(access_token__isnull=True) \
+            .exclude(sync_status=self.model.SYNC_FAILED) \
+            .filter(Q(next_sync_at__isnull=True) | Q(next_sync_at__lte=timezone.now()))
+
+    def claim(self) -> bool:
+        """
+        Mark all of these accounts running, or none of them if another
+        process holds an unexpired lease on any. The update is conditional,
+        so two processes can never sync the same accounts at once.
+        """
+        now = timezone.now()
+        expected = self.count()
+        with transaction.atomic():
+            claimed = self.exclude(sync_status=self.model.SYNC_RUNNING, next_sync_at__gt=now).update(
+                sync_status=self.model.SYNC_RUNNING,
+                next_sync_at=now + timedelta(seconds=self.model.SYNC_LEASE_SECONDS)
+            )
+            if claimed != expected:
+                transaction.set_rollback(True)
+                return False
+        return True
+
+    def mark_running(self):
+        # The lease makes an account due again if its sync process dies
+        self.update(
+            sync_status=self.model.SYNC_RUNNING,
+            next_sync_at=timezone.now() + timedelta(seconds=self.model.SYNC_LEASE_SECONDS)
+        )
+
+    def mark_done(self):
+        now = timezone.now()
+        self.update(
+            sync_status=self.model.SYNC_DONE,
+            sync_attempts=0,
+            sync_not_ready_polls=0,
+            last_sync_error='',
+            last_synced_at=now,
+            next_sync_at=now + timedelta(seconds=settings.PLAID_SYNC_REFRESH_INTERVAL)
+        )
+
+    def mark_retry(self, attempts: int, error: str):
+        """
+        Schedule another sync after an exponential backoff, or give up once
+        `SYNC_MAX_ATTEMPTS` is reached.
+        """
+        if attempts >= self.model.SYNC_MAX_ATTEMPTS:
+            self.update(
+                sync_status=self.model.SYNC_FAILED,
+                sync_attempts=attempts,
+                last_sync_error=error,
+                next_sync_at=None
+            )
+            return
+
+        self.update(
+            sync_status=self.model.SYNC_PENDING,
+            sync_attempts=attempts,
+            last_sync_error=error,
+            next_sync_at=timezone.now() + self.model.retry_backoff(attempts)
+        )
+
+    def mark_not_ready(self, polls: int, error: str):
+        """
+        Poll again for a history Plaid is still preparing, backing off like
+        a retry but on its own counter, and give up once
+        `SYNC_MAX_NOT_READY_POLLS` is reached.
+        """
+        if polls >= self.model.SYNC_MAX_NOT_READY_POLLS:
+            self.update(
+                sync_status=self.model.SYNC_FAILED,
+                sync_not_ready_polls=polls,
+                last_sync_error=error,
+                next_sync_at=None
+            )
+            return
+
+        self.update(
+            sync_status=self.model.SYNC_PENDING,
+            sync_not_ready_polls=polls,
+            last_sync_error=error,
+            next_sync_at=timezone.now() + self.model.retry_backoff(polls)
+        )
+
+
 class BankAccount(models.Model):
+    SYNC_PENDING = 'pending'
+    SYNC_RUNNING = 'running'
+    SYNC_DONE = 'done'
+    SYNC_FAILED = 'failed'
+    SYNC_STATUS_CHOICES = [
+        (SYNC_PENDING, 'Pending'),
+        (SYNC_RUNNING, 'Running'),
+        (SYNC_DONE, 'Done'),
+        (SYNC_FAILED, 'Failed'),
+    ]
+
+    SYNC_MAX_ATTEMPTS = 8
+    SYNC_LEASE_SECONDS = 900
+    SYNC_RETRY_BASE_SECONDS = 30
+    SYNC_RETRY_MAX_SECONDS = 3600
+    # With the backoff above, about ten hours of waiting for Plaid's history
+    SYNC_MAX_NOT_READY_POLLS = 16
+
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
 
     name = models.CharField(max_length=200)
@@ -54,5 +164,33 @@ class BankAccount(models.Model):
         help_text="Cursor for fetching transactions"
     )
 
+    sync_status = models.CharField(
+        max_length=10,
+        choices=SYNC_STATUS_CHOICES,
+        default=SYNC_PENDING
+    )
+    sync_attempts = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Failed sync attempts since the last successful sync"
+    )
+    sync_not_ready_polls = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Syncs deferred since the last successful sync because Plaid was preparing the history"
+    )
+    next_sync_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text="When the account is next due for a transaction sync"
+    )
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_sync_error = models.TextField(blank=True)
+
+    objects = BankAccountQuerySet.as_manager()
+
+    @classmethod
+    def retry_backoff(cls, attempts: int) -> timedelta:
+        return timedelta(seconds=min(
+            cls.SYNC_RETRY_BASE_SECONDS * 2 ** (attempts - 1), cls.SYNC_RETRY_MAX_SECONDS
+        ))
+
     def __str__(self):
         return f"{self.user} - {self.name} ({self.balance})"
@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from .models import BankAccount
+
+
+class BankAccountSyncSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BankAccount
+        fields = [
+            'id', 'name', 'sync_status', 'sync_attempts', 'sync_not_ready_polls',
+            'next_sync_at', 'last_synced_at', 'last_sync_error'
+        ]
+        read_only_fields = fields
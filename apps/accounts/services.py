@@ -1,79 +1,438 @@
+import hashlib
 import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from typing import Optional
+from typing import Callable
+
+from django.conf import settings
+from django.db import transaction as db_transaction
 
 from apps.accounts.models import BankAccount
-from apps.transactions.models import BankTransaction
+from apps.budget.services import recompute_budgets
+from apps.categories.services import plaid_subcategory_ids
+from apps.transactions.models import BankTransaction, EmbeddingTask
+from services.plaid import PlaidService, TransactionsNotReady
 
 logger = logging.getLogger(__name__)
 
 
 class AccountProcessor:
     @staticmethod
-    def _sanitise_subcategory(category):
-        """
-        Formats Plaid transaction subcategory into readable text.
-        """
-        multiwords = {
-            'BANK_FEES', 'FOOD_AND_DRINK', 'GENERAL_MERCHANDISE', 'GENERAL_SERVICES', 'GOVERNMENT_AND_NON_PROFIT',
-            'HOME_IMPROVEMENT', 'LOAN_PAYMENTS', 'PERSONAL_CARE', 'RENT_AND_UTILITIES', 'TRANSFER_IN', 'TRANSFER_OUT'
-        }
-
-        for word in multiwords:
-            if category.startswith(word):
-                return " ".join(category.replace(f'{word}_', '').split('_')).lower()
-        return " ".join(category.split('_')[1:]).lower()
-
-    @staticmethod
-    def process_transaction(transaction: dict, user, subcategories: dict) -> Optional[BankTransaction]:
-        """Process a single transaction and return BankTransaction object."""
+    def _transaction_date(transaction: dict):
         # Get the transaction date by order of precedence
         date_fields = [
             'authorized_datetime', 'datetime',
             'authorized_date', 'date'
         ]
-        transaction_date = next(
+        return next(
             (transaction.get(field)
              for field in date_fields if transaction.get(field)),
             None
         )
 
-        if not transaction_date:
-            logger.error("No valid date found in transaction data")
-            return None
+    @staticmethod
+    def process_page(
+        transactions: list[dict], user, bank_accounts: dict,
+        subcategory_ids: dict, transaction_ids: dict = None
+    ) -> tuple[list[BankTransaction], list]:
+        """
+        Turn a page of Plaid transactions into unsaved BankTransaction objects
+        and the `subcategories` through rows linking them, without running a
+        query. `bank_accounts` maps Plaid account ids to BankAccounts,
+        `subcategory_ids` maps Plaid detailed category codes to SubCategory
+        ids and `transaction_ids` maps Plaid transaction ids to the ids of rows that
+        already exist, which are reused so the caller can update them.
+        """
+        transaction_ids = transaction_ids or {}
+        Through = BankTransaction.subcategories.through
+        bank_transactions, through_rows = [], []
+
+        for transaction in transactions:
+            if not (transaction_date := AccountProcessor._transaction_date(transaction)):
+                logger.error("No valid date found in transaction data")
+                continue
 
-        # Create BankTransaction object
-        try:
-            bank_account = BankAccount.objects.get(account_id=transaction.get('account_id'))
-            bank_transaction = BankTransaction(
-                bank_account=bank_account,
-                merchant=transaction.get('merchant_name', 'Unknown Merchant'),
-                transaction_date=transaction_date,
-                # Using `abs` to unify transaction amounts into positive values. Why?
-                # - Banks are chaotic: some report expenses as "-100", others as "100".
-                # - This app only tracks expenses, so we treat all as positive.
-                # - Why not negative? Life is good (and math is simpler this way).
-                # WARNING: If income tracking is added later, revisit this logic!
-                amount=abs(Decimal(str(transaction['amount']))),
-                user=user
-            )
+            if not (bank_account := bank_accounts.get(transaction.get('account_id'))):
+                logger.error(f"Unknown bank account: {transaction.get('account_id')}")
+                continue
 
-            # Add subcategory to transaction
-            if 'personal_finance_category' in transaction:
-                category_name = AccountProcessor._sanitise_subcategory(
-                    transaction['personal_finance_category']['detailed']
+            try:
+                bank_transaction = BankTransaction(
+                    bank_account=bank_account,
+                    plaid_transaction_id=transaction.get('transaction_id'),
+                    merchant=transaction.get('merchant_name', 'Unknown Merchant'),
+                    transaction_date=transaction_date,
+                    # Using `abs` to unify transaction amounts into positive values. Why?
+                    # - Banks are chaotic: some report expenses as "-100", others as "100".
+                    # - This app only tracks expenses, so we treat all as positive.
+                    # - Why not negative? Life is good (and math is simpler this way).
+                    # WARNING: If income tracking is added later, revisit this logic!
+                    amount=abs(Decimal(str(transaction['amount']))),
+                    user=user
                 )
-                # Use the prefetched subcategories for performance
-                if subcategory := subcategories.get(category_name):
-                    bank_transaction.subcategories.add(subcategory)
+            except KeyError as e:
+                logger.error(f"Missing required field in transaction: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Error processing transaction: {str(e)}")
+                continue
+
+            if existing_id := transaction_ids.get(bank_transaction.plaid_transaction_id):
+                bank_transaction.id = existing_id
+            bank_transactions.append(bank_transaction)
+
+            if transaction.get('personal_finance_category'):
+                code = transaction['personal_finance_category']['detailed']
+                if subcategory_id := subcategory_ids.get(code):
+                    through_rows.append(Through(
+                        banktransaction_id=bank_transaction.id, subcategory_id=subcategory_id
+                    ))
                 else:
-                    logger.error(f"Subcategory not found: {category_name}")
+                    logger.error(f"No subcategory mapped to Plaid category: {code}")
+
+        return bank_transactions, through_rows
+
+
+def access_token_hash(access_token: str) -> str:
+    """Identifies an access token in job payloads without storing the secret"""
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def link_bank_accounts(user, access_token: str) -> list[BankAccount]:
+    """
+    Store the bank accounts of a newly linked Plaid item, updating the ones
+    already known. Returns the new accounts, which start out pending a sync.
+    Plaid errors are raised to the caller.
+    """
+    accounts = PlaidService.get_accounts(access_token)
+    if not accounts:
+        return []
+
+    with db_transaction.atomic():
+        # Get existing accounts in a single query
+        existing_accounts = {
+            acc.account_id: acc
+            for acc in BankAccount.objects.filter(
+                user=user,
+                account_id__in=[acc["account_id"] for acc in accounts]
+            )
+        }
+
+        to_create, to_update = [], []
+
+        for account in accounts:
+            account_id = account["account_id"]
+
+            if account_id in existing_accounts:
+                # Update existing account
+                bank_account = existing_accounts[account_id]
+                bank_account.name = account["official_name"]
+                bank_account.balance = account["balances"]["current"]
+                to_update.append(bank_account)
+            else:
+                # Create new account
+                to_create.append(
+                    BankAccount(
+                        user=user,
+                        account_id=account_id,
+                        name=account["official_name"],
+                        balance=account["balances"]["current"],
+                        access_token=access_token
+                    )
+                )
+
+        # Perform bulk operations
+        if to_create:
+            BankAccount.objects.bulk_create(to_create)
+        if to_update:
+            BankAccount.objects.bulk_update(to_update, ['name', 'balance'])
+
+    return to_create
+
+
+class TransactionSync:
+    """
+    Streams Plaid /transactions/sync updates for one Plaid item (the bank
+    accounts sharing an access token) into the database.
+
+    Each page is applied in its own database transaction together with the
+    cursor that follows it, so memory stays bounded by the page size and a
+    sync that dies midway resumes from the last stored page. Upserting by
+    `plaid_transaction_id` makes replaying a page harmless.
+    """
+    UPDATE_FIELDS = ['bank_account', 'merchant', 'transaction_date', 'amount']
+    BATCH_SIZE = 500
+
+    def __init__(self, bank_accounts):
+        self.bank_accounts = list(bank_accounts)
+        self.access_token = self.bank_accounts[0].access_token
+        self.user = self.bank_accounts[0].user
+        self.account_map = {bank_account.account_id: bank_account for bank_account in self.bank_accounts}
+        self.subcategory_ids = plaid_subcategory_ids()
+
+    @classmethod
+    def for_accounts(cls, bank_accounts) -> list['TransactionSync']:
+        """Group bank accounts into one sync per Plaid item"""
+        items = {}
+        for bank_account in bank_accounts.select_related('user'):
+            items.setdefault(bank_account.access_token, []).append(bank_account)
+        return [cls(accounts) for token, accounts in items.items() if token]
+
+    @property
+    def cursor(self) -> str:
+        # Any account without a cursor needs the full history; replaying
+        # pages the other accounts already have is safe
+        cursors = {bank_account.next_cursor for bank_account in self.bank_accounts}
+        if len(cursors) != 1 or None in cursors:
+            return ''
+        return cursors.pop()
+
+    def __str__(self):
+        return f"BankAccounts {self.account_ids}"
+
+    @property
+    def account_ids(self) -> list[int]:
+        return [bank_account.id for bank_account in self.bank_accounts]
+
+    @property
+    def accounts(self):
+        return BankAccount.objects.filter(id__in=self.account_ids)
+
+    @property
+    def status(self) -> str:
+        return self.bank_accounts[0].sync_status
+
+    def claim(self) -> bool:
+        """Mark the item's accounts running, unless another process is syncing them"""
+        if not self.accounts.claim():
+            return False
+        # Another process may have moved the cursors since they were read
+        cursors = dict(self.accounts.values_list('id', 'next_cursor'))
+        for bank_account in self.bank_accounts:
+            bank_account.next_cursor = cursors[bank_account.id]
+        self._set_status(BankAccount.SYNC_RUNNING)
+        return True
 
-            return bank_transaction
+    def mark_done(self):
+        self.accounts.mark_done()
+        self._set_status(BankAccount.SYNC_DONE, attempts=0, not_ready_polls=0)
 
-        except KeyError as e:
-            logger.error(f"Missing required field in transaction: {e}")
+    def mark_retry(self, error: Exception):
+        if isinstance(error, TransactionsNotReady):
+            # Expected right after linking, so it is polled without using up
+            # attempts, until the history is so late it is not coming
+            polls = max(bank_account.sync_not_ready_polls for bank_account in self.bank_accounts) + 1
+            self.accounts.mark_not_ready(polls, str(error))
+            self._set_status(
+                BankAccount.SYNC_FAILED if polls >= BankAccount.SYNC_MAX_NOT_READY_POLLS
+                else BankAccount.SYNC_PENDING,
+                not_ready_polls=polls
+            )
+            return
+
+        attempts = max(bank_account.sync_attempts for bank_account in self.bank_accounts) + 1
+        self.accounts.mark_retry(attempts, str(error))
+        self._set_status(
+            BankAccount.SYNC_FAILED if attempts >= BankAccount.SYNC_MAX_ATTEMPTS
+            else BankAccount.SYNC_PENDING,
+            attempts=attempts
+        )
+
+    def _set_status(self, status: str, attempts: int = None, not_ready_polls: int = None):
+        for bank_account in self.bank_accounts:
+            bank_account.sync_status = status
+            if attempts is not None:
+                bank_account.sync_attempts = attempts
+            if not_ready_polls is not None:
+                bank_account.sync_not_ready_polls = not_ready_polls
+
+    def apply_page(self, page: dict) -> dict:
+        """Store one page of updates and advance the cursor atomically"""
+        with db_transaction.atomic():
+            upserted, previous = self._upsert(page['added'] + page['modified'])
+            removed = self._remove(page['removed'])
+
+            if changed := upserted + previous + removed:
+                BankTransaction.refresh_recurring(
+                    self.user, merchants={bank_transaction.merchant for bank_transaction in changed}
+                )
+                recompute_budgets(changed)
+            # bulk writes skip post_save, so queue the embeddings here
+            EmbeddingTask.objects.enqueue(upserted)
+
+            self.accounts.update(next_cursor=page['next_cursor'])
+            for bank_account in self.bank_accounts:
+                bank_account.next_cursor = page['next_cursor']
+
+        return {
+            'added': len(page['added']),
+            'modified': len(page['modified']),
+            'removed': len(removed),
+        }
+
+    def _upsert(self, transactions: list[dict]) -> tuple[list, list]:
+        """
+        Insert new transactions and update known ones in place.
+        Returns the written transactions and the stored versions they replaced.
+        """
+        previous = {
+            bank_transaction.plaid_transaction_id: bank_transaction
+            for bank_transaction in BankTransaction.objects.filter(
+                plaid_transaction_id__in=[trans.get('transaction_id') for trans in transactions]
+            ).only('id', 'plaid_transaction_id', 'user', 'merchant', 'transaction_date')
+        }
+        bank_transactions, through_rows = AccountProcessor.process_page(
+            transactions, self.user, self.account_map, self.subcategory_ids,
+            transaction_ids={plaid_id: bt.id for plaid_id, bt in previous.items()}
+        )
+
+        to_create, to_update = [], []
+        for bank_transaction in bank_transactions:
+            if bank_transaction.plaid_transaction_id in previous:
+                to_update.append(bank_transaction)
+            else:
+                to_create.append(bank_transaction)
+
+        BankTransaction.objects.bulk_create(to_create, batch_size=self.BATCH_SIZE)
+        BankTransaction.objects.bulk_update(to_update, self.UPDATE_FIELDS, batch_size=self.BATCH_SIZE)
+
+        Through = BankTransaction.subcategories.through
+        Through.objects.filter(banktransaction_id__in=[bt.id for bt in to_update]).delete()
+        Through.objects.bulk_create(through_rows, batch_size=self.BATCH_SIZE)
+
+        return to_create + to_update, list(previous.values())
+
+    def _remove(self, removed: list[dict]) -> list:
+        transactions = list(BankTransaction.objects.filter(
+            plaid_transaction_id__in=[trans['transaction_id'] for trans in removed]
+        ))
+        # Deleted through the ORM so the delete signals update budgets and vectors
+        BankTransaction.objects.filter(id__in=[bt.id for bt in transactions]).delete()
+        return transactions
+
+
+class SyncScheduler:
+    """
+    Syncs several Plaid items concurrently.
+
+    A bounded thread pool runs the network phase: each worker pages through
+    one item's /transactions/sync, spacing its requests by
+    `PLAID_ITEM_REQUEST_INTERVAL`. Pages are handed over a bounded queue to
+    the calling thread, which alone writes to the database, so no database
+    transaction is held open during network I/O.
+
+    Accounts are claimed (marked running) for the duration of their sync,
+    and items another process is already syncing are skipped. They end done,
+    or pending with a backoff (failed once out of attempts) if fetching or
+    storing a page went wrong. Plaid still preparing an item's history
+    leaves it pending on a separate, bounded count of polls rather than
+    using up attempts.
+    """
+    _done = object()
+
+    def __init__(self, max_workers: int = None, request_interval: float = None, queue_size: int = None):
+        self.max_workers = max_workers or settings.PLAID_SYNC_CONCURRENCY
+        self.request_interval = settings.PLAID_ITEM_REQUEST_INTERVAL \
+            if request_interval is None else request_interval
+        self.queue_size = queue_size or self.max_workers * 2
+
+    def run(self, syncs: list[TransactionSync], on_page: Callable = None) -> dict:
+        """
+        Run every sync and return the totals per sync. `on_page` is called
+        with the sync and its counts after each stored page.
+        """
+        syncs = [sync for sync in syncs if sync.claim()]
+        pages = queue.Queue(maxsize=self.queue_size)
+        cancelled = set()
+        errors = {}
+        results = {sync: {'added': 0, 'modified': 0, 'removed': 0} for sync in syncs}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for sync in syncs:
+                executor.submit(self._fetch, sync, pages, cancelled)
+
+            remaining = len(syncs)
+            try:
+                while remaining:
+                    sync, page = pages.get()
+                    if page is self._done:
+                        remaining -= 1
+                        if error := errors.get(sync):
+                            sync.mark_retry(error)
+                            logger.info(f"Transaction sync for {sync} is {sync.status}")
+                        else:
+                            sync.mark_done()
+                            logger.info(f"Completed transaction sync for {sync}: {results[sync]}")
+                    elif isinstance(page, TransactionsNotReady):
+                        logger.info(f"Transactions for {sync} are not ready yet")
+                        errors[sync] = page
+                    elif isinstance(page, Exception):
+                        logger.error(f"Failed to fetch transactions for {sync}: {page}")
+                        errors[sync] = page
+                    elif sync not in cancelled:
+                        try:
+                            counts = sync.apply_page(page)
+                        except Exception as e:
+                            # Later pages build on this one's cursor, so stop the item here
+                            logger.error(f"Failed to store transactions for {sync}: {e}")
+                            errors[sync] = e
+                            cancelled.add(sync)
+                            continue
+
+                        for key, count in counts.items():
+                            results[sync][key] += count
+                        if on_page:
+                            on_page(sync, counts)
+            except BaseException:
+                # Stop the fetchers and drain their pages, or they stay blocked
+                # on the full queue and the pool's shutdown waits forever
+                cancelled.update(syncs)
+                while remaining:
+                    if pages.get()[1] is self._done:
+                        remaining -= 1
+                raise
+
+        return results
+
+    def _fetch(self, sync: TransactionSync, pages: queue.Queue, cancelled: set):
+        try:
+            throttle = RequestThrottle(self.request_interval)
+            iterator = PlaidService.iter_transaction_pages(sync.access_token, sync.cursor)
+            while sync not in cancelled:
+                throttle.wait()
+                try:
+                    page = next(iterator)
+                except StopIteration:
+                    break
+                pages.put((sync, page))
         except Exception as e:
-            logger.error(f"Error processing transaction: {str(e)}")
+            pages.put((sync, e))
+        finally:
+            pages.put((sync, self._done))
+
+
+class RequestThrottle:
+    """Keeps successive calls at least `interval` seconds apart"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_call = None
+
+    def wait(self):
+        if self.last_call is not None:
+            delay = self.last_call + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_call = time.monotonic()
+
 
-        return None
+def format_stats(stats: dict) -> str:
+    """One line per Plaid endpoint from `PlaidService.stats.snapshot()`"""
+    return "\n".join(
+        f"  {endpoint}: {counters['calls']} calls, {counters['retries']} retries, "
+        f"{counters['errors']} errors, mean {counters['mean_seconds']:.3f}s, "
+        f"max {counters['max_seconds']:.3f}s"
+        for endpoint, counters in sorted(stats.items())
+    )
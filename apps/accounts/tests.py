@@ -1,3 +1,493 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import plaid
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.categories.models import Category, PlaidCategoryMapping, SubCategory
+from apps.jobs.models import Job
+from apps.jobs.registry import run_job
+from apps.transactions.models import BankTransaction
+from services.plaid import (CircuitBreaker, EndpointStats, PlaidService,
+                            PlaidUnavailable)
+
+from .models import BankAccount
+from .services import (AccountProcessor, RequestThrottle, SyncScheduler,
+                       TransactionSync)
+
+
+class StubPlaidClient:
+    """
+    Answers Plaid endpoints from a queue of results, or from a function of
+    the request; exceptions are raised.
+    """
+
+    def __init__(self, **responses):
+        self.responses = {
+            endpoint: results if callable(results) else list(results)
+            for endpoint, results in responses.items()
+        }
+        self.calls = []
+
+    def __getattr__(self, endpoint):
+        def call(request, **kwargs):
+            self.calls.append(endpoint)
+            responses = self.responses[endpoint]
+            result = responses(request) if callable(responses) else responses.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return SimpleNamespace(**result, to_dict=lambda: result)
+        return call
+
+
+class StubPlaidTestCase(TestCase):
+    def use_plaid(self, **responses) -> StubPlaidClient:
+        PlaidService.client = StubPlaidClient(**responses)
+        self.addCleanup(setattr, PlaidService, 'client', None)
+        self.addCleanup(PlaidService.breaker.record_success)
+        self.addCleanup(PlaidService.stats.reset)
+        return PlaidService.client
+
+
+class PlaidPageProcessingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='plaid-page')
+        cls.bank_account = BankAccount.objects.create(
+            user=cls.user, name='Checking', account_id='acc-1', access_token='token'
+        )
+        category, _ = Category.objects.get_or_create(name='food and drink')
+        cls.groceries, _ = SubCategory.objects.get_or_create(name='groceries', category=category)
+        PlaidCategoryMapping.objects.update_or_create(
+            plaid_code='FOOD_AND_DRINK_GROCERIES', defaults={'subcategory': cls.groceries}
+        )
+
+    def plaid_transactions(self, count, prefix='txn', amount=10):
+        return [
+            {
+                'transaction_id': f'{prefix}-{i}',
+                'account_id': 'acc-1',
+                'amount': -amount,
+                'merchant_name': f'Shop {i % 5}',
+                'date': date.today() - timedelta(days=i),
+                'personal_finance_category': {'detailed': 'FOOD_AND_DRINK_GROCERIES'},
+            }
+            for i in range(count)
+        ]
+
+    def test_process_page_runs_no_queries(self):
+        transactions = self.plaid_transactions(20)
+        transactions.append({**transactions[0], 'transaction_id': 'other', 'account_id': 'unknown'})
+        sync = TransactionSync(BankAccount.objects.filter(user=self.user))
+
+        with self.assertNumQueries(0):
+            bank_transactions, through_rows = AccountProcessor.process_page(
+                transactions, self.user, sync.account_map, sync.subcategory_ids
+            )
+
+        self.assertEqual(len(bank_transactions), 20)
+        self.assertEqual(bank_transactions[0].amount, 10)
+        self.assertEqual(
+            [row.banktransaction_id for row in through_rows],
+            [bank_transaction.id for bank_transaction in bank_transactions]
+        )
+        self.assertEqual({row.subcategory_id for row in through_rows}, {self.groceries.id})
+
+    def test_upsert_queries_do_not_grow_with_page_size(self):
+        sync = TransactionSync(BankAccount.objects.filter(user=self.user))
+        query_counts = []
+        # Kept within one insert batch, which SQLite caps at 999 parameters
+        for count, prefix in [(10, 'small'), (60, 'large')]:
+            with CaptureQueriesContext(connection) as queries:
+                sync._upsert(self.plaid_transactions(count, prefix))
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(
+            BankTransaction.objects.filter(subcategories=self.groceries).count(), 70
+        )
+
+    def test_apply_page_queries_do_not_grow_with_page_size(self):
+        sync = TransactionSync(BankAccount.objects.filter(user=self.user))
+        pages = {'small': self.plaid_transactions(2, 'small'), 'large': self.plaid_transactions(20, 'large')}
+        for prefix, transactions in pages.items():
+            sync.apply_page({'added': transactions, 'modified': [], 'removed': [], 'next_cursor': prefix})
+
+        query_counts = []
+        for prefix, transactions in pages.items():
+            with CaptureQueriesContext(connection) as queries:
+                sync.apply_page({'added': [], 'modified': transactions, 'removed': [], 'next_cursor': prefix})
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(BankAccount.objects.get(pk=self.bank_account.pk).next_cursor, 'large')
+
+    def test_upsert_updates_known_transactions(self):
+        sync = TransactionSync(BankAccount.objects.filter(user=self.user))
+        sync._upsert(self.plaid_transactions(5))
+        sync._upsert(self.plaid_transactions(5, amount=12))
+
+        self.assertEqual(BankTransaction.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(set(BankTransaction.objects.values_list('amount', flat=True)), {12})
+        self.assertEqual(BankTransaction.subcategories.through.objects.count(), 5)
+
+
+@override_settings(PLAID_MAX_RETRIES=0)
+class LinkPlaidItemTests(StubPlaidTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='linker')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def link(self) -> Job:
+        self.use_plaid(item_public_token_exchange=[{'access_token': 'secret-token', 'item_id': 'item-1'}])
+        response = self.client.post(reverse('api-v1:exchange-public-token'), {'public_token': 'public'})
+        self.assertEqual(response.status_code, 202)
+        return Job.objects.get(pk=response.json()['job_id'])
+
+    def test_payload_does_not_hold_the_access_token(self):
+        job = self.link()
+        self.assertEqual(job.payload['item_id'], 'item-1')
+        self.assertNotIn('secret-token', str(job.payload))
+
+        self.use_plaid(accounts_get=[{'accounts': []}])
+        run_job(job)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+    def test_transient_plaid_errors_are_retried(self):
+        job = self.link()
+        self.use_plaid(accounts_get=[plaid.ApiException(status=503, reason='Unavailable')])
+        run_job(job)
+
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 0)
+
+    def test_rejected_items_fail(self):
+        job = self.link()
+        self.use_plaid(accounts_get=[plaid.ApiException(status=400, reason='ITEM_LOGIN_REQUIRED')])
+        run_job(job)
+
+        self.assertEqual(job.status, Job.FAILED)
+
+
+class SyncSchedulerTests(StubPlaidTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='scheduler')
+        for token in ('token-a', 'token-b'):
+            BankAccount.objects.create(
+                user=self.user, name=token, account_id=f'acc-{token}', access_token=token
+            )
+
+    def transactions_sync(self, pages: int, barrier=None, errors: dict = None):
+        """Plaid answering each item with `pages` pages of one transaction"""
+        def respond(request):
+            token, cursor = request.access_token, request.cursor
+            if error := (errors or {}).get(token):
+                return error
+            if barrier and not cursor:
+                barrier.wait()
+            number = int(cursor or 0) + 1
+            return {
+                'added': [{
+                    'transaction_id': f'{token}-{number}', 'account_id': f'acc-{token}',
+                    'amount': 5, 'merchant_name': 'Shop', 'date': date.today(),
+                }],
+                'modified': [], 'removed': [],
+                'next_cursor': str(number), 'has_more': number < pages,
+            }
+        return respond
+
+    def run_syncs(self, **options) -> dict:
+        syncs = TransactionSync.for_accounts(BankAccount.objects.filter(user=self.user))
+        on_page = options.pop('on_page', None)
+        return SyncScheduler(request_interval=0, **options).run(syncs, on_page=on_page)
+
+    def test_items_are_fetched_concurrently_and_stored(self):
+        # Both items must be mid-fetch at once for the first pages to return
+        self.use_plaid(transactions_sync=self.transactions_sync(3, threading.Barrier(2, timeout=5)))
+        results = self.run_syncs(max_workers=2)
+
+        self.assertEqual([counts['added'] for counts in results.values()], [3, 3])
+        self.assertEqual(BankTransaction.objects.filter(user=self.user).count(), 6)
+        self.assertEqual(
+            set(BankAccount.objects.values_list('sync_status', 'next_cursor')), {(BankAccount.SYNC_DONE, '3')}
+        )
+
+    @override_settings(PLAID_MAX_RETRIES=0)
+    def test_failing_item_is_retried_without_stopping_the_others(self):
+        self.use_plaid(transactions_sync=self.transactions_sync(
+            2, errors={'token-b': plaid.ApiException(status=400, reason='Bad Request')}
+        ))
+        self.run_syncs()
+
+        done = BankAccount.objects.get(access_token='token-a')
+        failed = BankAccount.objects.get(access_token='token-b')
+        self.assertEqual(done.sync_status, BankAccount.SYNC_DONE)
+        self.assertEqual((failed.sync_status, failed.sync_attempts), (BankAccount.SYNC_PENDING, 1))
+        self.assertIsNotNone(failed.next_sync_at)
+
+    def test_error_in_the_storing_thread_stops_the_fetchers(self):
+        BankAccount.objects.filter(access_token='token-b').delete()
+        self.use_plaid(transactions_sync=self.transactions_sync(10))
+
+        def on_page(sync, counts):
+            raise RuntimeError("Progress report failed")
+
+        # The fetcher fills the one-page queue and waits on it; without the
+        # queue being drained, leaving the pool would wait on it forever
+        with self.assertRaisesMessage(RuntimeError, "Progress report failed"):
+            self.run_syncs(queue_size=1, on_page=on_page)
+
+    def test_items_another_process_is_syncing_are_skipped(self):
+        BankAccount.objects.filter(access_token='token-b').mark_running()
+        self.use_plaid(transactions_sync=self.transactions_sync(1))
+        results = self.run_syncs()
+
+        self.assertEqual([sync.access_token for sync in results], ['token-a'])
+        self.assertEqual(
+            list(BankTransaction.objects.values_list('plaid_transaction_id', flat=True)), ['token-a-1']
+        )
+        self.assertEqual(
+            BankAccount.objects.get(access_token='token-b').sync_status, BankAccount.SYNC_RUNNING
+        )
+
+    def test_fetching_stays_at_most_a_queue_ahead_of_storing(self):
+        BankAccount.objects.filter(access_token='token-b').delete()
+        client = self.use_plaid(transactions_sync=self.transactions_sync(10))
+        leads = []
+        self.run_syncs(queue_size=1, on_page=lambda sync, counts: leads.append(
+            len(client.calls) - len(leads) - 1
+        ))
+
+        self.assertEqual(len(leads), 10)
+        # One page queued and one held by the fetcher waiting to queue it
+        self.assertLessEqual(max(leads), 2)
+
+    def test_items_plaid_is_still_preparing_are_polled_on_their_own_budget(self):
+        self.use_plaid(transactions_sync=lambda request: {
+            'added': [], 'modified': [], 'removed': [], 'next_cursor': '', 'has_more': False
+        })
+        for _ in range(BankAccount.SYNC_MAX_ATTEMPTS + 1):
+            self.run_syncs()
+
+        self.assertEqual(
+            set(BankAccount.objects.values_list('sync_status', 'sync_attempts', 'sync_not_ready_polls')),
+            {(BankAccount.SYNC_PENDING, 0, BankAccount.SYNC_MAX_ATTEMPTS + 1)}
+        )
+
+        for _ in range(BankAccount.SYNC_MAX_NOT_READY_POLLS - BankAccount.SYNC_MAX_ATTEMPTS - 1):
+            self.run_syncs()
+        self.assertEqual(
+            set(BankAccount.objects.values_list('sync_status', 'next_sync_at')), {(BankAccount.SYNC_FAILED, None)}
+        )
+
+
+class BankAccountSyncStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='sync-state')
+
+    def account(self, **fields) -> BankAccount:
+        return BankAccount.objects.create(
+            user=self.user, name='Checking', account_id=f'state-{BankAccount.objects.count()}',
+            **{'access_token': 'token', **fields}
+        )
+
+    def delay(self, account) -> float:
+        account.refresh_from_db()
+        return round((account.next_sync_at - timezone.now()).total_seconds())
+
+    def test_due_for_sync(self):
+        now = timezone.now()
+        due = [self.account(), self.account(next_sync_at=now - timedelta(minutes=1))]
+        self.account(next_sync_at=now + timedelta(minutes=1))
+        self.account(access_token=None)
+        self.account(sync_status=BankAccount.SYNC_FAILED)
+
+        self.assertEqual(set(BankAccount.objects.due_for_sync()), set(due))
+
+    def test_running_accounts_are_due_again_once_their_lease_runs_out(self):
+        account = self.account()
+        BankAccount.objects.filter(pk=account.pk).mark_running()
+        self.assertFalse(BankAccount.objects.due_for_sync().exists())
+        self.assertEqual(self.delay(account), BankAccount.SYNC_LEASE_SECONDS)
+
+        BankAccount.objects.filter(pk=account.pk).update(next_sync_at=timezone.now())
+        self.assertTrue(BankAccount.objects.due_for_sync().exists())
+
+    def test_accounts_are_claimed_by_one_process_at_a_time(self):
+        first, second = self.account(), self.account()
+        accounts = BankAccount.objects.filter(pk__in=[first.pk, second.pk])
+        BankAccount.objects.filter(pk=second.pk).mark_running()
+
+        # All or nothing: the first account must not be left claimed
+        self.assertFalse(accounts.claim())
+        first.refresh_from_db()
+        self.assertEqual(first.sync_status, BankAccount.SYNC_PENDING)
+
+        BankAccount.objects.filter(pk=second.pk).update(next_sync_at=timezone.now())
+        self.assertTrue(accounts.claim())
+        self.assertFalse(accounts.claim())
+
+    def test_done_resets_attempts_and_schedules_a_refresh(self):
+        account = self.account(sync_attempts=3, last_sync_error='timeout')
+        BankAccount.objects.filter(pk=account.pk).mark_done()
+
+        self.assertEqual(self.delay(account), settings.PLAID_SYNC_REFRESH_INTERVAL)
+        self.assertEqual(
+            (account.sync_status, account.sync_attempts, account.last_sync_error), (BankAccount.SYNC_DONE, 0, '')
+        )
+        self.assertIsNotNone(account.last_synced_at)
+
+    def test_retries_back_off_until_out_of_attempts(self):
+        account = self.account()
+        accounts = BankAccount.objects.filter(pk=account.pk)
+        delays = []
+        for attempts in (1, 2, 3):
+            accounts.mark_retry(attempts, 'timeout')
+            delays.append(self.delay(account))
+        base = BankAccount.SYNC_RETRY_BASE_SECONDS
+        self.assertEqual(delays, [base, base * 2, base * 4])
+        self.assertEqual(account.sync_status, BankAccount.SYNC_PENDING)
+
+        accounts.mark_retry(BankAccount.SYNC_MAX_ATTEMPTS, 'timeout')
+        account.refresh_from_db()
+        self.assertEqual((account.sync_status, account.next_sync_at), (BankAccount.SYNC_FAILED, None))
+        self.assertFalse(BankAccount.objects.due_for_sync().exists())
+
+    def test_not_ready_polls_back_off_until_the_history_is_overdue(self):
+        account = self.account(sync_attempts=2)
+        accounts = BankAccount.objects.filter(pk=account.pk)
+        delays = []
+        for polls in (1, 2, 3, 10):
+            accounts.mark_not_ready(polls, 'not ready')
+            delays.append(self.delay(account))
+        base = BankAccount.SYNC_RETRY_BASE_SECONDS
+        self.assertEqual(delays, [base, base * 2, base * 4, BankAccount.SYNC_RETRY_MAX_SECONDS])
+        self.assertEqual((account.sync_status, account.sync_attempts), (BankAccount.SYNC_PENDING, 2))
+
+        accounts.mark_not_ready(BankAccount.SYNC_MAX_NOT_READY_POLLS, 'not ready')
+        account.refresh_from_db()
+        self.assertEqual((account.sync_status, account.next_sync_at), (BankAccount.SYNC_FAILED, None))
+
+        accounts.mark_done()
+        account.refresh_from_db()
+        self.assertEqual(account.sync_not_ready_polls, 0)
+
+class RequestThrottleTests(TestCase):
+    def test_calls_are_spaced_by_the_interval(self):
+        throttle = RequestThrottle(0.05)
+        started = time.monotonic()
+        for _ in range(3):
+            throttle.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+
+def unavailable():
+    return plaid.ApiException(status=503, reason='Service Unavailable')
+
+
+@override_settings(PLAID_MAX_RETRIES=3, PLAID_RETRY_BACKOFF=0.5, PLAID_RETRY_MAX_BACKOFF=1)
+class PlaidCallTests(StubPlaidTestCase):
+    def setUp(self):
+        patcher = mock.patch('services.plaid.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transient_errors_are_retried_with_jittered_backoff(self):
+        client = self.use_plaid(accounts_get=[
+            unavailable(), plaid.ApiException(status=429, reason='Rate Limited'), {'accounts': []}
+        ])
+        self.assertEqual(PlaidService._call('accounts_get', None).accounts, [])
+
+        self.assertEqual(len(client.calls), 3)
+        delays = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        for delay, bound in zip(delays, [0.5, 1]):
+            self.assertTrue(0 <= delay <= bound)
+        self.assertEqual(
+            {key: PlaidService.stats.snapshot()['accounts_get'][key] for key in ('calls', 'retries', 'errors')},
+            {'calls': 3, 'retries': 2, 'errors': 0}
+        )
+
+    def test_other_errors_are_raised_without_retrying(self):
+        client = self.use_plaid(accounts_get=[plaid.ApiException(status=400, reason='Bad Request')])
+        with self.assertRaises(plaid.ApiException):
+            PlaidService._call('accounts_get', None)
+
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(PlaidService.breaker.failures, 0)
+
+    @override_settings(PLAID_MAX_RETRIES=1)
+    def test_gives_up_after_max_retries(self):
+        client = self.use_plaid(accounts_get=[unavailable(), unavailable(), {'accounts': []}])
+        with self.assertRaises(plaid.ApiException):
+            PlaidService._call('accounts_get', None)
+        self.assertEqual(len(client.calls), 2)
+
+    def test_token_exchange_is_not_retried(self):
+        client = self.use_plaid(item_public_token_exchange=[unavailable(), {'access_token': 'token'}])
+        self.assertEqual(PlaidService.exchange_public_token('public'), {})
+        self.assertEqual(len(client.calls), 1)
+
+    @override_settings(PLAID_MAX_RETRIES=0)
+    def test_open_circuit_skips_calls(self):
+        client = self.use_plaid(accounts_get=[unavailable(), unavailable(), {'accounts': []}])
+        with mock.patch.object(PlaidService, 'breaker', CircuitBreaker(2, 30)):
+            for _ in range(2):
+                with self.assertRaises(plaid.ApiException):
+                    PlaidService._call('accounts_get', None)
+            with self.assertRaises(PlaidUnavailable):
+                PlaidService._call('accounts_get', None)
+
+        self.assertEqual(len(client.calls), 2)
+
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_after_threshold_and_lets_one_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.is_open)
+
+
+class EndpointStatsTests(TestCase):
+    def test_counters_are_consistent_across_threads(self):
+        stats = EndpointStats()
+
+        def record():
+            for i in range(500):
+                stats.record('transactions_sync', 0.1 if i else 0.5, retried=i % 2 == 0, failed=i == 0)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counters = stats.snapshot()['transactions_sync']
+        self.assertEqual((counters['calls'], counters['retries'], counters['errors']), (4000, 2000, 8))
+        self.assertEqual(counters['max_seconds'], 0.5)
+        self.assertAlmostEqual(counters['mean_seconds'], (0.5 + 499 * 0.1) / 500)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
@@ -5,4 +5,5 @@ from . import views
 urlpatterns = [
     path('plaid/token/get/', views.GetLinkTokenView.as_view(), name='create-link-token'),
     path('plaid/token/exchange/', views.ExchangePublicTokenView.as_view(), name='exchange-public-token'),
+    path('sync-status/', views.BankAccountSyncStatusView.as_view(), name='bank-account-sync-status'),
 ]
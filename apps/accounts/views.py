@@ -1,8 +1,17 @@
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView, Response, status
 
+from apps.jobs.models import Job
 from services.plaid import PlaidService
 
+from .jobs import LINK_PLAID_ITEM
+from .models import BankAccount
+from .serializers import BankAccountSyncSerializer
+from .services import access_token_hash
+
 
 class GetLinkTokenView(APIView):
     permission_classes = [IsAuthenticated]
@@ -43,7 +52,40 @@ class ExchangePublicTokenView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-        profile = self.request.user.profile
-        profile.last_plaid_token = access_token
-        profile.save()
-        return Response({'message': '"Successfully exchanged Plaid public token'})
+        # Accounts and transaction history are ingested by `run_jobs`;
+        # clients poll the job for progress
+        with transaction.atomic():
+            profile = self.request.user.profile
+            profile.last_plaid_token = access_token
+            profile.save()
+            job = Job.objects.enqueue(
+                LINK_PLAID_ITEM, user=request.user,
+                # Only a hash: the token itself stays on the profile
+                payload={
+                    'item_id': token_response.get('item_id'),
+                    'token_hash': access_token_hash(access_token),
+                }
+            )
+
+        return Response(
+            {
+                'message': 'Successfully exchanged Plaid public token',
+                'job_id': job.id,
+                'status_url': request.build_absolute_uri(
+                    reverse('api-v1:job-detail', kwargs={'pk': job.id})
+                ),
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class BankAccountSyncStatusView(ListAPIView):
+    """
+    Transaction sync state of the user's bank accounts, for clients to
+    poll while the history of a newly linked item is being fetched.
+    """
+    serializer_class = BankAccountSyncSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return BankAccount.objects.filter(user=self.request.user).order_by('id')
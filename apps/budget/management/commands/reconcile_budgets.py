@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.budget.services import reconcile_budgets
+
+
+class Command(BaseCommand):
+    help = 'Recompute budget actual amounts for a month and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month', type=str,
+            help='Month to reconcile as YYYY-MM (defaults to the current month)'
+        )
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Overwrite drifted budgets with the recomputed amounts'
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('Month must be in YYYY-MM format')
+        else:
+            month = timezone.localdate().replace(day=1)
+
+        drifted = reconcile_budgets(month, fix=options['fix'])
+
+        for budget, actual, expected in drifted:
+            self.stdout.write(
+                f"{budget.user_id} {budget}: stored {actual}, expected {expected} "
+                f"(drift {actual - expected})"
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f"No drift for {month:%B %Y}"))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drifted)} budgets"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} budgets drifted"))
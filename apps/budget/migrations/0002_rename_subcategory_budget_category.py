@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("budget", "0001_initial"),
+        ("categories", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="budget",
+            unique_together=set(),
+        ),
+        migrations.RenameField(
+            model_name="budget",
+            old_name="subcategory",
+            new_name="category",
+        ),
+        migrations.AlterField(
+            model_name="budget",
+            name="category",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="budgets",
+                to="categories.category",
+            ),
+        ),
+        migrations.AlterModelOptions(
+            name="budget",
+            options={"ordering": ["-month", "category__name"]},
+        ),
+        migrations.AlterUniqueTogether(
+            name="budget",
+            unique_together={("user", "category", "month")},
+        ),
+    ]
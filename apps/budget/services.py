@@ -0,0 +1,175 @@
+from collections import Counter
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from apps.transactions.models import BankTransaction, StoreItem
+
+from .models import Budget
+
+
+def month_start(value) -> date:
+    """First day of the month a transaction datetime falls in"""
+    if isinstance(value, datetime):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+        value = value.date()
+    return value.replace(day=1)
+
+
+def month_range(month: date) -> tuple[datetime, datetime]:
+    start = timezone.make_aware(datetime.combine(month_start(month), time.min))
+    return start, start + relativedelta(months=1)
+
+
+def transaction_contributions(transaction, amount=None, transaction_date=None) -> Counter:
+    """
+    Amounts a bank transaction adds to each (category, month) budget.
+    Every subcategory counts, matching the category join used by
+    `compute_actual_amounts`.
+    """
+    contributions = Counter()
+    amount = transaction.amount if amount is None else amount
+    month = month_start(transaction.transaction_date if transaction_date is None else transaction_date)
+    for category_id in transaction.subcategories.values_list('category_id', flat=True):
+        contributions[(category_id, month)] += amount
+    return contributions
+
+
+def item_contributions(item, total_amount=None, transaction_date=None) -> Counter:
+    """
+    Amounts a store item adds to each (category, month) budget.
+    Store transactions are budgeted per item, as each item has its own categories.
+    """
+    contributions = Counter()
+    total_amount = item.total_amount if total_amount is None else total_amount
+    month = month_start(
+        item.transaction.transaction_date if transaction_date is None else transaction_date
+    )
+    for category_id in item.subcategories.values_list('category_id', flat=True):
+        contributions[(category_id, month)] += total_amount
+    return contributions
+
+
+def store_contributions(transaction, transaction_date=None) -> Counter:
+    contributions = Counter()
+    month = month_start(transaction.transaction_date if transaction_date is None else transaction_date)
+    for total_amount, category_id in StoreItem.objects.filter(
+        transaction=transaction, subcategories__isnull=False
+    ).values_list('total_amount', 'subcategories__category_id'):
+        contributions[(category_id, month)] += total_amount
+    return contributions
+
+
+def apply_budget_changes(user_id, before: Counter, after: Counter):
+    """
+    Move budget actual amounts from `before` to `after` contributions.
+    Only the differences are written, as atomic F() increments.
+    """
+    for key in before.keys() | after.keys():
+        delta = after.get(key, 0) - before.get(key, 0)
+        if not delta:
+            continue
+        category_id, month = key
+        Budget.objects.filter(
+            user_id=user_id, category_id=category_id, month=month
+        ).update(actual_amount=F('actual_amount') + delta)
+
+
+def compute_actual_amounts(months, users=None) -> Counter:
+    """
+    Total spending per (user, category, month) over the given months, from
+    one grouped aggregate over bank transactions and one over store items.
+    """
+    months = sorted({month_start(month) for month in months})
+    start, end = month_range(months[0])[0], month_range(months[-1])[1]
+    transaction_month = TruncMonth('transaction_date', output_field=DateField())
+
+    bank_transactions = BankTransaction.objects.filter(
+        transaction_date__gte=start, transaction_date__lt=end,
+        subcategories__isnull=False
+    )
+    store_items = StoreItem.objects.filter(
+        transaction__transaction_date__gte=start, transaction__transaction_date__lt=end,
+        subcategories__isnull=False
+    )
+    if users is not None:
+        bank_transactions = bank_transactions.filter(user__in=users)
+        store_items = store_items.filter(transaction__user__in=users)
+
+    totals = Counter()
+    for row in bank_transactions.annotate(month=transaction_month) \
+            .values('user_id', 'subcategories__category_id', 'month') \
+            .annotate(total=Sum('amount')).order_by():
+        totals[(row['user_id'], row['subcategories__category_id'], row['month'])] += row['total']
+
+    for row in store_items.annotate(month=TruncMonth(
+                'transaction__transaction_date', output_field=DateField()
+            )) \
+            .values('transaction__user_id', 'subcategories__category_id', 'month') \
+            .annotate(total=Sum('total_amount')).order_by():
+        totals[(
+            row['transaction__user_id'], row['subcategories__category_id'], row['month']
+        )] += row['total']
+
+    return totals
+
+
+def _refresh_budgets(budgets, totals: Counter, fix: bool) -> list[tuple[Budget, Decimal, Decimal]]:
+    drifted = []
+    for budget in budgets:
+        expected = totals.get((budget.user_id, budget.category_id, budget.month), Decimal('0'))
+        if budget.actual_amount != expected:
+            drifted.append((budget, budget.actual_amount, expected))
+
+    if fix and drifted:
+        for budget, _, expected in drifted:
+            budget.actual_amount = expected
+        Budget.objects.bulk_update(
+            [budget for budget, *_ in drifted], ['actual_amount'], batch_size=500
+        )
+
+    return drifted
+
+
+def reconcile_budgets(month: date, users=None, fix=False) -> list[tuple[Budget, Decimal, Decimal]]:
+    """
+    Recompute every budget for a month and return the ones that drifted
+    as (budget, stored amount, expected amount). With `fix`, store the
+    expected amounts.
+    """
+    month = month_start(month)
+    budgets = Budget.objects.filter(month=month).select_related('category')
+    if users is not None:
+        budgets = budgets.filter(user__in=users)
+
+    return _refresh_budgets(budgets, compute_actual_amounts([month], users), fix)
+
+
+def recompute_budgets(transactions) -> list[Budget]:
+    """
+    Bring budgets in line after a bulk write of transactions, which skips the
+    per-row signals. Every affected (user, month) is recomputed with the same
+    grouped aggregates and the changed budgets are saved with one bulk_update.
+    """
+    affected = {
+        (transaction.user_id, month_start(transaction.transaction_date))
+        for transaction in transactions
+    }
+    if not affected:
+        return []
+
+    users = {user_id for user_id, _ in affected}
+    months = {month for _, month in affected}
+    budgets = [
+        budget for budget in Budget.objects.filter(user__in=users, month__in=months)
+        if (budget.user_id, budget.month) in affected
+    ]
+    if not budgets:
+        return []
+
+    drifted = _refresh_budgets(budgets, compute_actual_amounts(months, users), fix=True)
+    return [budget for budget, *_ in drifted]
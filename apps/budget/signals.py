@@ -1,46 +1,97 @@
-from django.db.models import Sum
-from django.db.models.signals import post_delete, post_save
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from apps.transactions.models import BankTransaction, StoreTransaction
+from apps.transactions.models import BankTransaction, StoreItem, StoreTransaction
+
+from .services import (apply_budget_changes, item_contributions,
+                       store_contributions, transaction_contributions)
+
+
+@receiver(post_save, sender=BankTransaction)
+def bank_transaction_saved(sender, instance, created, **kwargs):
+    """Apply the change in amount or month of an existing transaction"""
+    if created:
+        # New transactions have no subcategories yet; they count once added
+        return
+    # The tracker also follows fields the budget ignores, such as the merchant
+    if not (instance.tracker.has_changed('amount') or instance.tracker.has_changed('transaction_date')):
+        return
+
+    before = transaction_contributions(
+        instance,
+        amount=instance.tracker.previous('amount'),
+        transaction_date=instance.tracker.previous('transaction_date')
+    )
+    apply_budget_changes(instance.user_id, before, transaction_contributions(instance))
+
 
-from .models import Budget
+@receiver(post_save, sender=StoreTransaction)
+def store_transaction_saved(sender, instance, created, **kwargs):
+    """Move item amounts between months when the transaction date changes"""
+    if created or not instance.tracker.has_changed('transaction_date'):
+        return
 
+    before = store_contributions(
+        instance, transaction_date=instance.tracker.previous('transaction_date')
+    )
+    apply_budget_changes(instance.user_id, before, store_contributions(instance))
 
-def update_budget_actual_amount(transaction):
-    """Update the actual amount for the budget based on transactions"""
-    # Get the first day of the transaction's month
-    transaction_month = transaction.transaction_date.replace(day=1)
 
-    # Find the corresponding budget
-    budget = Budget.objects.get(
-        user=transaction.user,
-        category=transaction.subcategories.first().category,  # Get the first subcategory
-        month=transaction_month
+@receiver(post_save, sender=StoreItem)
+def store_item_saved(sender, instance, created, **kwargs):
+    if created or not instance.tracker.has_changed('total_amount'):
+        return
+
+    before = item_contributions(instance, total_amount=instance.tracker.previous('total_amount'))
+    apply_budget_changes(
+        instance.transaction.user_id, before, item_contributions(instance)
     )
 
-    # Calculate total transactions for this category in this month
-    bank_total = BankTransaction.objects.filter(
-        user=transaction.user,
-        subcategories__category=budget.category,
-        transaction_date__year=transaction.transaction_date.year,
-        transaction_date__month=transaction.transaction_date.month
-    ).aggregate(total=Sum('amount'))['total'] or 0
-
-    store_total = StoreTransaction.objects.filter(
-        user=transaction.user,
-        subcategories__category=budget.category,
-        transaction_date__year=transaction.transaction_date.year,
-        transaction_date__month=transaction.transaction_date.month
-    ).aggregate(total=Sum('amount'))['total'] or 0
-
-    # Update the budget's actual amount
-    budget.actual_amount = bank_total + store_total
-    budget.save()
-
-
-@receiver([post_save, post_delete], sender=BankTransaction)
-@receiver([post_save, post_delete], sender=StoreTransaction)
-def transaction_changed(sender, instance, **kwargs):
-    """Handle transaction creation, updates, and deletion"""
-    update_budget_actual_amount(instance)
+
+@receiver(pre_delete, sender=BankTransaction)
+def bank_transaction_deleting(sender, instance, **kwargs):
+    # Categories are gone once the through rows cascade, so capture them first
+    instance._budget_contributions = transaction_contributions(instance)
+
+
+@receiver(pre_delete, sender=StoreItem)
+def store_item_deleting(sender, instance, **kwargs):
+    instance._budget_contributions = item_contributions(instance)
+    instance._budget_user_id = instance.transaction.user_id
+
+
+@receiver(post_delete, sender=BankTransaction)
+def bank_transaction_deleted(sender, instance, **kwargs):
+    apply_budget_changes(instance.user_id, instance._budget_contributions, Counter())
+
+
+@receiver(post_delete, sender=StoreItem)
+def store_item_deleted(sender, instance, **kwargs):
+    apply_budget_changes(instance._budget_user_id, instance._budget_contributions, Counter())
+
+
+@receiver(m2m_changed, sender=BankTransaction.subcategories.through)
+@receiver(m2m_changed, sender=StoreItem.subcategories.through)
+def categories_changed(sender, instance, action, reverse, **kwargs):
+    """Shift amounts between category budgets when categories are (re)assigned"""
+    if reverse:
+        # Changes made from the subcategory side are picked up by reconcile_budgets
+        return
+
+    if isinstance(instance, StoreItem):
+        contributions = item_contributions
+        user_id = instance.transaction.user_id
+    else:
+        contributions = transaction_contributions
+        user_id = instance.user_id
+
+    if action.startswith('pre_'):
+        instance._budget_contributions = contributions(instance)
+    elif action.startswith('post_'):
+        apply_budget_changes(
+            user_id,
+            getattr(instance, '_budget_contributions', Counter()),
+            contributions(instance)
+        )
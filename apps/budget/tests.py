@@ -1,3 +1,202 @@
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+
+from apps.accounts.models import BankAccount
+from apps.categories.models import Category, SubCategory
+from apps.transactions.models import BankTransaction, StoreItem, StoreTransaction
+
+from .models import Budget
+from .services import reconcile_budgets, recompute_budgets
+
+MARCH = date(2025, 3, 1)
+FEBRUARY = date(2025, 2, 1)
+
+
+def on(month: date):
+    return timezone.make_aware(datetime(month.year, month.month, 15, 12))
+
+
+class BudgetDeltaTests(TestCase):
+    """Each change is checked against a full recompute of the same budgets"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='budgeter')
+        cls.bank_account = BankAccount.objects.create(
+            user=cls.user, name='Checking', account_id='budget-account'
+        )
+        cls.food = Category.objects.create(name='test food')
+        cls.travel = Category.objects.create(name='test travel')
+        cls.groceries = SubCategory.objects.create(name='test groceries', category=cls.food)
+        cls.flights = SubCategory.objects.create(name='test flights', category=cls.travel)
+        for month in (FEBRUARY, MARCH):
+            for category in (cls.food, cls.travel):
+                Budget.objects.create(
+                    user=cls.user, category=category, month=month, planned_amount=Decimal('500')
+                )
+
+    def actual(self, category, month=MARCH) -> Decimal:
+        return Budget.objects.get(user=self.user, category=category, month=month).actual_amount
+
+    def assertMatchesRecompute(self):
+        for month in (FEBRUARY, MARCH):
+            self.assertEqual(reconcile_budgets(month), [])
+
+    def bank_transaction(self, amount='20.00', subcategory=None) -> BankTransaction:
+        transaction = BankTransaction.objects.create(
+            user=self.user, bank_account=self.bank_account, merchant='Market',
+            amount=Decimal(amount), transaction_date=on(MARCH)
+        )
+        transaction.subcategories.add(subcategory or self.groceries)
+        return transaction
+
+    def store_item(self, quantity=2, unit_price='5.00') -> StoreItem:
+        transaction = StoreTransaction.objects.create(
+            user=self.user, merchant='Market', transaction_date=on(MARCH), amount=0
+        )
+        item = StoreItem.objects.create(
+            transaction=transaction, name='Apples', quantity=quantity, unit_price=Decimal(unit_price)
+        )
+        item.subcategories.add(self.groceries)
+        return item
+
+    def test_created_transaction_counts_once_categorised(self):
+        self.bank_transaction()
+
+        self.assertEqual(self.actual(self.food), Decimal('20.00'))
+        self.assertMatchesRecompute()
+
+    def test_amount_change_applies_the_difference(self):
+        transaction = self.bank_transaction()
+        transaction.amount = Decimal('35.00')
+        transaction.save()
+
+        self.assertEqual(self.actual(self.food), Decimal('35.00'))
+        self.assertMatchesRecompute()
+
+    def test_merchant_change_leaves_the_budgets_alone(self):
+        transaction = self.bank_transaction()
+        transaction.merchant = 'Farmers Market'
+        with mock.patch('apps.budget.signals.transaction_contributions') as contributions:
+            transaction.save()
+
+        contributions.assert_not_called()
+        self.assertEqual(self.actual(self.food), Decimal('20.00'))
+
+    def test_category_change_moves_the_amount(self):
+        transaction = self.bank_transaction()
+        transaction.subcategories.set([self.flights])
+
+        self.assertEqual(self.actual(self.food), 0)
+        self.assertEqual(self.actual(self.travel), Decimal('20.00'))
+        self.assertMatchesRecompute()
+
+        transaction.subcategories.clear()
+        self.assertEqual(self.actual(self.travel), 0)
+        self.assertMatchesRecompute()
+
+    def test_month_change_moves_the_amount(self):
+        transaction = self.bank_transaction()
+        transaction.transaction_date = on(FEBRUARY)
+        transaction.save()
+
+        self.assertEqual(self.actual(self.food), 0)
+        self.assertEqual(self.actual(self.food, FEBRUARY), Decimal('20.00'))
+        self.assertMatchesRecompute()
+
+    def test_delete_removes_the_amount(self):
+        self.bank_transaction().delete()
+
+        self.assertEqual(self.actual(self.food), 0)
+        self.assertMatchesRecompute()
+
+    def test_store_items_are_budgeted_per_item(self):
+        item = self.store_item()
+        self.assertEqual(self.actual(self.food), Decimal('10.00'))
+        self.assertMatchesRecompute()
+
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.actual(self.food), Decimal('15.00'))
+        self.assertMatchesRecompute()
+
+        item.transaction.transaction_date = on(FEBRUARY)
+        item.transaction.save()
+        self.assertEqual(self.actual(self.food, FEBRUARY), Decimal('15.00'))
+        self.assertEqual(self.actual(self.food), 0)
+        self.assertMatchesRecompute()
+
+        item.delete()
+        self.assertEqual(self.actual(self.food, FEBRUARY), 0)
+        self.assertMatchesRecompute()
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        self.bank_transaction()
+        Budget.objects.filter(category=self.food, month=MARCH).update(actual_amount=Decimal('99'))
+
+        drifted = reconcile_budgets(MARCH)
+        self.assertEqual(
+            [(budget.category, stored, expected) for budget, stored, expected in drifted],
+            [(self.food, Decimal('99.00'), Decimal('20.00'))]
+        )
+        self.assertEqual(self.actual(self.food), Decimal('99.00'))
+
+        reconcile_budgets(MARCH, fix=True)
+        self.assertEqual(self.actual(self.food), Decimal('20.00'))
+        self.assertMatchesRecompute()
+
+
+class RecomputeBudgetsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='test food')
+        cls.groceries = SubCategory.objects.create(name='test groceries', category=cls.food)
+        cls.users = [get_user_model().objects.create(username=f'bulk-{i}') for i in range(2)]
+        cls.bank_accounts = [
+            BankAccount.objects.create(user=user, name='Checking', account_id=f'bulk-{user.id}')
+            for user in cls.users
+        ]
+
+    def bulk_create(self, user_index, month, amounts):
+        transactions = BankTransaction.objects.bulk_create([
+            BankTransaction(
+                user=self.users[user_index], bank_account=self.bank_accounts[user_index],
+                amount=Decimal(amount), transaction_date=on(month)
+            )
+            for amount in amounts
+        ])
+        BankTransaction.subcategories.through.objects.bulk_create([
+            BankTransaction.subcategories.through(
+                banktransaction_id=transaction.id, subcategory_id=self.groceries.id
+            )
+            for transaction in transactions
+        ])
+        return transactions
+
+    def test_only_affected_budgets_are_updated_in_fixed_queries(self):
+        budgets = {
+            (user_index, month): Budget.objects.create(
+                user=self.users[user_index], category=self.food, month=month, planned_amount=Decimal('500')
+            )
+            for user_index in range(2) for month in (FEBRUARY, MARCH)
+        }
+        transactions = self.bulk_create(0, MARCH, ['10', '15']) \
+            + self.bulk_create(0, FEBRUARY, ['7']) + self.bulk_create(1, MARCH, ['4'])
+        # Written without the signals; recompute_budgets must leave it alone
+        self.bulk_create(1, FEBRUARY, ['30'])
+
+        # The budgets, one aggregate per transaction type and one bulk update
+        with self.assertNumQueries(4):
+            updated = recompute_budgets(transactions)
 
-# Create your tests here.
+        self.assertEqual(len(updated), 3)
+        actual = {key: Budget.objects.get(pk=budget.pk).actual_amount for key, budget in budgets.items()}
+        self.assertEqual(actual, {
+            (0, FEBRUARY): Decimal('7.00'), (0, MARCH): Decimal('25.00'),
+            (1, FEBRUARY): Decimal('0.00'), (1, MARCH): Decimal('4.00'),
+        })
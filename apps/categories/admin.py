@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Category, SubCategory
+from .models import Category, PlaidCategoryMapping, SubCategory
 
 
 @admin.register(Category)
@@ -38,3 +38,11 @@ class CategoryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(PlaidCategoryMapping)
+class PlaidCategoryMappingAdmin(admin.ModelAdmin):
+    list_display = ('plaid_code', 'subcategory')
+    search_fields = ('plaid_code', 'subcategory__name')
+    autocomplete_fields = ('subcategory',)
+    readonly_fields = ('created_at', 'updated_at')
@@ -1,9 +1,12 @@
 import csv
+import time
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Q
 
-from apps.categories.models import Category, SubCategory
+from apps.categories.models import Category, PlaidCategoryMapping, SubCategory
+from apps.categories.services import clear_category_cache
 
 
 class Command(BaseCommand):
@@ -11,6 +14,14 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='Path to the CSV file')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Print the changes the import would make without writing them'
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Remove subcategories and Plaid mappings that are no longer in the file'
+        )
 
     def _normalize_name(self, name):
         """Convert names to a consistent format"""
@@ -22,45 +33,178 @@ class Command(BaseCommand):
         detailed_words = self._normalize_name(detailed_category).split()
         return " ".join(detailed_words[len(primary_words):])
 
-    @transaction.atomic
-    def handle(self, *args, **options):
-        csv_file_path = options['csv_file']
-        
-        # Read CSV and process data
+    def _read_rows(self, csv_file_path):
+        """
+        Parse the file once into (category, subcategory, plaid code, description)
+        rows. A Plaid code listed twice keeps its last row.
+        """
         with open(csv_file_path, 'r') as csvfile:
             reader = csv.reader(csvfile)
             next(reader)  # Skip header
-
-            # Collect and create primary categories
-            unique_categories = set(
-                self._normalize_name(row[0]) for row in reader
-            )
-
-            # Create primary categories
-            for cat_name in unique_categories:
-                Category.objects.get_or_create(name=cat_name)
-
-            # Reset file reader
-            csvfile.seek(0)
-            next(reader)  # Skip header again
-
-            # Create subcategories
-            for row in reader:
-                primary_category = self._normalize_name(row[0])
-                detailed_category = row[1]
-                description = row[2]
-
-                # Get primary category
-                primary_cat_obj = Category.objects.get(name=primary_category)
-
-                # Extract and normalize subcategory name
-                subcategory_name = self._extract_subcategory_name(row[0], detailed_category)
-
-                # Create subcategory
-                SubCategory.objects.get_or_create(
-                    category=primary_cat_obj,
-                    name=subcategory_name,
-                    defaults={'description': description}
+            rows = {
+                row[1]: (
+                    self._normalize_name(row[0]),
+                    self._extract_subcategory_name(row[0], row[1]),
+                    row[1],
+                    row[2],
                 )
+                for row in reader if row
+            }
+        return list(rows.values())
 
-        self.stdout.write(self.style.SUCCESS('Successfully imported categories'))
\ No newline at end of file
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.dry_run = options['dry_run']
+        started = time.perf_counter()
+        rows = self._read_rows(options['csv_file'])
+        parsed = time.perf_counter()
+
+        with transaction.atomic():
+            counts = {
+                'categories': self._import_categories(rows),
+                'subcategories': self._import_subcategories(rows),
+                'plaid mappings': self._import_mappings(rows),
+            }
+            if options['prune']:
+                self._prune(rows, counts)
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            else:
+                # Bulk writes skip the model signals that invalidate the cache
+                transaction.on_commit(clear_category_cache)
+        finished = time.perf_counter()
+
+        for table, table_counts in counts.items():
+            self.stdout.write(
+                f"{table}: " + ", ".join(f"{count} {action}" for action, count in table_counts.items())
+            )
+        self.stdout.write(
+            f"Read {len(rows)} rows in {parsed - started:.3f}s, "
+            f"{'planned' if options['dry_run'] else 'wrote'} changes in {finished - parsed:.3f}s"
+        )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, no changes were saved'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Successfully imported categories'))
+
+    def _report(self, symbol, description):
+        if self.verbosity > 1 or self.dry_run:
+            self.stdout.write(f"  {symbol} {description}")
+
+    def _import_categories(self, rows) -> dict:
+        names = {category for category, *_ in rows}
+        existing = set(Category.objects.filter(name__in=names).values_list('name', flat=True))
+        missing = sorted(names - existing)
+        for name in missing:
+            self._report('+', f"category {name}")
+
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        self.categories = {category.name: category for category in Category.objects.filter(name__in=names)}
+        return {'inserted': len(missing), 'updated': 0, 'unchanged': len(existing)}
+
+    def _import_subcategories(self, rows) -> dict:
+        existing = {
+            (subcategory.category_id, subcategory.name): subcategory
+            for subcategory in SubCategory.objects.filter(category__in=self.categories.values())
+        }
+
+        seen, to_write = set(), {}
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for category_name, name, _, description in rows:
+            category = self.categories[category_name]
+            key = (category.id, name)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            if not (subcategory := existing.get(key)):
+                counts['inserted'] += 1
+                self._report('+', f"subcategory {name} ({category_name})")
+            elif subcategory.description != description:
+                counts['updated'] += 1
+                self._report('~', f"subcategory {name} ({category_name}) description")
+            else:
+                counts['unchanged'] += 1
+                continue
+            to_write[key] = SubCategory(category=category, name=name, description=description)
+
+        SubCategory.objects.bulk_create(
+            to_write.values(),
+            update_conflicts=True,
+            unique_fields=['name', 'category'],
+            update_fields=['description', 'updated_at'],
+        )
+        self.subcategories = {
+            (subcategory.category_id, subcategory.name): subcategory
+            for subcategory in SubCategory.objects.filter(category__in=self.categories.values())
+        }
+        return counts
+
+    def _import_mappings(self, rows) -> dict:
+        existing = dict(
+            PlaidCategoryMapping.objects.filter(plaid_code__in=[row[2] for row in rows])
+            .values_list('plaid_code', 'subcategory_id')
+        )
+
+        to_write, counts = [], {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for category_name, name, plaid_code, _ in rows:
+            subcategory = self.subcategories[(self.categories[category_name].id, name)]
+            if plaid_code not in existing:
+                counts['inserted'] += 1
+                self._report('+', f"mapping {plaid_code} -> {name}")
+            elif existing[plaid_code] != subcategory.id:
+                counts['updated'] += 1
+                self._report('~', f"mapping {plaid_code} -> {name}")
+            else:
+                counts['unchanged'] += 1
+                continue
+
+            to_write.append(PlaidCategoryMapping(plaid_code=plaid_code, subcategory=subcategory))
+
+        PlaidCategoryMapping.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=['plaid_code'],
+            update_fields=['subcategory', 'updated_at'],
+        )
+        return counts
+
+    def _prune(self, rows, counts):
+        """
+        Delete mappings and subcategories missing from the file. Subcategories
+        still attached to transactions are deactivated instead, so no
+        transaction loses its category. Primary categories are never removed.
+        """
+        stale_mappings = PlaidCategoryMapping.objects.exclude(plaid_code__in=[row[2] for row in rows])
+        for plaid_code in stale_mappings.values_list('plaid_code', flat=True):
+            self._report('-', f"mapping {plaid_code}")
+        counts['plaid mappings']['deleted'] = stale_mappings.delete()[0]
+
+        keep = [
+            self.subcategories[(self.categories[category_name].id, name)].id
+            for category_name, name, *_ in rows
+        ]
+        stale = SubCategory.objects.exclude(pk__in=keep).select_related('category')
+        in_use = set(
+            stale.filter(
+                Q(banktransaction__isnull=False) | Q(manualtransaction__isnull=False) |
+                Q(store_items__isnull=False)
+            ).values_list('id', flat=True)
+        )
+        to_delete, to_deactivate = [], []
+        for subcategory in stale:
+            if subcategory.id in in_use:
+                if subcategory.is_active:
+                    to_deactivate.append(subcategory.id)
+                    self._report('~', f"subcategory {subcategory} deactivated (in use)")
+            else:
+                to_delete.append(subcategory.id)
+                self._report('-', f"subcategory {subcategory}")
+
+        counts['subcategories']['deactivated'] = SubCategory.objects.filter(
+            id__in=to_deactivate
+        ).update(is_active=False)
+        SubCategory.objects.filter(id__in=to_delete).delete()
+        counts['subcategories']['deleted'] = len(to_delete)
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+from django.db import migrations
+
+
+def backfill_plaid_mappings(apps, schema_editor):
+    """
+    Rebuild the Plaid codes of subcategories imported before mappings were
+    stored. `import_categories` names them by lowercasing the code and
+    dropping the primary category words, which this reverses.
+    """
+    SubCategory = apps.get_model("categories", "SubCategory")
+    PlaidCategoryMapping = apps.get_model("categories", "PlaidCategoryMapping")
+
+    mappings = {}
+    for subcategory in SubCategory.objects.select_related("category"):
+        code = f"{subcategory.category.name} {subcategory.name}".upper().replace(" ", "_")
+        mappings.setdefault(code, subcategory)
+
+    PlaidCategoryMapping.objects.bulk_create(
+        [
+            PlaidCategoryMapping(plaid_code=code, subcategory=subcategory)
+            for code, subcategory in mappings.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categories", "0002_plaidcategorymapping"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_plaid_mappings, migrations.RunPython.noop),
+    ]
@@ -51,3 +51,23 @@ class SubCategory(TimestampedModel):
 
     def __str__(self):
         return f"{self.name} ({self.category})"
+
+
+class PlaidCategoryMapping(TimestampedModel):
+    """
+    Maps a Plaid `personal_finance_category.detailed` code
+    (e.g. "FOOD_AND_DRINK_GROCERIES") to its SubCategory.
+    Built by `import_categories`.
+    """
+    plaid_code = models.CharField(max_length=100, unique=True)
+    subcategory = models.ForeignKey(
+        SubCategory,
+        on_delete=models.CASCADE,
+        related_name='plaid_mappings',
+    )
+
+    class Meta:
+        ordering = ['plaid_code']
+
+    def __str__(self):
+        return f"{self.plaid_code} -> {self.subcategory}"
@@ -0,0 +1,128 @@
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Category, PlaidCategoryMapping, SubCategory
+
+CACHE_VERSION_KEY = 'categories:version'
+
+
+class CategoryTree:
+    """Read-only snapshot of the category taxonomy, indexed for lookups"""
+
+    def __init__(self):
+        self.categories = {category.id: category for category in Category.objects.all()}
+        self.subcategories = {}
+        self.subcategories_by_name = {}
+        for subcategory in SubCategory.objects.all():
+            # Share the cached category instead of fetching it per subcategory
+            subcategory.category = self.categories[subcategory.category_id]
+            self.subcategories[subcategory.id] = subcategory
+            self.subcategories_by_name.setdefault(subcategory.name.lower(), []).append(subcategory)
+        self.plaid_subcategory_ids = dict(
+            PlaidCategoryMapping.objects.values_list('plaid_code', 'subcategory_id')
+        )
+
+
+_lock = threading.Lock()
+_tree: Optional[CategoryTree] = None
+_tree_version = None
+_checked_at = 0.0
+
+
+def _current_version() -> int:
+    if (version := cache.get(CACHE_VERSION_KEY)) is None:
+        cache.add(CACHE_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CACHE_VERSION_KEY, 1)
+    return version
+
+
+def get_tree() -> CategoryTree:
+    """
+    The category tree, loaded once per process. The shared version key is
+    checked at most every `CATEGORY_CACHE_CHECK_INTERVAL` seconds, so a
+    change made by another worker is picked up within that interval.
+    """
+    global _tree, _tree_version, _checked_at
+    now = time.monotonic()
+    if _tree is not None and now - _checked_at < settings.CATEGORY_CACHE_CHECK_INTERVAL:
+        return _tree
+
+    with _lock:
+        version = _current_version()
+        if _tree is None or version != _tree_version:
+            _tree = CategoryTree()
+            _tree_version = version
+        _checked_at = now
+        return _tree
+
+
+def clear_category_cache():
+    """Make every process reload the category tree"""
+    global _tree
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.add(CACHE_VERSION_KEY, 1, timeout=None)
+    with _lock:
+        _tree = None
+
+
+def plaid_subcategory_ids() -> dict[str, int]:
+    """Plaid detailed category code -> SubCategory id"""
+    return get_tree().plaid_subcategory_ids
+
+
+def subcategory_names() -> list[str]:
+    return sorted({subcategory.name for subcategory in get_tree().subcategories.values()})
+
+
+def subcategory_choices() -> list[str]:
+    """Every subcategory as `name (category)`, which tells duplicate names apart"""
+    return sorted(
+        f"{subcategory.name} ({subcategory.category.name})"
+        for subcategory in get_tree().subcategories.values()
+    )
+
+
+def get_subcategory(subcategory_id: int) -> Optional[SubCategory]:
+    return get_tree().subcategories.get(subcategory_id)
+
+
+def get_category(category_id: int) -> Optional[Category]:
+    return get_tree().categories.get(category_id)
+
+
+def find_subcategories(name: str, category_name: str = None) -> list[SubCategory]:
+    """
+    Every subcategory with this name, case-insensitively, in category order.
+    Names are only unique within a category, so pass `category_name` to
+    narrow the matches to that category.
+    """
+    matches = get_tree().subcategories_by_name.get(name.lower(), [])
+    if category_name is not None:
+        matches = [
+            subcategory for subcategory in matches
+            if subcategory.category.name.lower() == category_name.lower()
+        ]
+    return matches
+
+
+def find_subcategory(name: str, category_name: str = None) -> Optional[SubCategory]:
+    """
+    Look a subcategory up by name, case-insensitively. Names are only unique
+    within a category, so pass `category_name` to pick between duplicates;
+    otherwise the first match in category order is returned.
+    """
+    matches = find_subcategories(name, category_name)
+    return matches[0] if matches else None
+
+
+def is_expense(subcategory_id: int) -> bool:
+    """Whether a subcategory's category counts as spending (unknown ids do)"""
+    if subcategory := get_subcategory(subcategory_id):
+        return subcategory.category.is_expense
+    return True
@@ -1,15 +1,33 @@
 import logging
+import os
 
 from django.core.management import call_command
-from django.db.models.signals import post_migrate
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from .models import SubCategory
+
+from .models import Category, PlaidCategoryMapping, SubCategory
+from .services import clear_category_cache
 
 logger = logging.getLogger(__name__)
 
+SEED_FILE = "./seed_file.csv"
+
 
 @receiver(post_migrate)
 def run_on_migrate(sender, **kwargs):
     if sender.name == "apps.categories" and not SubCategory.objects.exists():
+        if not os.path.exists(SEED_FILE):
+            logger.warning(f"Seed file {SEED_FILE} not found. Skipping category import.")
+            return
         logger.info("SubCategory table is empty. Importing categories from seed file.")
-        call_command("import_categories", "./seed_file.csv")
+        call_command("import_categories", SEED_FILE)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver([post_save, post_delete], sender=PlaidCategoryMapping)
+def invalidate_category_cache(sender, *args, **kwargs):
+    clear_category_cache()
+    # Again once committed, in case another process reloaded the old rows meanwhile
+    transaction.on_commit(clear_category_cache)
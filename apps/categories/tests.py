@@ -1,3 +1,85 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import services
+from .models import Category, PlaidCategoryMapping, SubCategory
+
+
+class CategoryCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.income = Category.objects.create(name='test income', is_expense=False)
+        cls.food = Category.objects.create(name='test food')
+        cls.wages = SubCategory.objects.create(name='test other', category=cls.income)
+        cls.snacks = SubCategory.objects.create(name='test other', category=cls.food)
+
+    def test_lookups_run_no_queries_once_loaded(self):
+        services.get_tree()
+        with self.assertNumQueries(0):
+            self.assertEqual(services.get_subcategory(self.snacks.id), self.snacks)
+            self.assertEqual(services.get_category(self.food.id), self.food)
+            self.assertEqual(services.find_subcategory('Test Other', 'test food'), self.snacks)
+            self.assertFalse(services.is_expense(self.wages.id))
+            self.assertTrue(services.is_expense(self.snacks.id))
+            self.assertIn('test other', services.subcategory_names())
+
+    def test_saving_a_category_reloads_the_tree(self):
+        services.get_tree()
+        self.food.is_expense = False
+        self.food.save()
+
+        self.assertFalse(services.is_expense(self.snacks.id))
+
+    @override_settings(CATEGORY_CACHE_CHECK_INTERVAL=0)
+    def test_version_bump_from_another_process_reloads_the_tree(self):
+        tree = services.get_tree()
+        self.assertIs(services.get_tree(), tree)
+
+        cache.incr(services.CACHE_VERSION_KEY)
+        self.assertIsNot(services.get_tree(), tree)
+
+
+class ImportCategoriesTests(TestCase):
+    def write_csv(self, categories, per_category, description='Imported'):
+        csv_file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        # Cleanups run last-in first-out, so the file is closed before removal
+        self.addCleanup(os.unlink, csv_file.name)
+        self.addCleanup(csv_file.close)
+        csv_file.write('PRIMARY,DETAILED,DESCRIPTION\n')
+        for i in range(categories):
+            for j in range(per_category):
+                csv_file.write(f'IMPORT_{i},IMPORT_{i}_ITEM_{j},{description}\n')
+        csv_file.flush()
+        return csv_file.name
+
+    def import_categories(self, path, *args):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_categories', path, *args, stdout=out)
+        return out.getvalue(), len(queries)
+
+    def test_queries_do_not_grow_with_the_file(self):
+        _, small = self.import_categories(self.write_csv(2, 3))
+        # Kept within one insert batch, which SQLite caps at 999 parameters
+        _, large = self.import_categories(self.write_csv(10, 10))
+
+        self.assertEqual(small, large)
+        self.assertEqual(PlaidCategoryMapping.objects.filter(plaid_code__startswith='IMPORT_').count(), 100)
+
+    def test_reimport_is_idempotent_and_dry_run_writes_nothing(self):
+        path = self.write_csv(2, 3)
+        self.import_categories(path)
+
+        output, _ = self.import_categories(path)
+        self.assertIn('subcategories: 0 inserted, 0 updated, 6 unchanged', output)
+
+        output, _ = self.import_categories(self.write_csv(2, 3, 'Changed'), '--dry-run')
+        self.assertIn('subcategories: 0 inserted, 6 updated, 0 unchanged', output)
+        self.assertFalse(SubCategory.objects.filter(description='Changed').exists())
@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'user', 'status', 'attempts', 'available_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('user__username', 'kind')
+    readonly_fields = ('created_at', 'updated_at', 'started_at', 'finished_at')
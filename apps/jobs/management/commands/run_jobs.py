@@ -0,0 +1,51 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.jobs.models import Job
+from apps.jobs.registry import run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait when no job is due'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no due jobs are left instead of polling'
+        )
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Print queue counts and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for key, value in Job.objects.stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Job worker {worker} started")
+
+        while True:
+            job = Job.objects.claim(worker)
+            if not job:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            run_job(job)
+            self.stdout.write(
+                f"{job.kind} {job.id}: {job.status} in {time.perf_counter() - started:.1f}s"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Job queue drained'))
@@ -0,0 +1,167 @@
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from utils.models import TimestampedModel
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, kind: str, user=None, payload: dict = None) -> 'Job':
+        return self.create(
+            kind=kind, user=user, payload=payload or {},
+            available_at=timezone.now()
+        )
+
+    def claim(self, worker: str) -> Optional['Job']:
+        """
+        Lease the oldest due job to `worker`. Jobs locked by another
+        worker are skipped, so several `run_jobs` processes can share
+        the queue; a job whose lease ran out is picked up again, using
+        up an attempt.
+        """
+        now = timezone.now()
+        while True:
+            with transaction.atomic():
+                job = self.select_for_update(skip_locked=True) \
+                    .filter(status__in=[self.model.QUEUED, self.model.RUNNING]) \
+                    .filter(available_at__lte=now) \
+                    .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now)) \
+                    .order_by('available_at').first()
+                if not job:
+                    return None
+
+                if job.status == self.model.RUNNING:
+                    # The last run never finished, e.g. its worker crashed, so it
+                    # counts as an attempt; otherwise such a job would loop forever
+                    job.attempts += 1
+                    if job.attempts >= self.model.MAX_ATTEMPTS:
+                        job.fail(f"Lease expired {job.attempts} times")
+                        continue
+
+                job.status = self.model.RUNNING
+                job.locked_by = worker
+                job.locked_until = now + timedelta(seconds=self.model.LEASE_SECONDS)
+                job.started_at = job.started_at or now
+                job.save(update_fields=[
+                    'status', 'attempts', 'locked_by', 'locked_until', 'started_at', 'updated_at'
+                ])
+            return job
+
+    def stats(self) -> dict:
+        """Summarise the job queue"""
+        now = timezone.now()
+        summary = self.aggregate(
+            queued=Count('pk', filter=Q(status=self.model.QUEUED)),
+            running=Count('pk', filter=Q(status=self.model.RUNNING)),
+            failed=Count('pk', filter=Q(status=self.model.FAILED)),
+            oldest=Min('available_at', filter=Q(status=self.model.QUEUED, available_at__lte=now)),
+        )
+        oldest = summary.pop('oldest')
+        summary['lag_seconds'] = (now - oldest).total_seconds() if oldest else 0
+        return summary
+
+
+class Job(TimestampedModel):
+    """
+    Background job stored in the database and run by the `run_jobs`
+    command, so slow work can leave the request path without a broker.
+    `kind` selects the handler registered in `apps.jobs.registry`.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    MAX_ATTEMPTS = 5
+    LEASE_SECONDS = 600
+    RETRY_BASE_SECONDS = 30
+    RETRY_MAX_SECONDS = 3600
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE,
+        null=True, blank=True
+    )
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.JSONField(
+        default=dict, blank=True,
+        help_text="Counters reported by the handler while the job runs"
+    )
+    result = models.JSONField(null=True, blank=True)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.status})"
+
+    def report_progress(self, **counts):
+        """Add to the progress counters and extend the lease"""
+        for key, count in counts.items():
+            self.progress[key] = self.progress.get(key, 0) + count
+        self.locked_until = timezone.now() + timedelta(seconds=self.LEASE_SECONDS)
+        self.save(update_fields=['progress', 'locked_until', 'updated_at'])
+
+    def succeed(self, result=None):
+        self.status = self.SUCCEEDED
+        self.result = result
+        self.finished_at = timezone.now()
+        self.locked_by = self.locked_until = None
+        self.save(update_fields=[
+            'status', 'result', 'finished_at', 'locked_by', 'locked_until', 'updated_at'
+        ])
+
+    def fail(self, error: str):
+        self.status = self.FAILED
+        self.last_error = error
+        self.finished_at = timezone.now()
+        self.locked_by = self.locked_until = None
+        self.save(update_fields=[
+            'status', 'attempts', 'last_error', 'finished_at', 'locked_by', 'locked_until', 'updated_at'
+        ])
+
+    def retry(self, error: str, delay: float = None, count_attempt: bool = True):
+        """
+        Queue the job again, after `delay` seconds or an exponential
+        backoff. Fails it once `MAX_ATTEMPTS` attempts have been counted.
+        """
+        if count_attempt:
+            self.attempts += 1
+            if self.attempts >= self.MAX_ATTEMPTS:
+                self.fail(error)
+                return
+
+        if delay is None:
+            delay = min(self.RETRY_BASE_SECONDS * 2 ** max(self.attempts - 1, 0), self.RETRY_MAX_SECONDS)
+        self.status = self.QUEUED
+        self.last_error = error
+        self.available_at = timezone.now() + timedelta(seconds=delay)
+        self.locked_by = self.locked_until = None
+        self.save(update_fields=[
+            'status', 'attempts', 'last_error', 'available_at', 'locked_by', 'locked_until', 'updated_at'
+        ])
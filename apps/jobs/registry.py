@@ -0,0 +1,55 @@
+import logging
+from typing import Callable
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, Callable] = {}
+
+
+class RetryJob(Exception):
+    """
+    Raised by a handler whose job cannot finish yet. The job runs again
+    after `delay` seconds without using up an attempt.
+    """
+
+    def __init__(self, message: str, delay: float = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobError(Exception):
+    """Raised by a handler to fail its job without retrying"""
+
+
+def register(kind: str):
+    """Register the decorated function as the handler for jobs of `kind`"""
+    def decorator(handler: Callable):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def run_job(job: Job):
+    """
+    Run a claimed job with its handler. Handlers take the job and return a
+    JSON-serialisable result; unexpected errors are retried with backoff.
+    """
+    if not (handler := _handlers.get(job.kind)):
+        job.fail(f"No handler registered for {job.kind}")
+        return
+
+    try:
+        result = handler(job)
+    except RetryJob as e:
+        logger.info(f"Job {job.id} ({job.kind}) deferred: {e}")
+        job.retry(str(e), delay=e.delay, count_attempt=False)
+    except JobError as e:
+        logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+        job.fail(str(e))
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.kind}) raised an error")
+        job.retry(str(e))
+    else:
+        job.succeed(result)
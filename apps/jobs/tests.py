@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import Job
+from .registry import JobError, RetryJob, register, run_job
+
+FLAKY = 'tests.flaky'
+DEFERRED = 'tests.deferred'
+BROKEN = 'tests.broken'
+
+
+@register(FLAKY)
+def flaky(job):
+    raise ValueError("Temporary failure")
+
+
+@register(DEFERRED)
+def deferred(job):
+    raise RetryJob("Not ready", delay=120)
+
+
+@register(BROKEN)
+def broken(job):
+    raise JobError("Bad payload")
+
+
+class JobQueueTests(TestCase):
+    def enqueue(self, kind=FLAKY, **fields) -> Job:
+        job = Job.objects.enqueue(kind)
+        Job.objects.filter(pk=job.pk).update(**fields)
+        job.refresh_from_db()
+        return job
+
+    def expire_lease(self, job):
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+    def test_claim_takes_the_oldest_due_job_and_skips_leased_ones(self):
+        now = timezone.now()
+        newer = self.enqueue(available_at=now - timedelta(minutes=1))
+        older = self.enqueue(available_at=now - timedelta(minutes=2))
+        self.enqueue(available_at=now + timedelta(minutes=1))
+
+        self.assertEqual(Job.objects.claim('first'), older)
+        self.assertEqual(Job.objects.claim('second'), newer)
+        self.assertIsNone(Job.objects.claim('third'))
+
+        older.refresh_from_db()
+        self.assertEqual((older.status, older.locked_by), (Job.RUNNING, 'first'))
+
+    def test_expired_lease_is_reclaimed_with_an_attempt_counted(self):
+        job = self.enqueue()
+        Job.objects.claim('crashed')
+        self.expire_lease(job)
+
+        job = Job.objects.claim('second')
+        self.assertEqual((job.locked_by, job.attempts), ('second', 1))
+
+    def test_job_that_keeps_crashing_its_worker_fails(self):
+        job = self.enqueue(attempts=Job.MAX_ATTEMPTS - 1)
+        Job.objects.claim('crashed')
+        self.expire_lease(job)
+
+        self.assertIsNone(Job.objects.claim('second'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, Job.MAX_ATTEMPTS))
+
+    def test_errors_are_retried_with_exponential_backoff(self):
+        job = self.enqueue()
+        delays = []
+        for _ in range(2):
+            job = Job.objects.claim('worker')
+            started = timezone.now()
+            run_job(job)
+            delays.append(round((job.available_at - started).total_seconds()))
+            Job.objects.filter(pk=job.pk).update(available_at=started)
+
+        self.assertEqual(delays, [Job.RETRY_BASE_SECONDS, Job.RETRY_BASE_SECONDS * 2])
+        self.assertEqual((job.status, job.attempts, job.last_error), (Job.QUEUED, 2, "Temporary failure"))
+
+    def test_job_fails_after_max_attempts(self):
+        job = self.enqueue(attempts=Job.MAX_ATTEMPTS - 1)
+        run_job(Job.objects.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, Job.MAX_ATTEMPTS))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_job_defers_without_using_an_attempt(self):
+        job = self.enqueue(DEFERRED)
+        started = timezone.now()
+        run_job(Job.objects.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+        self.assertEqual(round((job.available_at - started).total_seconds()), 120)
+        self.assertIsNone(job.locked_by)
+
+    def test_job_error_fails_without_retrying(self):
+        job = self.enqueue(BROKEN)
+        run_job(Job.objects.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), (Job.FAILED, 0, "Bad payload"))
+
+    def test_unknown_kind_fails(self):
+        job = self.enqueue('tests.unknown')
+        run_job(Job.objects.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
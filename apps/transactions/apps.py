@@ -6,4 +6,5 @@ class TransactionsConfig(AppConfig):
     name = "apps.transactions"
 
     def ready(self):
+        import apps.transactions.jobs
         import apps.transactions.signals
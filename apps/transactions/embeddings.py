@@ -0,0 +1,121 @@
+import json
+import logging
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+
+from utils.embedding_cache import text_hash
+from utils.vectordb import (HASH_KEY, delete_vector_documents, get_embeddings,
+                            get_stored_hashes, upsert_vector_documents)
+
+from .insights import bump_data_version
+from .models import EmbeddingTask
+
+logger = logging.getLogger(__name__)
+
+
+def build_documents(transactions) -> tuple[list, list]:
+    """
+    Render vector documents for a batch of transactions.
+    Returns the documents and the transactions that failed to render.
+    """
+    documents, failed = [], []
+    for instance in transactions:
+        try:
+            document = instance.to_vector_document()
+            document.metadata[HASH_KEY] = document_hash(document)
+            documents.append(document)
+        except Exception as e:
+            logger.error(f"Failed to build vector document for {instance}: {e}")
+            failed.append(instance)
+    return documents, failed
+
+
+def document_hash(document) -> str:
+    """Changes whenever the stored vector document would"""
+    metadata = json.dumps(document.metadata, sort_keys=True, default=str)
+    return text_hash(f"{document.page_content}\0{metadata}", settings.EMBEDDING_MODEL)
+
+
+def changed_documents(documents) -> list:
+    """Drop documents whose stored copy already has the same content hash"""
+    stored = get_stored_hashes(
+        [document.metadata["transaction_id"] for document in documents],
+        {document.metadata["user_id"] for document in documents}
+    )
+    return [
+        document for document in documents
+        if stored.get(document.metadata["transaction_id"]) != document.metadata[HASH_KEY]
+    ]
+
+
+def embed_documents(documents) -> list:
+    return get_embeddings().embed_documents(
+        [document.page_content for document in documents]
+    )
+
+
+def index_documents(documents) -> int:
+    """Embed documents in a single inference call and upsert them"""
+    if documents:
+        upsert_vector_documents(documents, embed_documents(documents))
+    return len(documents)
+
+
+def process_tasks(tasks) -> dict:
+    """Re-embed the transactions behind a batch of claimed outbox tasks"""
+    result = {'indexed': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0}
+    tasks_by_model = defaultdict(dict)
+    for task in tasks:
+        tasks_by_model[task.transaction_model][task.transaction_id] = task
+
+    documents, missing, done, failed = [], {}, [], []
+    for model_name, model_tasks in tasks_by_model.items():
+        model = apps.get_model('transactions', model_name)
+        transactions = list(
+            model.objects.filter(id__in=model_tasks.keys()).for_embedding()
+        )
+
+        # Transactions deleted since they were enqueued drop out of the index
+        model_missing = model_tasks.keys() - {instance.id for instance in transactions}
+        missing.update((pk, model_tasks[pk].user_id) for pk in model_missing)
+        done.extend(model_tasks[pk] for pk in model_missing)
+
+        model_documents, model_failed = build_documents(transactions)
+        documents.extend(model_documents)
+        failed.extend(model_tasks[instance.id] for instance in model_failed)
+        done.extend(
+            model_tasks[instance.id]
+            for instance in transactions if instance not in model_failed
+        )
+
+    try:
+        # Tasks queued before owners were recorded fall back to every partition
+        owners = set(missing.values())
+        delete_vector_documents(list(missing), None if None in owners else owners)
+        # Re-saves that leave the document as it was skip inference and the write
+        changed = changed_documents(documents)
+        index_documents(changed)
+        # Bulk imports skip the save signals, and answers given between a
+        # delete and its vector's removal still cite the deleted transaction;
+        # both go stale once the index is up to date
+        bump_data_version(
+            [str(document.metadata["user_id"]) for document in changed]
+            + [str(user_id) for user_id in owners if user_id is not None]
+        )
+    except Exception as e:
+        logger.error(f"Failed to index {len(tasks)} embedding tasks: {e}")
+        EmbeddingTask.objects.retry(tasks, str(e))
+        result['failed'] = len(tasks)
+        return result
+
+    if failed:
+        EmbeddingTask.objects.retry(failed, "Failed to build vector document")
+    EmbeddingTask.objects.complete(done)
+
+    result['indexed'] = len(changed)
+    result['unchanged'] = len(documents) - len(changed)
+    result['deleted'] = len(missing)
+    result['failed'] = len(failed)
+    return result
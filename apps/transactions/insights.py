@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import re
+import time
+from typing import Iterator
+
+from django.conf import settings
+from django.core.cache import cache
+
+from utils.vectordb import get_embeddings, get_llm, search_vectors
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are Trink, a personal finance assistant. Answer the user's question "
+    "using only the transactions listed below. Quote amounts with their "
+    "currency, say so when the transactions do not answer the question, and "
+    "keep the answer short."
+)
+# Built once; only the transactions and the question change per request
+QUESTION_TEMPLATE = "Transactions:\n{transactions}\n\nQuestion: {question}"
+
+
+def _version_key(user_id) -> str:
+    return f"insights:version:{user_id}"
+
+
+def data_version(user_id) -> int:
+    """Changes whenever the user's transactions do"""
+    if (version := cache.get(_version_key(user_id))) is None:
+        cache.add(_version_key(user_id), 1, timeout=None)
+        version = cache.get(_version_key(user_id), 1)
+    return version
+
+
+def bump_data_version(user_ids):
+    """Invalidate the cached answers of these users"""
+    for user_id in set(user_ids):
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            cache.add(_version_key(user_id), 1, timeout=None)
+
+
+def normalise_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def answer_cache_key(user_id, question: str) -> str:
+    digest = hashlib.sha256(normalise_question(question).encode()).hexdigest()
+    return f"insights:answer:{user_id}:{data_version(user_id)}:{digest}"
+
+
+def build_messages(question: str, documents: list[dict]) -> list[tuple[str, str]]:
+    transactions = "\n\n".join(document["text"] for document in documents) or "(none)"
+    return [
+        ("system", SYSTEM_PROMPT),
+        ("human", QUESTION_TEMPLATE.format(transactions=transactions, question=question.strip())),
+    ]
+
+
+def answer_question(user, question: str) -> Iterator[tuple[str, dict]]:
+    """
+    Answer a question about the user's spending from their top-k most
+    relevant transactions, yielding (event, data) pairs as the answer is
+    generated: `sources`, then `token` for each chunk, then `done` with the
+    stage timings. Complete answers are cached per data version, so a
+    repeated question is answered without retrieval or generation until
+    the user's transactions change.
+    """
+    started = time.perf_counter()
+    timings = {}
+    key = answer_cache_key(user.id, question)
+    if (cached := cache.get(key)) is not None:
+        yield "sources", {"transaction_ids": cached["sources"]}
+        yield "token", {"text": cached["answer"]}
+        timings["total"] = time.perf_counter() - started
+        yield "done", {"cached": True, "timings": timings}
+        return
+
+    vector = get_embeddings().embed_query(question)
+    documents = search_vectors(vector, settings.INSIGHTS_TOP_K, {"user_id": str(user.id)})
+    sources = [document["transaction_id"] for document in documents]
+    timings["retrieval"] = time.perf_counter() - started
+    yield "sources", {"transaction_ids": sources}
+
+    prompt_started = time.perf_counter()
+    messages = build_messages(question, documents)
+    timings["prompt"] = time.perf_counter() - prompt_started
+
+    generation_started = time.perf_counter()
+    chunks = []
+    for chunk in get_llm().stream(messages):
+        if not chunk.content:
+            continue
+        if not chunks:
+            timings["first_token"] = time.perf_counter() - generation_started
+        chunks.append(chunk.content)
+        yield "token", {"text": chunk.content}
+    timings["generation"] = time.perf_counter() - generation_started
+    timings["total"] = time.perf_counter() - started
+
+    cache.set(key, {"answer": "".join(chunks), "sources": sources}, timeout=settings.INSIGHTS_CACHE_TTL)
+    stages = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items())
+    logger.info(f"Answered insight question for user {user.id}: {stages}")
+    yield "done", {"cached": False, "timings": timings}
@@ -0,0 +1,21 @@
+import base64
+
+from apps.jobs.registry import register
+
+from .services import process_receipt
+
+EXTRACT_RECEIPT = 'transactions.extract_receipt'
+
+
+@register(EXTRACT_RECEIPT)
+def extract_receipt(job) -> dict:
+    """
+    Extract a receipt uploaded in async mode. The payload holds the
+    normalised image, which is dropped once the result is stored.
+    """
+    transaction_data = process_receipt(
+        base64.b64decode(job.payload['image']), job.payload['content_hash']
+    )
+    job.payload = {'content_hash': job.payload['content_hash']}
+    job.save(update_fields=['payload', 'updated_at'])
+    return transaction_data
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_service import RemoteEmbeddings, create_server
+from utils.vectordb import load_local_embeddings
+
+
+class StubEmbeddings(Embeddings):
+    """Stand-in model with a fixed cost per inference call plus a cost per text"""
+
+    def __init__(self, call_latency: float, text_latency: float, dimensions: int = 384):
+        self.call_latency = call_latency
+        self.text_latency = text_latency
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts):
+        time.sleep(self.call_latency + self.text_latency * len(texts))
+        return [[float(len(text))] * self.dimensions for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class Command(BaseCommand):
+    help = 'Measure embedding service throughput (docs/s) against request batch size'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default=settings.EMBEDDING_SERVICE_URL,
+            help='Running embedding server; by default one is started in this process'
+        )
+        parser.add_argument('--documents', type=int, default=512)
+        parser.add_argument(
+            '--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64],
+            help='Texts sent per request'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Requests in flight at once, like that many web workers'
+        )
+        parser.add_argument(
+            '--stub', action='store_true',
+            help='Serve a stub model (20ms per call + 1ms per text) instead of loading the real one'
+        )
+
+    def handle(self, *args, **options):
+        server = None
+        url = options['url']
+        if not url:
+            embeddings = StubEmbeddings(0.02, 0.001) if options['stub'] else load_local_embeddings()
+            server = create_server(
+                embeddings, '127.0.0.1', 0,
+                settings.EMBEDDING_MAX_BATCH_SIZE, settings.EMBEDDING_MAX_WAIT_MS / 1000
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_port}"
+
+        client = RemoteEmbeddings(url, pool_size=options['concurrency'])
+        texts = [
+            f"Merchant: Merchant {i % 50} | Amount: {i % 97}.99 USD | Date: 2025-01-{i % 28 + 1:02d}"
+            for i in range(options['documents'])
+        ]
+        client.embed_documents(texts[:1])
+
+        try:
+            for batch_size in options['batch_sizes']:
+                self.run(client, url, texts, batch_size, options['concurrency'])
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+    def run(self, client, url, texts, batch_size, concurrency):
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        before = self.server_stats(client, url)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            embedded = sum(len(vectors) for vectors in executor.map(client.embed_documents, batches))
+        elapsed = time.perf_counter() - started
+
+        after = self.server_stats(client, url)
+        inference_calls = after['batches'] - before['batches']
+        self.stdout.write(
+            f"batch size {batch_size:>4}: {embedded / elapsed:8.1f} docs/s "
+            f"({len(batches)} requests, {inference_calls} inference calls, "
+            f"{embedded / max(inference_calls, 1):.1f} texts per call)"
+        )
+
+    @staticmethod
+    def server_stats(client, url) -> dict:
+        return json.loads(client.http.request('GET', f"{url}/stats").data)
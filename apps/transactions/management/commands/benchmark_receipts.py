@@ -0,0 +1,120 @@
+import io
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.transactions.services import (extract_receipt_data, get_receipt_data,
+                                        normalise_receipt_image, receipt_cache_key,
+                                        receipt_hash)
+
+RECEIPT_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.heic'}
+
+
+class StubReceiptModel:
+    """Stand-in for Gemini: a fixed delay plus a delay per megabyte uploaded"""
+
+    def __init__(self, latency: float, latency_per_mb: float):
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+
+    def generate_content(self, parts):
+        image = parts[1]['data']
+        time.sleep(self.latency + self.latency_per_mb * len(image) / 1e6)
+        return SimpleNamespace(text=json.dumps({
+            'store_location': 'Benchmark Store',
+            'date_time': '2025-01-01T12:00:00',
+            'items': [{'category': 'groceries', 'name': 'Bread', 'quantity': 1, 'unit_price': 2.5}],
+        }))
+
+
+class Command(BaseCommand):
+    help = 'Measure receipt extraction time and upload size with and without image normalisation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', help='Folder of receipt photos')
+        parser.add_argument(
+            '--generate', type=int, default=0,
+            help='Benchmark this many generated 12 megapixel photos instead of a folder'
+        )
+        parser.add_argument('--latency', type=float, default=0.3, help='Stub model seconds per call')
+        parser.add_argument(
+            '--latency-per-mb', type=float, default=0.5,
+            help='Stub model seconds per megabyte of image uploaded'
+        )
+
+    def handle(self, *args, **options):
+        model = StubReceiptModel(options['latency'], options['latency_per_mb'])
+        with tempfile.TemporaryDirectory() as directory:
+            if options['generate']:
+                paths = self.generate(Path(directory), options['generate'])
+            elif options['folder']:
+                paths = sorted(
+                    path for path in Path(options['folder']).iterdir()
+                    if path.suffix.lower() in RECEIPT_SUFFIXES
+                )
+            else:
+                raise CommandError('Pass --folder or --generate')
+            if not paths:
+                raise CommandError('No receipt images found')
+
+            for path in paths:
+                with open(path, 'rb') as image_file:
+                    cache.delete(receipt_cache_key(receipt_hash(image_file)))
+
+            raw = self.run(paths, lambda image_file: extract_receipt_data(image_file.read(), model))
+            normalised_sizes = []
+
+            def normalised(image_file):
+                image = normalise_receipt_image(image_file)
+                normalised_sizes.append(len(image))
+                return extract_receipt_data(image, model)
+
+            normalised_times = self.run(paths, normalised)
+            first_pass = self.run(paths, lambda image_file: get_receipt_data(image_file, model))
+            cached = self.run(paths, lambda image_file: get_receipt_data(image_file, model))
+            raw_sizes = [path.stat().st_size for path in paths]
+
+        self.stdout.write(f"{len(paths)} receipts")
+        self.stdout.write(
+            f"  upload size: {statistics.mean(raw_sizes) / 1e6:.2f}MB raw, "
+            f"{statistics.mean(normalised_sizes) / 1e6:.2f}MB normalised"
+        )
+        for label, times in [
+            ('raw image', raw), ('normalised', normalised_times),
+            ('pipeline, first upload', first_pass), ('pipeline, duplicate', cached),
+        ]:
+            self.stdout.write(
+                f"  {label:<24} mean {statistics.mean(times) * 1000:8.1f}ms  "
+                f"max {max(times) * 1000:8.1f}ms"
+            )
+
+    def run(self, paths, extract) -> list[float]:
+        times = []
+        for path in paths:
+            with open(path, 'rb') as image_file:
+                started = time.perf_counter()
+                extract(image_file)
+                times.append(time.perf_counter() - started)
+        return times
+
+    def generate(self, directory: Path, count: int) -> list[Path]:
+        """Phone-camera sized photos: 4000x3000 with noise, so JPEG cannot shrink them much"""
+        import numpy as np
+        import PIL.Image
+
+        rng = np.random.default_rng(0)
+        paths = []
+        for i in range(count):
+            pixels = rng.integers(180, 255, (3000, 4000, 3), dtype=np.uint8)
+            output = io.BytesIO()
+            PIL.Image.fromarray(pixels).save(output, format='JPEG', quality=92)
+            path = directory / f'receipt-{i}.jpg'
+            path.write_bytes(output.getvalue())
+            paths.append(path)
+        return paths
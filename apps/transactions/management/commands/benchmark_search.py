@@ -0,0 +1,78 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.transactions.management.commands.benchmark_vector_index import \
+    Command as VectorIndexBenchmark
+from utils.local_vectors import LocalVectorIndex
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure p50/p95 latency of per-user pre-filtered vector search against '
+        'scanning the whole collection and filtering afterwards, on the local backend'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+            help='Documents per collection'
+        )
+        parser.add_argument('--users', type=int, default=100, help='Users the documents are spread over')
+        parser.add_argument('--dimensions', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('-k', type=int, default=100, help='Candidates retrieved per search')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            self.stdout.write(f"\n{size} documents, {options['users']} users")
+            self.run(size, options)
+
+    def run(self, size, options):
+        rng = np.random.default_rng(options['seed'])
+        users, k = options['users'], options['k']
+        vectors = VectorIndexBenchmark.clustered_vectors(rng, size, options['dimensions'])
+        documents = [
+            {
+                'text': f'transaction {i}',
+                'transaction_id': str(i),
+                'user_id': str(i % users),
+                'date': f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                'type': 'EXPENSE' if i % 5 else 'INCOME',
+            }
+            for i in range(size)
+        ]
+
+        with tempfile.TemporaryDirectory() as root:
+            index = LocalVectorIndex(root)
+            started = time.perf_counter()
+            for start in range(0, size, 100_000):
+                index.upsert(documents[start:start + 100_000], vectors[start:start + 100_000])
+            self.stdout.write(f"  indexed in {time.perf_counter() - started:.1f}s")
+
+            queries = vectors[rng.choice(size, options['queries'])]
+            query_users = rng.integers(users, size=options['queries'])
+            dates = {'$gte': '2025-06-01', '$lte': '2025-06-30'}
+
+            def pre_filtered(query, user):
+                return index.search(query, k, {'user_id': str(user), 'date': dates})
+
+            def post_filtered(query, user):
+                # What an unfiltered vector query costs: every user's vectors are
+                # ranked, and enough candidates kept to survive the user filter
+                matches = index.search(query, k * users, {'date': dates}, exact=True)
+                return [match for match in matches if match['user_id'] == str(user)][:k]
+
+            for label, search in [('pre-filtered', pre_filtered), ('post-filtered', post_filtered)]:
+                latencies = []
+                for query, user in zip(queries, query_users):
+                    started = time.perf_counter()
+                    search(query, user)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"  {label:<14} p50 {np.percentile(latencies, 50):8.2f}ms  "
+                    f"p95 {np.percentile(latencies, 95):8.2f}ms"
+                )
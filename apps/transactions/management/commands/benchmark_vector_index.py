@@ -0,0 +1,94 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from utils.local_vectors import LocalVectorIndex
+
+
+class Command(BaseCommand):
+    help = 'Measure local vector index latency and IVF recall against brute-force search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=100_000, help='Documents in one user partition')
+        parser.add_argument('--dimensions', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('-k', type=int, default=10)
+        parser.add_argument(
+            '--nprobe', type=int, nargs='+', default=[1, 4, 8, 16],
+            help='IVF lists probed per query'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count, k = options['documents'], options['k']
+        vectors = self.clustered_vectors(rng, count, options['dimensions'])
+        documents = [
+            {
+                'text': f'transaction {i}',
+                'transaction_id': str(i),
+                'user_id': '1',
+                'date': f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                'amount': float(i % 500),
+                'type': 'EXPENSE' if i % 5 else 'INCOME',
+                'categories': [f'category {i % 20}'],
+            }
+            for i in range(count)
+        ]
+        # Queries near stored documents, as real questions land near real transactions
+        queries = vectors[rng.choice(count, options['queries'])] + rng.normal(
+            0, 0.05, (options['queries'], options['dimensions'])
+        ).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as root:
+            index = LocalVectorIndex(root)
+            started = time.perf_counter()
+            index.upsert(documents, vectors)
+            self.stdout.write(f"Indexed {count} documents in {time.perf_counter() - started:.1f}s")
+
+            filters = {
+                'no filter': {'user_id': '1'},
+                'date + type filter': {
+                    'user_id': '1', 'date': {'$gte': '2025-06-01'}, 'type': 'EXPENSE'
+                },
+            }
+            for label, filter in filters.items():
+                self.stdout.write(f"\n{label}")
+                exact, latencies = self.run(index, queries, k, filter, exact=True)
+                self.report('brute force', latencies)
+                for nprobe in options['nprobe']:
+                    index.nprobe = nprobe
+                    results, latencies = self.run(index, queries, k, filter, exact=False)
+                    recall = np.mean([
+                        len(set(found) & set(expected)) / max(len(expected), 1)
+                        for found, expected in zip(results, exact)
+                    ])
+                    self.report(f"ivf nprobe={nprobe}", latencies, recall)
+
+    @staticmethod
+    def clustered_vectors(rng, count, dimensions, clusters=256):
+        centres = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+        return centres[rng.integers(clusters, size=count)] + rng.normal(
+            0, 0.3, (count, dimensions)
+        ).astype(np.float32)
+
+    @staticmethod
+    def run(index, queries, k, filter, exact):
+        results, latencies = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found = index.search(query, k, filter, exact=exact)
+            latencies.append(time.perf_counter() - started)
+            results.append([document['transaction_id'] for document in found])
+        return results, np.array(latencies) * 1000
+
+    def report(self, label, latencies, recall=None):
+        line = (
+            f"  {label:<14} p50 {np.percentile(latencies, 50):7.2f}ms  "
+            f"p95 {np.percentile(latencies, 95):7.2f}ms"
+        )
+        if recall is not None:
+            line += f"  recall@k {recall:.3f}"
+        self.stdout.write(line)
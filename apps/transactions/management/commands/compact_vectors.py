@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.vectordb import (collection_stats, ensure_vector_indexes,
+                            ensure_vector_search_index,
+                            find_duplicate_vector_documents,
+                            get_vectors_collection)
+
+
+class Command(BaseCommand):
+    help = 'Remove duplicate vector documents and add the unique transaction_id and vector search indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count the duplicates without deleting them'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of duplicates deleted per request'
+        )
+
+    def handle(self, *args, **options):
+        if settings.VECTOR_STORE_BACKEND != 'atlas':
+            raise CommandError('Only the Atlas vector store can hold duplicates')
+
+        before = collection_stats()
+        self.report('Before', before)
+
+        duplicates = find_duplicate_vector_documents()
+        self.stdout.write(f"Found {len(duplicates)} duplicate documents")
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, no changes were saved'))
+            return
+
+        collection = get_vectors_collection()
+        deleted = 0
+        for start in range(0, len(duplicates), options['batch_size']):
+            batch = duplicates[start:start + options['batch_size']]
+            deleted += collection.delete_many({'_id': {'$in': batch}}).deleted_count
+
+        ensure_vector_indexes()
+        ensure_vector_search_index()
+        self.report('After', collection_stats())
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} duplicates; transaction_id is now unique"
+        ))
+
+    def report(self, label, stats):
+        self.stdout.write(
+            f"{label}: {stats['documents']} documents, "
+            f"{stats['size'] / 2 ** 20:.1f} MiB data, {stats['index_size'] / 2 ** 20:.1f} MiB indexes"
+        )
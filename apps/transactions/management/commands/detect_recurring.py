@@ -0,0 +1,71 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.transactions.models import (BankTransaction, ManualTransaction,
+                                     StoreTransaction)
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored recurring-transaction flags for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='Only refresh transactions belonging to this user id'
+        )
+        parser.add_argument(
+            '--compare', action='store_true',
+            help='Also time the per-transaction COUNT query and report disagreements'
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['user']:
+            users = users.filter(id=options['user'])
+
+        for model in (BankTransaction, StoreTransaction, ManualTransaction):
+            started = time.perf_counter()
+            updated = sum(len(model.refresh_recurring(user)) for user in users)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{model.__name__}: batch detection took {elapsed:.2f}s, "
+                f"updated {updated} transactions"
+            )
+
+            if options['compare']:
+                self.compare(model, users)
+
+        self.stdout.write(self.style.SUCCESS('Successfully refreshed recurring transactions'))
+
+    def compare(self, model, users):
+        """Benchmark against one COUNT query per transaction (the old `is_recurring`)"""
+        transactions = list(model.objects.filter(user__in=users))
+
+        started = time.perf_counter()
+        mismatches = sum(
+            self.count_query_is_recurring(model, transaction) != transaction.is_recurring
+            for transaction in transactions
+        )
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{model.__name__}: per-transaction queries took {elapsed:.2f}s "
+            f"for {len(transactions)} transactions, {mismatches} disagreements"
+        )
+
+    @staticmethod
+    def count_query_is_recurring(model, transaction) -> bool:
+        amount = transaction.amount
+        return model.objects.filter(
+            user=transaction.user_id,
+            merchant=transaction.merchant,
+            amount__range=(
+                amount * (1 - model.TOLERANCE_FACTOR),
+                amount * (1 + model.TOLERANCE_FACTOR)
+            ),
+            transaction_date__gte=transaction.transaction_date -
+            timedelta(days=model.LOOKBACK_DAYS)
+        ).exclude(id=transaction.id).count() >= model.MIN_OCCURRENCES
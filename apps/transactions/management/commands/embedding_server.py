@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from utils.embedding_service import create_server
+from utils.vectordb import load_local_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Serve batched embedding inference to the other processes over local HTTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--max-batch-size', type=int, default=settings.EMBEDDING_MAX_BATCH_SIZE,
+            help='Most texts embedded in one inference call'
+        )
+        parser.add_argument(
+            '--max-wait-ms', type=float, default=settings.EMBEDDING_MAX_WAIT_MS,
+            help='How long to wait for more requests before running a batch'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Loading embedding model {settings.EMBEDDING_MODEL}")
+        embeddings = load_local_embeddings()
+        # Warm up so the first request does not pay for lazy initialisation
+        embeddings.embed_documents(['warm up'])
+
+        server = create_server(
+            embeddings, options['host'], options['port'],
+            options['max_batch_size'], options['max_wait_ms'] / 1000
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedding server listening on http://{options['host']}:{server.server_port}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
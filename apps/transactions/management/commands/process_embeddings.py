@@ -0,0 +1,68 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.transactions.embeddings import process_tasks
+from apps.transactions.models import EmbeddingTask
+from utils import providers
+from utils.vectordb import get_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Drain the embedding outbox and upsert transaction vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=64,
+            help='Number of transactions embedded per inference call'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no due tasks are left instead of polling'
+        )
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Print queue lag and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for key, value in EmbeddingTask.objects.stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Embedding worker {worker} started")
+
+        while True:
+            tasks = EmbeddingTask.objects.claim(worker, options['batch_size'])
+            if not tasks:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            result = process_tasks(tasks)
+            self.stdout.write(
+                f"Indexed {result['indexed']}, unchanged {result['unchanged']}, "
+                f"deleted {result['deleted']}, failed {result['failed']}"
+            )
+            self.report_cache()
+
+        self.stdout.write(self.style.SUCCESS('Embedding queue drained'))
+
+    def report_cache(self):
+        if not providers.is_loaded('embeddings') or not hasattr(get_embeddings(), 'cache'):
+            return
+        stats = get_embeddings().cache.snapshot()
+        self.stdout.write(
+            f"Embedding cache: {stats['hit_rate']:.0%} hit rate "
+            f"({stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['size']} cached, {stats['evictions']} evicted)"
+        )
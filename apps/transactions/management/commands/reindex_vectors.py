@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.transactions.models import BankTransaction, StoreTransaction
+
+
+class Command(BaseCommand):
+    help = 'Rebuild vector documents for existing transactions in bulk'
+
+    models = {
+        'bank': BankTransaction,
+        'store': StoreTransaction,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', choices=[*self.models, 'all'], default='all',
+            help='Transaction type to reindex'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='Only reindex transactions belonging to this user id'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of transactions embedded per inference call'
+        )
+
+    def handle(self, *args, **options):
+        models = self.models.values() if options['model'] == 'all' \
+            else [self.models[options['model']]]
+
+        for model in models:
+            queryset = model.objects.all()
+            if options['user']:
+                queryset = queryset.filter(user_id=options['user'])
+
+            started = time.perf_counter()
+            indexed = model.objects.bulk_embed(
+                queryset, batch_size=options['batch_size']
+            )
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(
+                f"{model.__name__}: indexed {indexed} transactions in {elapsed:.1f}s "
+                f"({indexed / elapsed if elapsed else 0:.0f} docs/s)"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Successfully reindexed vectors'))
@@ -0,0 +1,98 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_alter_profile_currency"),
+        ("categories", "0001_initial"),
+        ("transactions", "0002_embeddingtask"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="banktransaction",
+            name="is_recurring",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="banktransaction",
+            name="recurrence_period",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("weekly", "Weekly"),
+                    ("biweekly", "Biweekly"),
+                    ("monthly", "Monthly"),
+                    ("quarterly", "Quarterly"),
+                    ("yearly", "Yearly"),
+                ],
+                max_length=20,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="manualtransaction",
+            name="is_recurring",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="manualtransaction",
+            name="recurrence_period",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("weekly", "Weekly"),
+                    ("biweekly", "Biweekly"),
+                    ("monthly", "Monthly"),
+                    ("quarterly", "Quarterly"),
+                    ("yearly", "Yearly"),
+                ],
+                max_length=20,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="storetransaction",
+            name="is_recurring",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="storetransaction",
+            name="recurrence_period",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("weekly", "Weekly"),
+                    ("biweekly", "Biweekly"),
+                    ("monthly", "Monthly"),
+                    ("quarterly", "Quarterly"),
+                    ("yearly", "Yearly"),
+                ],
+                max_length=20,
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="banktransaction",
+            index=models.Index(
+                fields=["user", "is_recurring"], name="transaction_user_id_2341ee_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="manualtransaction",
+            index=models.Index(
+                fields=["user", "is_recurring"], name="transaction_user_id_314f36_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="storetransaction",
+            index=models.Index(
+                fields=["user", "is_recurring"], name="transaction_user_id_fe7276_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0003_recurrence_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="banktransaction",
+            name="plaid_transaction_id",
+            field=models.CharField(
+                blank=True,
+                help_text="Plaid transaction id, used to apply modified and removed updates",
+                max_length=100,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0004_banktransaction_plaid_transaction_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="embeddingtask",
+            name="user_id",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Owner of the transaction, whose vector partition holds its document",
+                null=True,
+            ),
+        ),
+    ]
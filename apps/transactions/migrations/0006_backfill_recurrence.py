@@ -0,0 +1,39 @@
+from django.db import migrations
+
+from apps.transactions.mixins import RecurringTransactionMixin
+
+TRANSACTION_MODELS = ["BankTransaction", "StoreTransaction", "ManualTransaction"]
+
+
+def backfill_recurrence(apps, schema_editor):
+    """
+    Store the recurrence flags of rows that predate the columns, one user
+    at a time. Historical models lack the mixin, so detection is called on
+    it directly; it only reads the fields loaded here.
+    """
+    for name in TRANSACTION_MODELS:
+        model = apps.get_model("transactions", name)
+        user_ids = model.objects.order_by().values_list("user_id", flat=True).distinct()
+        for user_id in user_ids:
+            transactions = list(
+                model.objects.filter(user_id=user_id).only(
+                    "id", "user_id", "merchant", "amount", "transaction_date"
+                )
+            )
+            results = RecurringTransactionMixin.detect_recurring(transactions)
+            for transaction in transactions:
+                transaction.is_recurring, transaction.recurrence_period = results[transaction.id]
+            model.objects.bulk_update(
+                transactions, ["is_recurring", "recurrence_period"], batch_size=500
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0005_embeddingtask_user_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_recurrence, migrations.RunPython.noop),
+    ]
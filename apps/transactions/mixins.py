@@ -1,6 +1,9 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
 
+from django.db.models import Q
 from django.utils.formats import date_format
 
 
@@ -40,9 +43,10 @@ class TransactionEmbeddingMixin:
 
         # Add itemized breakdown for store transactions
         if hasattr(self, 'items'):
+            items = self.items.all()
             components.append("\nItem Details:")
-            components.extend(self._format_items())
-            components.append(f"Total Items: {self.items.count()}")
+            components.extend(self._format_items(items))
+            components.append(f"Total Items: {len(items)}")
 
         # Add user notes if available
         if self.description:
@@ -88,41 +92,159 @@ class TransactionEmbeddingMixin:
     def get_currency(self) -> str:
         return getattr(self.user.profile, 'currency', 'NGN')
 
-    def _format_items(self) -> list[str]:
+    def _format_items(self, items) -> list[str]:
+        currency = self.get_currency()
         return [
             f"- {item.name} "
             f"Qty: {item.quantity} "
-            f"@ {self.get_currency()}{item.unit_price:.2f} "
-            f"Total: {self.get_currency()}{item.total_amount:.2f} "
+            f"@ {currency}{item.unit_price:.2f} "
+            f"Total: {currency}{item.total_amount:.2f} "
             f"(Categories: {self._format_categories(item)})"
-            for item in self.items.all()
+            for item in items
         ]
 
     def _format_categories(self, item) -> str:
-        return ' | '.join(item.subcategories.values_list('name', flat=True))
+        # Iterate `.all()` rather than `values_list` so prefetched
+        # subcategories are reused instead of queried per item
+        return ' | '.join(subcategory.name for subcategory in item.subcategories.all())
 
 
 class RecurringTransactionMixin:
-    """Mixin for detecting recurring transactions"""
+    """
+    Mixin for detecting recurring transactions
+
+    A transaction is recurring when at least `MIN_OCCURRENCES` other
+    transactions from the same user and merchant fall within
+    `TOLERANCE_FACTOR` of its amount and are no older than `LOOKBACK_DAYS`
+    before it. The result is stored in `is_recurring`/`recurrence_period`
+    by `refresh_recurring`, so reading it never costs a query.
+    """
     TOLERANCE_FACTOR = Decimal('0.15')
     LOOKBACK_DAYS = 60
     MIN_OCCURRENCES = 1
 
-    @property
-    def is_recurring(self) -> bool:
-        amount = self.amount
-        tolerance_range = (
-            amount * (1 - self.TOLERANCE_FACTOR),
-            amount * (1 + self.TOLERANCE_FACTOR)
+    # Gap between similar charges (in days) for each recurrence period
+    RECURRENCE_PERIODS = [
+        ('weekly', 5, 9),
+        ('biweekly', 12, 16),
+        ('monthly', 26, 35),
+        ('quarterly', 85, 95),
+        ('yearly', 355, 375),
+    ]
+    PERIOD_SEARCH_DAYS = 400
+
+    @classmethod
+    def detect_recurring(cls, transactions) -> dict:
+        """
+        Classify transactions in one pass per merchant.
+        Returns a mapping of transaction id to `(is_recurring, period)`.
+        """
+        groups = defaultdict(list)
+        for transaction in transactions:
+            groups[(transaction.user_id, transaction.merchant)].append(transaction)
+
+        results = {}
+        for group in groups.values():
+            group.sort(key=lambda transaction: transaction.transaction_date)
+            matches = cls._count_matches(group)
+            gaps = cls._match_gaps(group)
+            for transaction, count in zip(group, matches):
+                is_recurring = count >= cls.MIN_OCCURRENCES
+                results[transaction.id] = (
+                    is_recurring,
+                    cls._classify_period(gaps.get(transaction.id)) if is_recurring else None
+                )
+        return results
+
+    @classmethod
+    def _tolerance_range(cls, amount):
+        return amount * (1 - cls.TOLERANCE_FACTOR), amount * (1 + cls.TOLERANCE_FACTOR)
+
+    @classmethod
+    def _count_matches(cls, group) -> list[int]:
+        """
+        Count, for each transaction, the others on or after its lookback
+        start with an amount in tolerance. Walks the date-sorted group
+        backwards so the window only ever grows, keeping its amounts sorted.
+        """
+        lookback = timedelta(days=cls.LOOKBACK_DAYS)
+        counts = [0] * len(group)
+        window = []
+        start = len(group)
+        for i in range(len(group) - 1, -1, -1):
+            window_start = group[i].transaction_date - lookback
+            while start > 0 and group[start - 1].transaction_date >= window_start:
+                start -= 1
+                insort(window, group[start].amount)
+
+            low, high = cls._tolerance_range(group[i].amount)
+            # The transaction itself is always in its own window
+            counts[i] = bisect_right(window, high) - bisect_left(window, low) - 1
+        return counts
+
+    @classmethod
+    def _match_gaps(cls, group) -> dict:
+        """
+        Days between each transaction and its nearest similar neighbour.
+        `start` follows the walk at the edge of the search window, so each
+        scan back stays inside it and usually stops at the previous charge.
+        """
+        search = timedelta(days=cls.PERIOD_SEARCH_DAYS)
+        gaps = {}
+        start = 0
+        for i, transaction in enumerate(group):
+            while transaction.transaction_date - group[start].transaction_date > search:
+                start += 1
+            low, high = cls._tolerance_range(transaction.amount)
+            for j in range(i - 1, start - 1, -1):
+                previous = group[j]
+                if low <= previous.amount <= high:
+                    gap = (transaction.transaction_date - previous.transaction_date).days
+                    gaps[transaction.id] = gap
+                    # The first charge of a series takes the gap to the next one
+                    gaps.setdefault(previous.id, gap)
+                    break
+        return gaps
+
+    @classmethod
+    def _classify_period(cls, gap):
+        if gap is None:
+            return None
+        return next(
+            (period for period, low, high in cls.RECURRENCE_PERIODS if low <= gap <= high),
+            None
         )
 
-        return self.__class__.objects.filter(
-            user=self.user,
-            merchant=self.merchant,
-            amount__range=tolerance_range,
-            transaction_date__gte=self.transaction_date -
-            timedelta(days=self.LOOKBACK_DAYS)
-        ).exclude(id=self.id).count() >= self.MIN_OCCURRENCES
+    @classmethod
+    def refresh_recurring(cls, user, merchants=None) -> list:
+        """
+        Re-run detection over a user's transactions (optionally only some
+        merchants) and store the changes. Returns the updated transactions.
+        """
+        transactions = cls.objects.filter(user=user).only(
+            'id', 'user', 'merchant', 'amount', 'transaction_date',
+            'is_recurring', 'recurrence_period'
+        )
+        if merchants is not None:
+            merchant_filter = Q(merchant__in=[m for m in merchants if m is not None])
+            if None in merchants:
+                merchant_filter |= Q(merchant__isnull=True)
+            transactions = transactions.filter(merchant_filter)
+        transactions = list(transactions)
+
+        results = cls.detect_recurring(transactions)
+        changed = []
+        for transaction in transactions:
+            is_recurring, period = results[transaction.id]
+            if (transaction.is_recurring, transaction.recurrence_period) != (is_recurring, period):
+                transaction.is_recurring = is_recurring
+                transaction.recurrence_period = period
+                changed.append(transaction)
+
+        cls.objects.bulk_update(
+            changed, ['is_recurring', 'recurrence_period'], batch_size=500
+        )
+        return changed
 
 
 class VectorDocumentMixin:
@@ -151,7 +273,8 @@ class VectorDocumentMixin:
         }
 
         if hasattr(self, 'subcategories'):
-            metadata["categories"] = list(
-                self.subcategories.values_list('name', flat=True))
+            metadata["categories"] = [
+                subcategory.name for subcategory in self.subcategories.all()
+            ]
 
         return metadata
@@ -1,5 +1,6 @@
 from .bank import BankTransaction
 from .base import ManualTransaction
+from .outbox import EmbeddingTask
 from .store import StoreItem, StoreTransaction
 
-__all__ = ['BankTransaction', 'ManualTransaction', 'StoreTransaction', 'StoreItem']
+__all__ = ['BankTransaction', 'EmbeddingTask', 'ManualTransaction', 'StoreTransaction', 'StoreItem']
@@ -1,4 +1,5 @@
 from django.db import models
+from model_utils import FieldTracker
 
 from apps.accounts.models import BankAccount
 from apps.categories.models import SubCategory
@@ -9,6 +10,10 @@ from .base import AbstractTransaction
 class BankTransaction(AbstractTransaction):
     """Model for bank account transactions"""
     bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
+    plaid_transaction_id = models.CharField(
+        max_length=100, unique=True, null=True, blank=True,
+        help_text="Plaid transaction id, used to apply modified and removed updates"
+    )
     subcategories = models.ManyToManyField(SubCategory)
     balance = models.DecimalField(
         max_digits=10,
@@ -16,3 +21,5 @@ class BankTransaction(AbstractTransaction):
         null=True,
         help_text="Account balance after transaction"
     )
+
+    tracker = FieldTracker(fields=['amount', 'transaction_date', 'merchant'])
@@ -2,14 +2,45 @@ import uuid
 
 from django.contrib.auth import get_user_model
 from django.db import models
+from model_utils import FieldTracker
 
 from apps.categories.models import SubCategory
+from apps.categories.services import is_expense
 from utils.models import TimestampedModel
 
 from ..mixins import (RecurringTransactionMixin, TransactionEmbeddingMixin,
                       VectorDocumentMixin)
 
 
+class TransactionQuerySet(models.QuerySet):
+    def for_embedding(self):
+        """Load everything `to_vector_document` renders in a fixed number of queries"""
+        queryset = self.select_related('user__profile')
+        if hasattr(self.model, 'store_location'):
+            return queryset.prefetch_related('items__subcategories')
+        return queryset.prefetch_related('subcategories')
+
+    def bulk_embed(self, queryset=None, batch_size: int = 500) -> int:
+        """
+        Embed and index transactions in batches, one inference call and one
+        MongoDB bulk upsert per batch. Used for backfills and bulk imports, which
+        bypass the per-row `post_save` embedding path.
+        """
+        from ..embeddings import build_documents, index_documents
+
+        queryset = (self if queryset is None else queryset).for_embedding()
+
+        indexed, batch = 0, []
+        for instance in queryset.iterator(chunk_size=batch_size):
+            batch.append(instance)
+            if len(batch) == batch_size:
+                indexed += index_documents(build_documents(batch)[0])
+                batch = []
+        if batch:
+            indexed += index_documents(build_documents(batch)[0])
+        return indexed
+
+
 class AbstractTransaction(
     TimestampedModel, TransactionEmbeddingMixin,
     RecurringTransactionMixin, VectorDocumentMixin
@@ -26,19 +57,38 @@ class AbstractTransaction(
     transaction_date = models.DateTimeField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
+    is_recurring = models.BooleanField(default=False)
+    recurrence_period = models.CharField(
+        max_length=20, null=True, blank=True,
+        choices=[
+            (period, period.title())
+            for period, *_ in RecurringTransactionMixin.RECURRENCE_PERIODS
+        ]
+    )
+
+    objects = TransactionQuerySet.as_manager()
+
     @property
     def type(self):
         if hasattr(self, 'store_location'):
             return 'EXPENSE'
-        return 'EXPENSE' if self.subcategories.select_related('category').first().category.is_expense else 'INCOME'
+        # Uses prefetched subcategories when available (see `for_embedding`);
+        # the category flag comes from the process-wide category cache
+        subcategory = next(iter(self.subcategories.all()), None)
+        if subcategory is None or is_expense(subcategory.id):
+            return 'EXPENSE'
+        return 'INCOME'
 
     class Meta:
         abstract = True
         indexes = [
             models.Index(fields=['transaction_date']),
             models.Index(fields=['merchant']),
+            models.Index(fields=['user', 'is_recurring']),
         ]
 
 
 class ManualTransaction(AbstractTransaction):
     subcategories = models.ManyToManyField(SubCategory)
+
+    tracker = FieldTracker(fields=['merchant'])
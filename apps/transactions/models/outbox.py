@@ -0,0 +1,154 @@
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from utils.models import TimestampedModel
+
+
+class EmbeddingTaskQuerySet(models.QuerySet):
+    def enqueue(self, instances):
+        """Mark transactions as dirty so a worker re-embeds them"""
+        now = timezone.now()
+        tasks = [
+            self.model(
+                transaction_model=instance._meta.model_name,
+                transaction_id=instance.pk,
+                user_id=instance.user_id,
+                dirtied_at=now,
+                available_at=now,
+            )
+            for instance in instances
+        ]
+        if not tasks:
+            return
+
+        # Re-dirtying an existing task resets its retry state instead of
+        # adding a duplicate row, so bursts of saves coalesce into one embed
+        self.bulk_create(
+            tasks,
+            update_conflicts=True,
+            unique_fields=['transaction_model', 'transaction_id'],
+            update_fields=['user_id', 'dirtied_at', 'available_at', 'attempts', 'last_error'],
+        )
+
+    def pending(self):
+        return self.filter(attempts__lt=self.model.MAX_ATTEMPTS)
+
+    def failed(self):
+        return self.filter(attempts__gte=self.model.MAX_ATTEMPTS)
+
+    def claim(self, worker: str, batch_size: int) -> list:
+        """
+        Lease up to `batch_size` due tasks to `worker`.
+        Rows locked by another worker are skipped, so several
+        worker processes can drain the queue side by side.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            tasks = list(
+                self.pending()
+                .select_for_update(skip_locked=True)
+                .filter(available_at__lte=now)
+                .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+                .order_by('available_at')[:batch_size]
+            )
+            self.filter(pk__in=[task.pk for task in tasks]).update(
+                locked_by=worker,
+                locked_until=now + timedelta(seconds=self.model.LEASE_SECONDS)
+            )
+        return tasks
+
+    def complete(self, tasks):
+        """Remove tasks that were not dirtied again while being processed"""
+        done = Q()
+        for task in tasks:
+            done |= Q(pk=task.pk, dirtied_at=task.dirtied_at)
+        if tasks:
+            self.filter(done).delete()
+        self.release(tasks)
+
+    def release(self, tasks):
+        self.filter(pk__in=[task.pk for task in tasks]).update(
+            locked_by=None, locked_until=None
+        )
+
+    def retry(self, tasks, error: str):
+        """Schedule tasks for another attempt with exponential backoff"""
+        now = timezone.now()
+        for task in tasks:
+            task.attempts += 1
+            task.last_error = error
+            task.available_at = now + timedelta(
+                seconds=min(
+                    self.model.RETRY_BASE_SECONDS * 2 ** (task.attempts - 1),
+                    self.model.RETRY_MAX_SECONDS
+                )
+            )
+            task.locked_by = task.locked_until = None
+        self.bulk_update(
+            tasks,
+            ['attempts', 'last_error', 'available_at', 'locked_by', 'locked_until']
+        )
+
+    def stats(self) -> dict:
+        """Summarise how far behind the embedding queue is"""
+        now = timezone.now()
+        summary = self.aggregate(
+            pending=Count('pk', filter=Q(attempts__lt=self.model.MAX_ATTEMPTS)),
+            in_flight=Count('pk', filter=Q(locked_until__gte=now)),
+            retrying=Count(
+                'pk',
+                filter=Q(attempts__gt=0, attempts__lt=self.model.MAX_ATTEMPTS)
+            ),
+            failed=Count('pk', filter=Q(attempts__gte=self.model.MAX_ATTEMPTS)),
+            oldest=Min(
+                'dirtied_at', filter=Q(attempts__lt=self.model.MAX_ATTEMPTS)
+            ),
+        )
+        oldest = summary.pop('oldest')
+        summary['lag_seconds'] = (now - oldest).total_seconds() if oldest else 0
+        return summary
+
+
+class EmbeddingTask(TimestampedModel):
+    """
+    Outbox entry recording that a transaction's vector document is stale.
+    Written in the same database transaction as the change itself and
+    drained in batches by the `process_embeddings` command.
+    """
+    MAX_ATTEMPTS = 5
+    LEASE_SECONDS = 300
+    RETRY_BASE_SECONDS = 30
+    RETRY_MAX_SECONDS = 3600
+
+    transaction_model = models.CharField(
+        max_length=50,
+        help_text="Model name of the transaction, e.g. banktransaction"
+    )
+    transaction_id = models.UUIDField()
+    # Not a foreign key: tasks outlive the transactions and users they point at
+    user_id = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Owner of the transaction, whose vector partition holds its document"
+    )
+
+    dirtied_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    objects = EmbeddingTaskQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('transaction_model', 'transaction_id')
+        indexes = [
+            models.Index(fields=['available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_model} {self.transaction_id} (attempts: {self.attempts})"
@@ -1,6 +1,7 @@
 from decimal import Decimal
 
 from django.db import models
+from model_utils import FieldTracker
 
 from apps.categories.models import SubCategory
 
@@ -11,6 +12,8 @@ class StoreTransaction(AbstractTransaction):
     """Model for retail store transactions"""
     store_location = models.CharField(max_length=200, null=True, blank=True)
 
+    tracker = FieldTracker(fields=['transaction_date', 'merchant'])
+
     @property
     def total_amount(self) -> Decimal:
         """Calculate total amount from associated items"""
@@ -40,6 +43,8 @@ class StoreItem(models.Model):
         related_name='items'
     )
 
+    tracker = FieldTracker(fields=['total_amount'])
+
     def save(self, *args, **kwargs):
         """Calculate total amount before saving"""
         self.total_amount = self.quantity * self.unit_price
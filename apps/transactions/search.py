@@ -0,0 +1,257 @@
+import base64
+import json
+import math
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q, Value
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
+
+from utils.vectordb import get_embeddings, search_vectors
+
+from .models import BankTransaction, StoreTransaction
+
+SEARCH_MODELS = {'bank': BankTransaction, 'store': StoreTransaction}
+TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,}')
+# Reciprocal rank fusion constant; larger values flatten the rank curve
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+def start_of_day(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+class TransactionSearch:
+    """
+    Hybrid search over one user's bank and store transactions.
+
+    Vector similarity comes from the vector store, with the user and the
+    other filters pushed into the query as pre-filters, so other users'
+    vectors are never scanned. A BM25 score over merchant and description
+    comes from the database under the same filters. The two rankings are
+    merged with reciprocal rank fusion.
+
+    The fused ranking is kept in the cache for `TRANSACTION_SEARCH_CURSOR_TTL`
+    seconds, and cursors page through that snapshot, so results do not shift
+    between pages while new transactions are indexed. An expired cursor
+    resumes after its last (score, id) in a fresh ranking.
+    """
+
+    def __init__(self, user, query: str, date_from: date = None, date_to: date = None,
+                 type: str = None, categories: list[str] = None):
+        self.user = user
+        self.query = query.strip()
+        self.terms = list(dict.fromkeys(tokenize(self.query)))
+        self.date_from = date_from
+        self.date_to = date_to
+        self.type = type
+        self.categories = categories or []
+        self.candidates = settings.TRANSACTION_SEARCH_CANDIDATES
+        self.timings = {}
+
+    # Filters
+
+    def vector_filter(self) -> dict:
+        # Atlas only filters on paths declared in `vector_search_index_definition`
+        filter = {'user_id': str(self.user.id)}
+        dates = {}
+        if self.date_from:
+            dates['$gte'] = self.date_from.isoformat()
+        if self.date_to:
+            dates['$lte'] = self.date_to.isoformat()
+        if dates:
+            filter['date'] = dates
+        if self.type:
+            filter['type'] = self.type
+        if self.categories:
+            filter['categories'] = {'$in': self.categories}
+        return filter
+
+    def filter_queryset(self, kind: str):
+        queryset = SEARCH_MODELS[kind].objects.filter(user=self.user)
+        # Bounds on the column itself, not its date, so the index can be used
+        if self.date_from:
+            queryset = queryset.filter(transaction_date__gte=start_of_day(self.date_from))
+        if self.date_to:
+            queryset = queryset.filter(transaction_date__lt=start_of_day(self.date_to + timedelta(days=1)))
+
+        subcategories = 'items__subcategories' if kind == 'store' else 'subcategories'
+        if self.categories:
+            queryset = queryset.filter(**{f'{subcategories}__name__in': self.categories}).distinct()
+        if self.type == 'INCOME':
+            # Mirrors `AbstractTransaction.type`: store purchases are always expenses
+            if kind == 'store':
+                return queryset.none()
+            queryset = queryset.filter(subcategories__category__is_expense=False).distinct()
+        elif self.type == 'EXPENSE' and kind == 'bank':
+            queryset = queryset.exclude(subcategories__category__is_expense=False)
+        return queryset
+
+    # Retrieval
+
+    def _timed(self, name, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        self.timings[name] = time.perf_counter() - started
+        return result
+
+    def vector_ranking(self) -> list[str]:
+        vector = self._timed('embed', get_embeddings().embed_query, self.query)
+        matches = self._timed('vector', search_vectors, vector, self.candidates, self.vector_filter())
+        return [match['transaction_id'] for match in matches]
+
+    def keyword_ranking(self) -> list[str]:
+        """
+        Ids ranked by BM25 over merchant and description. Corpus statistics
+        (size, average length, document frequency per term) come from one
+        aggregate per model; every matching transaction is scored before
+        the top candidates are taken, so older strong matches are not missed.
+        """
+        if not self.terms:
+            return []
+
+        text_length = Length(Coalesce('merchant', Value(''))) + Length(Coalesce('description', Value('')))
+        total, length_sum, frequencies, candidates = 0, 0.0, Counter(), []
+        for kind in SEARCH_MODELS:
+            queryset = self.filter_queryset(kind)
+            matches = {term: Q(merchant__icontains=term) | Q(description__icontains=term) for term in self.terms}
+            stats = queryset.aggregate(
+                total=Count('pk', distinct=True),
+                average_length=Avg(text_length),
+                **{f'df_{i}': Count('pk', filter=match, distinct=True) for i, match in enumerate(matches.values())}
+            )
+            total += stats['total']
+            length_sum += (stats['average_length'] or 0) * stats['total']
+            for i, term in enumerate(self.terms):
+                frequencies[term] += stats[f'df_{i}']
+
+            any_match = Q()
+            for match in matches.values():
+                any_match |= match
+            candidates.extend(queryset.filter(any_match).values_list('id', 'merchant', 'description'))
+
+        if not candidates:
+            return []
+
+        average_length = length_sum / total if total else 1
+        scores = {}
+        for pk, merchant, description in candidates:
+            text = f"{merchant or ''} {description or ''}".lower()
+            length = len(merchant or '') + len(description or '')
+            score = 0.0
+            for term in self.terms:
+                if not (tf := text.count(term)):
+                    continue
+                idf = math.log(1 + (total - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (
+                    tf + BM25_K1 * (1 - BM25_B + BM25_B * length / max(average_length, 1))
+                )
+            scores[str(pk)] = score
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))[:self.candidates]
+
+    def rank(self) -> list[tuple[str, float]]:
+        """Fused (transaction id, score) pairs, best first, ties broken by id"""
+        scores = Counter()
+        for ranking in (self.vector_ranking(), self._timed('keyword', self.keyword_ranking)):
+            for position, pk in enumerate(ranking):
+                scores[pk] += 1 / (RRF_K + position + 1)
+        return sorted(((pk, round(score, 8)) for pk, score in scores.items()), key=lambda hit: (-hit[1], hit[0]))
+
+    # Pagination
+
+    def fingerprint(self) -> list:
+        return [
+            self.user.id, self.query.lower(),
+            self.date_from and self.date_from.isoformat(),
+            self.date_to and self.date_to.isoformat(),
+            self.type, sorted(self.categories),
+        ]
+
+    @staticmethod
+    def encode_cursor(snapshot: str, offset: int, last: tuple[str, float]) -> str:
+        data = json.dumps({'s': snapshot, 'o': offset, 'a': [last[1], last[0]]})
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> dict:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return {'snapshot': str(data['s']), 'offset': int(data['o']), 'after': (float(data['a'][0]), str(data['a'][1]))}
+        except (ValueError, KeyError, TypeError, IndexError):
+            raise InvalidCursor('Invalid cursor')
+
+    def ranking(self, cursor: dict = None) -> tuple[str, list, int]:
+        """The ranking snapshot a page is cut from, and the offset to start at"""
+        if cursor:
+            snapshot = cache.get(f"search:{cursor['snapshot']}")
+            if snapshot and snapshot['fingerprint'] == self.fingerprint():
+                return cursor['snapshot'], snapshot['hits'], cursor['offset']
+
+        key = uuid.uuid4().hex
+        hits = self.rank()
+        cache.set(
+            f"search:{key}", {'fingerprint': self.fingerprint(), 'hits': hits},
+            timeout=settings.TRANSACTION_SEARCH_CURSOR_TTL
+        )
+        offset = 0
+        if cursor:
+            # Resume after the last result the client saw
+            score, pk = cursor['after']
+            offset = next(
+                (i for i, (hit_pk, hit_score) in enumerate(hits) if (-hit_score, hit_pk) > (-score, pk)),
+                len(hits)
+            )
+        return key, hits, offset
+
+    def hydrate(self, ids: list[str]) -> dict:
+        instances = {}
+        for kind, model in SEARCH_MODELS.items():
+            related = 'items__subcategories' if kind == 'store' else 'subcategories'
+            for instance in model.objects.filter(user=self.user, id__in=ids).prefetch_related(related):
+                instance.kind = kind
+                instances[str(instance.id)] = instance
+        return instances
+
+    def page(self, limit: int = 20, cursor: str = None) -> tuple[list, str]:
+        """
+        One page of matching transactions, each annotated with its `kind`
+        and fused `score`, and the cursor for the next page (or None).
+        Transactions deleted since they were indexed are skipped.
+        """
+        started = time.perf_counter()
+        snapshot, hits, offset = self.ranking(self.decode_cursor(cursor) if cursor else None)
+        page_hits = hits[offset:offset + limit]
+
+        instances = self._timed('hydrate', self.hydrate, [pk for pk, _ in page_hits])
+        results = []
+        for pk, score in page_hits:
+            if instance := instances.get(pk):
+                instance.score = score
+                results.append(instance)
+
+        next_cursor = None
+        if offset + limit < len(hits):
+            next_cursor = self.encode_cursor(snapshot, offset + limit, page_hits[-1])
+        self.timings['total'] = time.perf_counter() - started
+        return results, next_cursor
+
+
+def server_timing(timings: dict) -> str:
+    """Format stage timings for a Server-Timing response header"""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from rest_framework import serializers
+
+from apps.categories.services import find_subcategories
+
+# The largest amount a `DecimalField(max_digits=10, decimal_places=2)` holds
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+class TransactionSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=500)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    type = serializers.ChoiceField(choices=['EXPENSE', 'INCOME'], required=False)
+    category = serializers.ListField(child=serializers.CharField(), required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    cursor = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': 'Must not be before date_from.'})
+        return attrs
+
+
+class InsightQuestionSerializer(serializers.Serializer):
+    question = serializers.CharField(max_length=500)
+
+
+class ReceiptItemSerializer(serializers.Serializer):
+    category = serializers.CharField(required=False, allow_blank=True)
+    name = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    parent_category = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs['quantity'] * attrs['unit_price'] > MAX_AMOUNT:
+            raise serializers.ValidationError({'quantity': f'The item total must not exceed {MAX_AMOUNT}.'})
+        # Subcategory names repeat across categories, so one that does needs
+        # its category; unknown names are stored uncategorised
+        attrs['subcategory'] = None
+        if attrs.get('category'):
+            matches = find_subcategories(attrs['category'], attrs.get('parent_category') or None)
+            if len(matches) > 1:
+                raise serializers.ValidationError(
+                    {'parent_category': f"'{attrs['category']}' is in several categories; name its category."}
+                )
+            attrs['subcategory'] = matches[0] if matches else None
+        return attrs
+
+
+class ReceiptSerializer(serializers.Serializer):
+    """A receipt as extracted by the upload endpoints, possibly corrected by the user"""
+    store_location = serializers.CharField(max_length=200, required=False, allow_blank=True, allow_null=True)
+    date_time = serializers.DateTimeField(required=False, allow_null=True)
+    items = ReceiptItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        if sum(item['quantity'] * item['unit_price'] for item in items) > MAX_AMOUNT:
+            raise serializers.ValidationError(f'The receipt total must not exceed {MAX_AMOUNT}.')
+        return items
+
+
+class TransactionSearchResultSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    kind = serializers.CharField()
+    merchant = serializers.CharField()
+    description = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    transaction_date = serializers.DateTimeField()
+    type = serializers.CharField()
+    is_recurring = serializers.BooleanField()
+    categories = serializers.SerializerMethodField()
+    score = serializers.FloatField()
+
+    def get_categories(self, instance) -> list[str]:
+        if instance.kind == 'store':
+            subcategories = [
+                subcategory for item in instance.items.all() for subcategory in item.subcategories.all()
+            ]
+        else:
+            subcategories = instance.subcategories.all()
+        return list(dict.fromkeys(subcategory.name for subcategory in subcategories))
@@ -1,28 +1,36 @@
+import hashlib
+import io
 import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+from typing import Iterator
 
-import google.generativeai as genai
-import PIL.Image
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.utils import timezone
 
-from apps.categories.models import SubCategory
+from apps.budget.services import recompute_budgets
+from apps.categories.services import get_tree, subcategory_choices
+from utils import providers
 
-genai.configure(api_key=settings.GEMINI_API_KEY)
-model = genai.GenerativeModel(settings.GEMINI_MODEL)
+from .insights import bump_data_version
+from .models import EmbeddingTask, StoreItem, StoreTransaction
 
+logger = logging.getLogger(__name__)
 
-def get_receipt_data(image_path=None):
-    image = PIL.Image.open(image_path)
-    subcatgories = SubCategory.objects.values_list("name", flat=True)
-    subcatgories_string = ", ".join(subcatgories)
-
-    prompt = f"""
+RECEIPT_PROMPT = """
     Return the transaction details in the receipt in JSON format.
-    Use this JSON schema: 
+    Use this JSON schema:
     Transaction = {{
         store_location: str,
         date_time: str (ISO 8601 standard),
         items: [{{
-            category: str (select one from here: {subcatgories_string}),
+            category: str (select one from here, without the part in brackets: {subcategories}),
+            parent_category: str (the part in brackets after the selected category),
             name: str,
             quantity: int,
             unit_price: float
@@ -31,7 +39,84 @@ def get_receipt_data(image_path=None):
     Return: dict[Transaction]
     """
 
-    response = model.generate_content([prompt, image])
+
+class InvalidReceiptImage(ValueError):
+    pass
+
+
+_prompt_lock = threading.Lock()
+_prompt = (None, None, None)
+
+
+@providers.register("gemini")
+def _gemini_model():
+    import google.generativeai as genai
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel(settings.GEMINI_MODEL)
+
+
+def receipt_prompt() -> tuple[str, str]:
+    """
+    The extraction prompt and a hash of it, rebuilt only when the category
+    tree is reloaded, as the subcategory list is the only part that changes.
+    """
+    global _prompt
+    tree = get_tree()
+    if _prompt[0] is not tree:
+        with _prompt_lock:
+            prompt = RECEIPT_PROMPT.format(subcategories=", ".join(subcategory_choices()))
+            _prompt = (tree, prompt, hashlib.sha256(prompt.encode()).hexdigest()[:16])
+    return _prompt[1], _prompt[2]
+
+
+def normalise_receipt_image(image_file) -> bytes:
+    """
+    Orient the photo by its EXIF tag, shrink it to fit within
+    `RECEIPT_MAX_DIMENSION` pixels and recompress it as JPEG. Receipt text
+    stays legible well below phone camera resolution, and the smaller
+    upload is faster to send and to process.
+    """
+    import PIL.Image
+    import PIL.ImageOps
+
+    try:
+        with PIL.Image.open(image_file) as image:
+            image = PIL.ImageOps.exif_transpose(image)
+            image.thumbnail((settings.RECEIPT_MAX_DIMENSION, settings.RECEIPT_MAX_DIMENSION))
+            output = io.BytesIO()
+            image.convert("RGB").save(
+                output, format="JPEG", quality=settings.RECEIPT_JPEG_QUALITY, optimize=True
+            )
+    except (PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError) as e:
+        raise InvalidReceiptImage(str(e))
+    return output.getvalue()
+
+
+def receipt_hash(image_file) -> str:
+    """Content hash of the uploaded file, so re-uploads hit the cache before decoding"""
+    image_file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: image_file.read(1 << 20), b""):
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def receipt_cache_key(content_hash: str, prompt_hash: str = None) -> str:
+    # A new category list or model can extract differently
+    prompt_hash = prompt_hash or receipt_prompt()[1]
+    return f"receipts:{settings.GEMINI_MODEL}:{prompt_hash}:{content_hash}"
+
+
+def get_cached_receipt(content_hash: str, prompt_hash: str = None):
+    return cache.get(receipt_cache_key(content_hash, prompt_hash))
+
+
+def extract_receipt_data(image: bytes, model=None, prompt: str = None) -> dict:
+    """Send a normalised receipt image to the model and parse its JSON reply"""
+    model = model or providers.get("gemini")
+    prompt = prompt or receipt_prompt()[0]
+    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image}])
     json_string = response.text
 
     cleaned_string = json_string.replace("```json\n", "").replace("\n```", "")
@@ -44,3 +129,127 @@ def get_receipt_data(image_path=None):
         )
 
     return transaction_data
+
+
+def process_receipt(image: bytes, content_hash: str, model=None, prompt: tuple[str, str] = None) -> dict:
+    """
+    Extract a normalised receipt image and cache the result under its
+    upload's hash. `prompt` is the (prompt, hash) pair from `receipt_prompt`.
+    """
+    prompt, prompt_hash = prompt or receipt_prompt()
+    transaction_data = extract_receipt_data(image, model, prompt)
+    cache.set(
+        receipt_cache_key(content_hash, prompt_hash), transaction_data, timeout=settings.RECEIPT_CACHE_TTL
+    )
+    return transaction_data
+
+
+def get_receipt_data(image_path=None, model=None):
+    """
+    Extract a receipt's transaction details from an image path or file.
+    Results are cached by the file's content hash, so duplicate uploads
+    skip the model.
+    """
+    if isinstance(image_path, str):
+        with open(image_path, "rb") as image_file:
+            return get_receipt_data(image_file, model)
+
+    content_hash = receipt_hash(image_path)
+    if (cached := get_cached_receipt(content_hash)) is not None:
+        return cached
+    return process_receipt(normalise_receipt_image(image_path), content_hash, model)
+
+
+def _extract_upload(image_file, model, prompt: tuple[str, str]) -> dict:
+    started = time.perf_counter()
+    content_hash = receipt_hash(image_file)
+    if (transaction_data := get_cached_receipt(content_hash, prompt[1])) is not None:
+        cached = True
+    else:
+        cached = False
+        transaction_data = process_receipt(normalise_receipt_image(image_file), content_hash, model, prompt)
+    return {'data': transaction_data, 'cached': cached, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def extract_receipts(image_files: list, model=None) -> Iterator[dict]:
+    """
+    Extract several receipts on a pool of `RECEIPT_BATCH_CONCURRENCY`
+    threads, yielding each result as soon as it is ready, so a batch takes
+    about as long as its slowest receipt. A receipt that fails yields an
+    error result instead of failing the batch.
+    """
+    # The prompt is resolved once here and handed to the workers, as
+    # building it reads the category tree, and pool threads would open
+    # database connections that nothing closes
+    prompt = receipt_prompt()
+    executor = ThreadPoolExecutor(
+        max_workers=settings.RECEIPT_BATCH_CONCURRENCY, thread_name_prefix='receipt'
+    )
+    try:
+        futures = {
+            executor.submit(_extract_upload, image_file, model, prompt): (index, image_file)
+            for index, image_file in enumerate(image_files)
+        }
+        for future in as_completed(futures):
+            index, image_file = futures[future]
+            result = {'index': index, 'filename': getattr(image_file, 'name', None)}
+            try:
+                yield {**result, 'status': 'ok', **future.result()}
+            except InvalidReceiptImage:
+                yield {**result, 'status': 'error', 'error': 'The file is not a supported image.'}
+            except Exception as e:
+                logger.error(f"Failed to extract receipt {result['filename']}: {e}")
+                yield {**result, 'status': 'error', 'error': 'Failed to extract receipt data.'}
+    finally:
+        # A client that disconnects stops the receipts that have not started
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ingest_receipt(user, receipt: dict) -> StoreTransaction:
+    """
+    Store an extracted receipt as a `StoreTransaction` and its `StoreItem`s.
+    Saving each item and re-saving the parent re-sums the items and fires
+    the embedding, recurrence and budget signals once per row, so the rows
+    are bulk-created with totals computed here instead, and those updates
+    run once for the whole receipt.
+    """
+    store_location = receipt.get('store_location') or None
+    items = [
+        StoreItem(
+            name=item['name'],
+            quantity=item['quantity'],
+            unit_price=item['unit_price'],
+            total_amount=item['quantity'] * item['unit_price'],
+        )
+        for item in receipt.get('items', [])
+    ]
+    # Resolved against the category tree by `ReceiptSerializer`
+    subcategories = [item.get('subcategory') for item in receipt.get('items', [])]
+    store_transaction = StoreTransaction(
+        user=user,
+        merchant=store_location,
+        store_location=store_location,
+        transaction_date=receipt.get('date_time') or timezone.now(),
+        amount=sum((item.total_amount for item in items), Decimal('0')),
+    )
+
+    with db_transaction.atomic():
+        StoreTransaction.objects.bulk_create([store_transaction])
+        for item in items:
+            item.transaction = store_transaction
+        StoreItem.objects.bulk_create(items)
+        StoreItem.subcategories.through.objects.bulk_create([
+            StoreItem.subcategories.through(storeitem_id=item.id, subcategory_id=subcategory.id)
+            for item, subcategory in zip(items, subcategories)
+            if subcategory is not None
+        ])
+
+        changed = StoreTransaction.refresh_recurring(user, merchants=[store_location])
+        recompute_budgets([store_transaction])
+        # bulk writes skip post_save, so queue the embedding here
+        EmbeddingTask.objects.enqueue(
+            [store_transaction, *(other for other in changed if other.pk != store_transaction.pk)]
+        )
+        bump_data_version([user.id])
+
+    return store_transaction
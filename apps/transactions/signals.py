@@ -1,26 +1,42 @@
 import logging
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from utils.vectordb import get_vector_store, vectors_collection
-
-from .models import BankTransaction, StoreTransaction
+from .insights import bump_data_version
+from .models import (BankTransaction, EmbeddingTask, ManualTransaction,
+                     StoreItem, StoreTransaction)
 
 logger = logging.getLogger(__name__)
 
 
-@receiver(post_save, sender=BankTransaction)
-@receiver(post_save, sender=StoreTransaction)
-def update_embeddings(sender, instance, created, *args, **kwargs):
-    try:
-        vector_document = instance.to_vector_document()
-        vector_store = get_vector_store()
-
-        if not created:
-            vectors_collection.delete_one({'transaction_id': str(instance.id)})
-
-        vector_store.add_documents([vector_document])
-
-    except Exception as e:
-        logger.error(f"Failed to update embeddings for {instance}: {e}")
+@receiver([post_save, post_delete], sender=BankTransaction)
+@receiver([post_save, post_delete], sender=StoreTransaction)
+def update_embeddings(sender, instance, *args, **kwargs):
+    # Only mark the transaction as dirty; `process_embeddings` does the
+    # inference and vector writes off the request path
+    EmbeddingTask.objects.enqueue([instance])
+    bump_data_version([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=BankTransaction)
+@receiver([post_save, post_delete], sender=StoreTransaction)
+@receiver([post_save, post_delete], sender=ManualTransaction)
+def update_recurrence(sender, instance, *args, **kwargs):
+    # Re-check only this merchant's history, and the one it was renamed
+    # from; rows whose flag flips need their vector metadata rewritten too
+    merchants = [instance.merchant]
+    if kwargs.get('created') is False and instance.tracker.has_changed('merchant'):
+        merchants.append(instance.tracker.previous('merchant'))
+    changed = sender.refresh_recurring(instance.user_id, merchants=merchants)
+    # Manual transactions are not in the vector index
+    if changed and sender is not ManualTransaction:
+        EmbeddingTask.objects.enqueue(changed)
+
+
+@receiver([post_save, post_delete], sender=StoreItem)
+def update_store_embeddings(sender, instance, *args, **kwargs):
+    # The user's answers are invalidated once the re-embedded document lands
+    EmbeddingTask.objects.enqueue([
+        StoreTransaction(pk=instance.transaction_id, user_id=instance.transaction.user_id)
+    ])
@@ -1,3 +1,843 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+import PIL.Image
+from django.conf import settings
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.accounts.models import BankAccount
+from apps.budget.models import Budget
+from apps.categories.models import Category, SubCategory
+from apps.categories.services import clear_category_cache, get_tree
+from apps.jobs.models import Job
+from apps.jobs.registry import run_job
+from utils import providers
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_service import RemoteEmbeddings, create_server
+from utils.local_vectors import LocalVectorIndex, LocalVectorStore
+from utils.vectordb import vector_search_index_definition
+
+from .embeddings import process_tasks
+from .management.commands.benchmark_receipts import StubReceiptModel
+from .models import (BankTransaction, EmbeddingTask, ManualTransaction,
+                     StoreItem, StoreTransaction)
+from .search import TransactionSearch
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        # Queries embed differently from documents, as with BGE's instruction
+        self.embedded.append(f'query: {text}')
+        return [-float(len(text))]
+
+
+class EmbeddingQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='embedder')
+        cls.bank_account = BankAccount.objects.create(
+            user=cls.user, name='Checking', account_id='test-account'
+        )
+        category = Category.objects.create(name='test food', description='Food')
+        cls.subcategories = SubCategory.objects.bulk_create([
+            SubCategory(name='test groceries', category=category),
+            SubCategory(name='test snacks', category=category),
+        ])
+
+    def create_bank_transactions(self, count):
+        transactions = BankTransaction.objects.bulk_create([
+            BankTransaction(
+                user=self.user,
+                bank_account=self.bank_account,
+                merchant='Netflix',
+                amount=Decimal('15.99'),
+                transaction_date=timezone.now() - timedelta(days=30 * i),
+            )
+            for i in range(count)
+        ])
+        BankTransaction.subcategories.through.objects.bulk_create([
+            BankTransaction.subcategories.through(
+                banktransaction_id=transaction.id, subcategory_id=subcategory.id
+            )
+            for transaction in transactions
+            for subcategory in self.subcategories
+        ])
+
+    def create_store_transactions(self, count):
+        transactions = StoreTransaction.objects.bulk_create([
+            StoreTransaction(
+                user=self.user,
+                merchant='Jumia',
+                store_location='Lagos',
+                amount=Decimal('20.00'),
+                transaction_date=timezone.now(),
+            )
+            for _ in range(count)
+        ])
+        items = StoreItem.objects.bulk_create([
+            StoreItem(
+                transaction=transaction, name=f'Item {i}',
+                quantity=2, unit_price=Decimal('5.00'), total_amount=Decimal('10.00')
+            )
+            for transaction in transactions
+            for i in range(2)
+        ])
+        StoreItem.subcategories.through.objects.bulk_create([
+            StoreItem.subcategories.through(
+                storeitem_id=item.id, subcategory_id=self.subcategories[0].id
+            )
+            for item in items
+        ])
+
+    def render(self, model):
+        return [
+            instance.to_vector_document()
+            for instance in model.objects.filter(user=self.user).for_embedding()
+        ]
+
+    def test_bank_documents_use_constant_queries(self):
+        self.create_bank_transactions(3)
+        get_tree()
+        # transactions (with profile), subcategories; categories are cached
+        with self.assertNumQueries(2):
+            self.render(BankTransaction)
+
+        self.create_bank_transactions(7)
+        with self.assertNumQueries(2):
+            documents = self.render(BankTransaction)
+
+        self.assertEqual(len(documents), 10)
+        self.assertEqual(
+            documents[0].metadata['categories'], ['test groceries', 'test snacks']
+        )
+        self.assertIn('Category: test groceries | test snacks', documents[0].page_content)
+
+    def test_store_documents_use_constant_queries(self):
+        self.create_store_transactions(2)
+        # transactions (with profile), items, item subcategories
+        with self.assertNumQueries(3):
+            self.render(StoreTransaction)
+
+        self.create_store_transactions(8)
+        with self.assertNumQueries(3):
+            documents = self.render(StoreTransaction)
+
+        self.assertEqual(len(documents), 10)
+        self.assertIn('Total Items: 2', documents[0].page_content)
+
+    def test_detects_monthly_recurring_charges(self):
+        self.create_bank_transactions(3)
+        BankTransaction.objects.bulk_create([
+            BankTransaction(
+                user=self.user, bank_account=self.bank_account, merchant='Netflix',
+                amount=Decimal('80.00'), transaction_date=timezone.now()
+            ),
+            BankTransaction(
+                user=self.user, bank_account=self.bank_account, merchant='Corner Shop',
+                amount=Decimal('15.99'), transaction_date=timezone.now()
+            ),
+        ])
+
+        with self.assertNumQueries(2):
+            BankTransaction.refresh_recurring(self.user)
+
+        recurring = BankTransaction.objects.filter(user=self.user, is_recurring=True)
+        self.assertEqual(recurring.count(), 3)
+        self.assertEqual(set(recurring.values_list('recurrence_period', flat=True)), {'monthly'})
+
+    def test_renaming_a_merchant_refreshes_its_old_group(self):
+        self.create_bank_transactions(2)
+        BankTransaction.refresh_recurring(self.user)
+        renamed, remaining = BankTransaction.objects.filter(user=self.user)
+
+        renamed.merchant = 'Netflix Premium'
+        renamed.save()
+
+        # Each name now has a single charge, so neither recurs
+        remaining.refresh_from_db()
+        self.assertEqual((remaining.is_recurring, remaining.recurrence_period), (False, None))
+        self.assertFalse(BankTransaction.objects.filter(user=self.user, is_recurring=True).exists())
+
+    def test_manual_transactions_are_refreshed_on_save(self):
+        for days in (30, 0):
+            ManualTransaction.objects.create(
+                user=self.user, merchant='Gym', amount=Decimal('25.00'),
+                transaction_date=timezone.now() - timedelta(days=days)
+            )
+
+        self.assertEqual(
+            set(ManualTransaction.objects.values_list('is_recurring', 'recurrence_period')), {(True, 'monthly')}
+        )
+        self.assertFalse(EmbeddingTask.objects.filter(transaction_model='manualtransaction').exists())
+
+    def test_migration_backfills_rows_that_predate_the_flags(self):
+        self.create_bank_transactions(3)
+        backfill = importlib.import_module('apps.transactions.migrations.0006_backfill_recurrence')
+        backfill.backfill_recurrence(apps, None)
+
+        self.assertEqual(
+            set(BankTransaction.objects.values_list('is_recurring', 'recurrence_period')), {(True, 'monthly')}
+        )
+
+
+class NumberedEmbeddings:
+    """Embeds `text-N` as [N] and records the size of each inference call"""
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        return [[float(text.split('-')[1])] for text in texts]
+
+    def embed_query(self, text):
+        return [-float(text.split('-')[1])]
+
+
+class EmbeddingServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.model = NumberedEmbeddings()
+        # Batches close on size alone, so grouping does not depend on timing
+        server = create_server(self.model, '127.0.0.1', 0, max_batch_size=4, max_wait=5)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.batcher = server.batcher
+        self.url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def embed_concurrently(self, *requests):
+        """Send each list of numbers as its own request, all at once"""
+        client = RemoteEmbeddings(self.url)
+        results = [None] * len(requests)
+
+        def send(index):
+            results[index] = client.embed_documents([f'text-{n}' for n in requests[index]])
+
+        threads = [threading.Thread(target=send, args=(index,)) for index in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        return results
+
+    def test_concurrent_requests_share_a_batch(self):
+        self.assertEqual(self.embed_concurrently([1], [2, 3, 4]), [[[1.0]], [[2.0], [3.0], [4.0]]])
+        self.assertEqual(self.embed_concurrently([5, 6], [7, 8]), [[[5.0], [6.0]], [[7.0], [8.0]]])
+
+        self.assertEqual(self.model.batches, [4, 4])
+        self.assertEqual(
+            {key: self.batcher.stats[key] for key in ('requests', 'documents', 'batches')},
+            {'requests': 4, 'documents': 8, 'batches': 2}
+        )
+
+    def test_oversized_requests_are_split_and_returned_in_order(self):
+        numbers = list(range(10))
+        self.assertEqual(self.embed_concurrently(numbers), [[[float(n)] for n in numbers]])
+        self.assertEqual(self.model.batches, [4, 4, 2])
+
+    def test_queries_use_the_models_query_embedding(self):
+        self.batcher.max_wait = 0.01
+        client = RemoteEmbeddings(self.url)
+        self.assertEqual(client.embed_query('text-3'), [-3.0])
+        self.assertEqual(client.embed_documents(['text-3']), [[3.0]])
+        self.assertEqual((self.batcher.stats['queries'], self.batcher.stats['documents']), (1, 1))
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def test_only_unseen_texts_reach_the_model(self):
+        model = CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, 'test-model', max_size=2)
+
+        self.assertEqual(embeddings.embed_documents(['netflix', 'netflix', 'rent']), [[7.0], [7.0], [4.0]])
+        self.assertEqual(embeddings.embed_documents(['rent', 'netflix']), [[4.0], [7.0]])
+        self.assertEqual(model.embedded, ['netflix', 'rent'])
+
+        # 'rent' was used least recently, so it is evicted first
+        embeddings.embed_documents(['salary'])
+        embeddings.embed_documents(['netflix', 'rent'])
+        self.assertEqual(model.embedded, ['netflix', 'rent', 'salary', 'rent'])
+        self.assertEqual(embeddings.cache.snapshot()['evictions'], 2)
+
+    def test_queries_are_embedded_and_cached_apart_from_documents(self):
+        model = CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, 'test-model')
+
+        self.assertEqual(embeddings.embed_documents(['netflix']), [[7.0]])
+        self.assertEqual(embeddings.embed_query('netflix'), [-7.0])
+        self.assertEqual(embeddings.embed_query('netflix'), [-7.0])
+        self.assertEqual(model.embedded, ['netflix', 'query: netflix'])
+
+
+class ProcessEmbeddingTasksTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='reindexer')
+        cls.bank_account = BankAccount.objects.create(
+            user=cls.user, name='Checking', account_id='test-reindex'
+        )
+
+    def setUp(self):
+        self.stored = {}
+
+        def upsert(documents, vectors):
+            for document in documents:
+                self.stored[document.metadata['transaction_id']] = document.metadata['content_hash']
+
+        self.model = CountingEmbeddings()
+        for name, patched in [
+            ('get_embeddings', lambda: self.model),
+            ('get_stored_hashes', lambda ids, user_ids: {pk: self.stored.get(pk) for pk in ids}),
+            ('upsert_vector_documents', upsert),
+            ('delete_vector_documents', lambda ids, user_ids: None),
+        ]:
+            patcher = mock.patch(f'apps.transactions.embeddings.{name}', patched)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def process(self):
+        return process_tasks(EmbeddingTask.objects.claim('test', 100))
+
+    def test_resaves_that_leave_the_text_unchanged_are_skipped(self):
+        transaction = BankTransaction.objects.create(
+            user=self.user, bank_account=self.bank_account, merchant='Spotify',
+            amount=Decimal('9.99'), transaction_date=timezone.now()
+        )
+        self.assertEqual(self.process()['indexed'], 1)
+
+        transaction.save()
+        self.assertEqual(self.process(), {'indexed': 0, 'unchanged': 1, 'deleted': 0, 'failed': 0})
+        self.assertEqual(len(self.model.embedded), 1)
+
+        transaction.merchant = 'Spotify Premium'
+        transaction.save()
+        self.assertEqual(self.process()['indexed'], 1)
+        self.assertEqual(len(self.model.embedded), 2)
+
+
+class LocalVectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def document(self, pk, user_id='1', **metadata):
+        return {'text': f'transaction {pk}', 'transaction_id': str(pk), 'user_id': user_id, **metadata}
+
+    def ids(self, results) -> list[str]:
+        return [result['transaction_id'] for result in results]
+
+    def test_upsert_replaces_and_filters_use_metadata(self):
+        index = LocalVectorIndex(self.root)
+        index.upsert([
+            self.document(1, date='2025-01-10', amount=20.0, categories=['groceries']),
+            self.document(2, date='2025-02-10', amount=80.0, categories=['dining', 'groceries']),
+            self.document(3, date='2025-02-20', amount=5.0, categories=['transport']),
+            self.document(4, user_id='2', date='2025-02-11', amount=50.0, categories=['groceries']),
+        ], [[1, 0], [0.9, 0.1], [0, 1], [1, 0]])
+        index.upsert([self.document(1, date='2025-03-01', amount=20.0, categories=['groceries'])], [[0.5, 0.5]])
+
+        self.assertEqual(self.ids(index.search([1, 0], k=2, filter={'user_id': '1'})), ['2', '1'])
+        self.assertEqual(self.ids(index.search([1, 0], filter={
+            'user_id': '1', 'date': {'$gte': '2025-02-01', '$lt': '2025-03-01'}, 'categories': 'groceries'
+        })), ['2'])
+        self.assertEqual(self.ids(index.search([1, 0], filter={'amount': {'$gt': 10}})), ['4', '2', '1'])
+
+        # Another process sees the write; deletes find the owning partition
+        LocalVectorIndex(self.root).delete(['2'])
+        self.assertEqual(self.ids(index.search([1, 0], filter={'user_id': '1'})), ['1', '3'])
+
+    def test_owners_limit_reads_to_their_partitions(self):
+        index = LocalVectorIndex(self.root)
+        index.upsert([self.document(1), self.document(2, user_id='2')], [[1, 0], [0, 1]])
+        index.partition = mock.Mock(wraps=index.partition)
+
+        self.assertEqual(index.stored_hashes(['1'], 'text', user_ids=[1]), {'1': 'transaction 1'})
+        index.delete(['1'], user_ids=[1])
+        self.assertEqual({call.args[0] for call in index.partition.call_args_list}, {'1'})
+        self.assertEqual(self.ids(index.search([1, 0])), ['2'])
+
+    def test_ivf_search_matches_brute_force_on_clustered_data(self):
+        rng = np.random.default_rng(0)
+        centres = rng.normal(size=(16, 8))
+        vectors = centres[rng.integers(16, size=700)] + rng.normal(0, 0.1, (700, 8))
+        index = LocalVectorIndex(self.root, nprobe=4, ivf_min_size=200, log_min_rows=0)
+
+        def assertMatchesBruteForce():
+            for query in vectors[:20]:
+                exact = [result['transaction_id'] for result in index.search(query, 5, exact=True)]
+                approximate = [result['transaction_id'] for result in index.search(query, 5)]
+                self.assertEqual(approximate, exact)
+
+        index.upsert([self.document(i) for i in range(500)], vectors[:500])
+        # Logged rows sit outside the IVF lists and are always searched
+        index.upsert([self.document(i) for i in range(500, 600)], vectors[500:600])
+        partition = index.partition('1')
+        self.assertEqual((len(partition.ivf['assignments']), len(partition.log)), (500, 100))
+        assertMatchesBruteForce()
+
+        # Outgrowing a quarter of the partition rewrites it, assigning the new rows
+        index.upsert([self.document(i) for i in range(600, 700)], vectors[600:])
+        partition = index.partition('1')
+        self.assertEqual((len(partition.ivf['assignments']), len(partition.log)), (700, 0))
+        assertMatchesBruteForce()
+
+    def test_upserts_append_to_the_log_until_it_is_rewritten(self):
+        index = LocalVectorIndex(self.root, log_min_rows=3)
+        index.upsert([self.document(1), self.document(2)], [[1, 0], [0, 1]])
+        generation = index.partition('1').generation
+
+        index.upsert([self.document(1, label='replaced'), self.document(3)], [[0.6, 0.8], [1, 1]])
+        reader = LocalVectorIndex(self.root)
+        for partition in (index.partition('1'), reader.partition('1')):
+            self.assertEqual((partition.generation, len(partition.log)), (generation, 2))
+        self.assertEqual(reader.count(), 3)
+        self.assertEqual(
+            [(result['transaction_id'], result.get('label')) for result in reader.search([0, 1], k=3)],
+            [('2', None), ('1', 'replaced'), ('3', None)]
+        )
+
+        # Whatever a writer that died before committing left is overwritten
+        for name in ('jsonl', 'f32'):
+            with open(f'{self.root}/users/1/log-{generation}.{name}', 'ab') as log:
+                log.write(b'{"partial')
+        index.upsert([self.document(4)], [[1, 0]])
+        self.assertEqual((len(reader.partition('1').log), reader.count()), (3, 4))
+        self.assertEqual(self.ids(reader.search([1, 0], k=1)), ['4'])
+
+        index.upsert([self.document(5)], [[-1, 0]])
+        partition = reader.partition('1')
+        self.assertNotEqual(partition.generation, generation)
+        self.assertEqual((len(partition), len(partition.log)), (5, 0))
+        self.assertEqual(self.ids(reader.search([0, 1], k=2)), ['2', '1'])
+
+    def test_store_rejects_documents_without_an_owner(self):
+        store = LocalVectorStore(CountingEmbeddings(), LocalVectorIndex(self.root))
+        with self.assertRaises(ValueError):
+            store.add_texts(['rent'], [{'date': '2025-01-01'}])
+        [pk] = store.add_texts(['rent'], [{'user_id': '1'}])
+        self.assertEqual(self.ids(store.index.search([1], filter={'user_id': '1'})), [pk])
+
+
+class BagOfWordsEmbeddings(CountingEmbeddings):
+    """Texts sharing words get similar vectors"""
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            vector = [0.0] * 64
+            for word in re.findall(r'[a-z]+', text.lower()):
+                vector[zlib.crc32(word.encode()) % 64] += 1
+            vectors.append(vector)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@override_settings(VECTOR_STORE_BACKEND='local', TRANSACTION_SEARCH_CANDIDATES=10)
+class LocalVectorStoreTestCase(TestCase):
+    """Two users' bank transactions, indexed in a temporary local vector store"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='searcher')
+        cls.other = get_user_model().objects.create(username='other-searcher')
+        accounts = BankAccount.objects.bulk_create([
+            BankAccount(user=user, name='Checking', account_id=f'search-{user.username}')
+            for user in (cls.user, cls.other)
+        ])
+        now = timezone.now()
+        cls.transactions = BankTransaction.objects.bulk_create([
+            BankTransaction(
+                user=user, bank_account=account, merchant=merchant, description=description,
+                amount=Decimal('10.00'), transaction_date=now - timedelta(days=days)
+            )
+            for user, account in zip((cls.user, cls.other), accounts)
+            for merchant, description, days in [
+                ('Pizza Palace', 'pizza dinner', 1),
+                ('Burger Barn', 'burger lunch', 2),
+                ('City Transit', 'bus pass', 3),
+                ('Pizza Express', 'pizza with friends', 40),
+            ]
+        ])
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        local_dir = override_settings(LOCAL_VECTOR_DIR=directory.name)
+        local_dir.enable()
+        self.addCleanup(local_dir.disable)
+        patchers = [
+            mock.patch('apps.transactions.embeddings.get_embeddings', BagOfWordsEmbeddings),
+            mock.patch('apps.transactions.search.get_embeddings', BagOfWordsEmbeddings),
+            mock.patch('apps.transactions.insights.get_embeddings', BagOfWordsEmbeddings),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        providers.reset('vector_backend')
+        self.addCleanup(providers.reset, 'vector_backend')
+        BankTransaction.objects.bulk_embed()
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class TransactionSearchTests(LocalVectorStoreTestCase):
+    def search(self, **params):
+        response = self.client.get(reverse('api-v1:transaction_search'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        return response
+
+    def test_results_are_limited_to_the_user_and_filters(self):
+        response = self.search(q='pizza')
+        self.assertIn('vector;dur=', response['Server-Timing'])
+        results = response.json()['results']
+        self.assertEqual([result['merchant'] for result in results[:2]], ['Pizza Palace', 'Pizza Express'])
+        own = {str(transaction.id) for transaction in self.transactions if transaction.user_id == self.user.id}
+        self.assertTrue({result['id'] for result in results} <= own)
+
+        date_from = (timezone.now() - timedelta(days=10)).date().isoformat()
+        results = self.search(q='pizza', date_from=date_from).json()['results']
+        self.assertEqual(results[0]['merchant'], 'Pizza Palace')
+        self.assertNotIn('Pizza Express', [result['merchant'] for result in results])
+
+    def test_cursor_pages_do_not_overlap(self):
+        first = self.search(q='pizza burger bus', limit=2).json()
+        self.assertIsNotNone(first['next_cursor'])
+        # Later pages are cut from the cached ranking without searching again
+        response = self.search(q='pizza burger bus', limit=2, cursor=first['next_cursor'])
+        self.assertNotIn('vector;dur=', response['Server-Timing'])
+        second = response.json()
+
+        ids = [result['id'] for result in first['results'] + second['results']]
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+        self.assertIsNone(second['next_cursor'])
+
+    def test_every_vector_filter_path_is_declared_in_the_atlas_index(self):
+        search = TransactionSearch(
+            self.user, 'pizza', date_from=timezone.now().date(), date_to=timezone.now().date(),
+            type='EXPENSE', categories=['test food']
+        )
+        declared = {
+            field['path'] for field in vector_search_index_definition()['fields'] if field['type'] == 'filter'
+        }
+        self.assertLessEqual(set(search.vector_filter()), declared)
+
+    def test_keyword_ranking_scores_older_matches_beyond_the_candidate_limit(self):
+        account = BankAccount.objects.get(user=self.user)
+        BankTransaction.objects.bulk_create([
+            BankTransaction(
+                user=self.user, bank_account=account, merchant='Deli',
+                description='sandwich, crisps and a slice of pizza for the office lunch',
+                amount=Decimal('10.00'), transaction_date=timezone.now() - timedelta(days=days)
+            )
+            for days in range(5, 15)
+        ])
+        by_merchant = {
+            transaction.merchant: str(transaction.id) for transaction in self.transactions
+            if transaction.user_id == self.user.id
+        }
+
+        ranking = TransactionSearch(self.user, 'pizza').keyword_ranking()
+        self.assertEqual(ranking[:2], [by_merchant['Pizza Palace'], by_merchant['Pizza Express']])
+
+    def test_date_filters_compare_the_indexed_column(self):
+        today = timezone.localdate()
+        queryset = TransactionSearch(
+            self.user, 'pizza', date_from=today - timedelta(days=2), date_to=today - timedelta(days=1)
+        ).filter_queryset('bank')
+        self.assertNotIn('cast_date', str(queryset.query))
+        self.assertEqual(
+            set(queryset.values_list('merchant', flat=True)), {'Pizza Palace', 'Burger Barn'}
+        )
+
+
+class StreamingChat:
+    def __init__(self, *chunks):
+        self.chunks = chunks
+        self.calls = []
+
+    def stream(self, messages):
+        self.calls.append(messages)
+        for chunk in self.chunks:
+            yield mock.Mock(content=chunk)
+
+
+class InsightsTests(LocalVectorStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = StreamingChat('You spent ', 'NGN 20.00 on pizza.')
+        patcher = mock.patch('apps.transactions.insights.get_llm', lambda: self.llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, question):
+        response = self.client.post(reverse('api-v1:transaction_insights'), {'question': question})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        for block in b''.join(response.streaming_content).decode().strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+        return events
+
+    def test_answer_streams_and_is_cached_until_transactions_change(self):
+        events = self.ask('How much did I spend on pizza?')
+        self.assertEqual([event for event, _ in events], ['sources', 'token', 'token', 'done'])
+        own = {str(transaction.id) for transaction in self.transactions if transaction.user_id == self.user.id}
+        self.assertTrue(set(events[0][1]['transaction_ids']) <= own)
+        self.assertIn('Pizza Palace', self.llm.calls[0][1][1])
+        self.assertEqual(set(events[-1][1]['timings']), {'retrieval', 'prompt', 'first_token', 'generation', 'total'})
+
+        events = self.ask('  how much did I spend on PIZZA ')
+        self.assertEqual(events[1], ('token', {'text': 'You spent NGN 20.00 on pizza.'}))
+        self.assertTrue(events[-1][1]['cached'])
+        self.assertEqual(len(self.llm.calls), 1)
+
+        transaction = BankTransaction.objects.filter(user=self.user).first()
+        transaction.description = 'shared pizza'
+        transaction.save()
+        self.assertFalse(self.ask('How much did I spend on pizza?')[-1][1]['cached'])
+        self.assertEqual(len(self.llm.calls), 2)
+
+    def test_answers_given_before_a_deleted_vector_is_removed_are_not_reused(self):
+        transaction = BankTransaction.objects.get(user=self.user, merchant='Pizza Palace')
+        deleted = transaction.id
+        transaction.delete()
+        # The vector is still searchable until the outbox is processed
+        self.assertIn(str(deleted), self.ask('pizza')[0][1]['transaction_ids'])
+
+        process_tasks(EmbeddingTask.objects.claim('test', 100))
+        events = self.ask('pizza')
+        self.assertFalse(events[-1][1]['cached'])
+        self.assertNotIn(str(deleted), events[0][1]['transaction_ids'])
+
+
+@override_settings(RECEIPT_MAX_DIMENSION=400)
+class ReceiptPipelineTests(TestCase):
+    def setUp(self):
+        self.model = StubReceiptModel(0, 0)
+        self.model.generate_content = mock.Mock(wraps=self.model.generate_content)
+        patcher = mock.patch('apps.transactions.services.providers.get', lambda name: self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username='receipts'))
+
+    def receipt(self, colour='white'):
+        # Landscape pixels with an EXIF tag saying to rotate them upright
+        exif = PIL.Image.Exif()
+        exif[0x0112] = 6
+        output = io.BytesIO()
+        PIL.Image.new('RGB', (1200, 800), colour).save(output, format='JPEG', exif=exif)
+        return SimpleUploadedFile('receipt.jpg', output.getvalue(), content_type='image/jpeg')
+
+    def upload(self, image, **params):
+        url = reverse('api-v1:extract_receipt')
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, {'image': image}, format='multipart')
+
+    def test_image_is_oriented_downscaled_and_duplicates_hit_the_cache(self):
+        response = self.upload(self.receipt())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_amount'], 2.5)
+
+        sent = self.model.generate_content.call_args.args[0][1]['data']
+        self.assertEqual(PIL.Image.open(io.BytesIO(sent)).size, (267, 400))
+
+        self.assertEqual(self.upload(self.receipt()).status_code, 200)
+        self.assertEqual(self.model.generate_content.call_count, 1)
+
+    def test_model_failures_are_reported_as_a_bad_gateway(self):
+        replies = [RuntimeError('Model unavailable'), mock.Mock(text='Sorry, I cannot read this')]
+        self.model.generate_content = mock.Mock(side_effect=replies)
+        for _ in replies:
+            response = self.upload(self.receipt())
+            self.assertEqual(response.status_code, 502)
+            self.assertEqual(response.json(), {'error': 'Failed to extract receipt data.'})
+
+    def test_async_mode_runs_in_a_job(self):
+        response = self.upload(self.receipt('ivory'), **{'async': 'true'})
+        self.assertEqual(response.status_code, 202)
+        self.model.generate_content.assert_not_called()
+
+        job = Job.objects.get(pk=response.json()['job_id'])
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result['store_location'], 'Benchmark Store')
+        self.assertNotIn('image', job.payload)
+
+        # The finished job's result now answers re-uploads directly
+        self.assertEqual(self.upload(self.receipt('ivory'), **{'async': 'true'}).status_code, 200)
+
+    def test_batch_extracts_concurrently_and_reports_failures(self):
+        # Each extraction waits until all three are in flight, so the batch
+        # only succeeds if they overlap
+        in_flight = threading.Barrier(3, timeout=5)
+        generate_content = self.model.generate_content
+
+        def overlapping(parts):
+            in_flight.wait()
+            return generate_content(parts)
+
+        self.model.generate_content = overlapping
+        images = [self.receipt(colour) for colour in ('red', 'green', 'blue')]
+        images.append(SimpleUploadedFile('notes.txt', b'not an image', content_type='text/plain'))
+
+        with mock.patch('apps.transactions.services.get_tree') as get_tree:
+            response = self.client.post(reverse('api-v1:extract_receipts'), {'images': images}, format='multipart')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(lines[-1]['summary']['ok'], 3)
+        self.assertEqual([line['filename'] for line in lines if line.get('status') == 'error'], ['notes.txt'])
+        # Only the request thread resolved the prompt
+        self.assertEqual(get_tree.call_count, 1)
+
+
+class IngestReceiptTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='shopper')
+        cls.category = Category.objects.create(name='test food', description='Food')
+        SubCategory.objects.create(name='test groceries', category=cls.category)
+        SubCategory.objects.create(name='test snacks', category=cls.category)
+        cls.budget = Budget.objects.create(
+            user=cls.user, category=cls.category,
+            month=timezone.localdate().replace(day=1), planned_amount=Decimal('100')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        get_tree()
+
+    def save(self, count):
+        items = [
+            {'category': ('Test Groceries', 'test snacks', 'unknown')[i % 3], 'name': f'Item {i}',
+             'quantity': 2, 'unit_price': '1.25'}
+            for i in range(count)
+        ]
+        receipt = {'store_location': 'Corner Shop', 'date_time': timezone.now().isoformat(), 'items': items}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('api-v1:save_receipt'), receipt, format='json')
+        self.assertEqual(response.status_code, 201)
+        return StoreTransaction.objects.get(pk=response.json()['id']), len(queries)
+
+    def test_receipt_is_stored_in_constant_queries(self):
+        transaction, small = self.save(3)
+        self.assertEqual(transaction.amount, Decimal('7.50'))
+        self.assertEqual(transaction.items.filter(subcategories__isnull=False).count(), 2)
+        self.assertEqual(EmbeddingTask.objects.filter(transaction_id=transaction.pk).count(), 1)
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.actual_amount, Decimal('5.00'))
+
+        _, large = self.save(30)
+        self.assertEqual(large, small)
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.actual_amount, Decimal('55.00'))
+
+    def test_invalid_items_are_rejected(self):
+        response = self.client.post(
+            reverse('api-v1:save_receipt'),
+            {'items': [{'name': 'Bread', 'quantity': 0, 'unit_price': '1.00'}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StoreTransaction.objects.exists())
+
+    def test_duplicate_subcategory_names_need_their_category(self):
+        # The rows are rolled back without a commit, so drop them from the tree too
+        self.addCleanup(clear_category_cache)
+        drinks = Category.objects.create(name='test drinks', description='Drinks')
+        SubCategory.objects.create(name='test snacks', category=drinks)
+        item = {'category': 'test snacks', 'name': 'Crisps', 'quantity': 1, 'unit_price': '1.00'}
+
+        response = self.client.post(reverse('api-v1:save_receipt'), {'items': [item]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_category', response.json()['items']['0'])
+
+        response = self.client.post(
+            reverse('api-v1:save_receipt'), {'items': [{**item, 'parent_category': 'Test Drinks'}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        item = StoreTransaction.objects.get(pk=response.json()['id']).items.get()
+        self.assertEqual(list(item.subcategories.values_list('category__name', flat=True)), ['test drinks'])
+
+    def test_totals_that_overflow_the_amount_columns_are_rejected(self):
+        item = {'name': 'Bread', 'quantity': 1000000, 'unit_price': '100.00'}
+        response = self.client.post(reverse('api-v1:save_receipt'), {'items': [item]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.json()['items']['0'])
+
+        item = {'name': 'Bread', 'quantity': 1, 'unit_price': '60000000.00'}
+        response = self.client.post(reverse('api-v1:save_receipt'), {'items': [item, item]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('items', response.json())
+        self.assertFalse(StoreTransaction.objects.exists())
+
+
+class StartupImportTests(SimpleTestCase):
+    """
+    Runs `python -X importtime manage.py check` to keep process startup
+    light: external clients must be loaded lazily through `utils.providers`.
+    """
+    HEAVY_MODULES = {
+        'google.generativeai', 'langchain_community', 'langchain_mongodb',
+        'langchain_openai', 'pymongo', 'plaid', 'PIL', 'transformers', 'torch',
+    }
+    IMPORT_BUDGET_SECONDS = 1.5
+
+    def test_check_skips_heavy_imports_within_budget(self):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', 'manage.py', 'check'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        imports = re.findall(r'^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$', result.stderr, re.M)
+        loaded = {module.split('.')[0] for _, _, module in imports}
+        self.assertFalse(loaded & self.HEAVY_MODULES)
+
+        top_level = sorted(
+            ((int(cumulative), module) for cumulative, indent, module in imports if not indent),
+            reverse=True
+        )
+        total = sum(cumulative for cumulative, _ in top_level) / 1e6
+        self.assertLess(
+            total, self.IMPORT_BUDGET_SECONDS,
+            f"Imports took {total:.2f}s; slowest: {top_level[:5]}"
+        )
@@ -4,4 +4,8 @@ from . import views
 
 urlpatterns = [
     path('upload/receipt/', views.ExtractReceiptAPIView.as_view(), name='extract_receipt'),
+    path('upload/receipts/', views.ExtractReceiptBatchAPIView.as_view(), name='extract_receipts'),
+    path('receipts/', views.SaveReceiptAPIView.as_view(), name='save_receipt'),
+    path('search/', views.TransactionSearchAPIView.as_view(), name='transaction_search'),
+    path('insights/', views.InsightsAPIView.as_view(), name='transaction_insights'),
 ]
@@ -1,9 +1,25 @@
+import base64
+import json
 import logging
+import time
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView, Response, status
 
-from .services import get_receipt_data
+from apps.jobs.models import Job
+
+from .insights import answer_question
+from .jobs import EXTRACT_RECEIPT
+from .search import InvalidCursor, TransactionSearch, server_timing
+from .serializers import (InsightQuestionSerializer, ReceiptSerializer,
+                          TransactionSearchQuerySerializer,
+                          TransactionSearchResultSerializer)
+from .services import (InvalidReceiptImage, extract_receipts,
+                       get_cached_receipt, ingest_receipt,
+                       normalise_receipt_image, process_receipt, receipt_hash)
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +29,9 @@ class ExtractReceiptAPIView(APIView):
     def post(self, request, *args, **kwargs):
         """
         Extract receipt data from an image.
+        With `?async=true` the extraction runs in the background and the
+        response points at the job to poll; duplicates of a receipt that
+        was already extracted are answered straight from the cache.
         """
         if 'image' not in request.FILES:
             return Response(
@@ -20,10 +39,162 @@ class ExtractReceiptAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if ocr_data := get_receipt_data(request.FILES['image']):
+        image_file = request.FILES['image']
+        content_hash = receipt_hash(image_file)
+        if (ocr_data := get_cached_receipt(content_hash)) is not None:
+            return Response({**ocr_data})
+
+        try:
+            image = normalise_receipt_image(image_file)
+        except InvalidReceiptImage:
+            return Response(
+                {"error": "The file is not a supported image."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if request.query_params.get('async', '').lower() in ('1', 'true'):
+            job = Job.objects.enqueue(
+                EXTRACT_RECEIPT, user=request.user,
+                payload={'content_hash': content_hash, 'image': base64.b64encode(image).decode()}
+            )
+            return Response(
+                {
+                    'job_id': job.id,
+                    'status_url': request.build_absolute_uri(
+                        reverse('api-v1:job-detail', kwargs={'pk': job.id})
+                    ),
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        try:
+            ocr_data = process_receipt(image, content_hash)
+        except Exception as e:
+            # The model failed or replied with something other than receipt JSON
+            logger.error(f"Failed to extract receipt {content_hash}: {e}")
+            return Response(
+                {"error": "Failed to extract receipt data."},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        if ocr_data:
             return Response({**ocr_data})
 
         return Response(
             {"error": "Failed to extract receipt data."},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+class ExtractReceiptBatchAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Extract several receipts uploaded as `images`, concurrently.
+        Results stream back as NDJSON, one line per receipt in the order
+        they finish, then a summary line; a failed receipt is reported
+        on its own line without failing the others.
+        """
+        images = request.FILES.getlist('images')
+        if not images:
+            return Response(
+                {"error": "No image files provided."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(images) > settings.RECEIPT_BATCH_MAX_FILES:
+            return Response(
+                {"error": f"At most {settings.RECEIPT_BATCH_MAX_FILES} images can be uploaded at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        def stream():
+            started = time.perf_counter()
+            counts = {'ok': 0, 'error': 0}
+            for result in extract_receipts(images):
+                counts[result['status']] += 1
+                yield json.dumps(result) + "\n"
+            yield json.dumps({
+                'summary': {**counts, 'seconds': round(time.perf_counter() - started, 3)}
+            }) + "\n"
+
+        response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class SaveReceiptAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """Store an extracted receipt as a store transaction with its items"""
+        serializer = ReceiptSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        store_transaction = ingest_receipt(request.user, serializer.validated_data)
+        return Response(
+            {
+                'id': store_transaction.id,
+                'amount': str(store_transaction.amount),
+                'transaction_date': store_transaction.transaction_date,
+                'items': len(serializer.validated_data['items']),
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+
+class TransactionSearchAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Search the user's transactions by meaning and keywords.
+        Stage timings are returned in the Server-Timing header.
+        """
+        params = TransactionSearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        search = TransactionSearch(
+            request.user, data['q'],
+            date_from=data.get('date_from'), date_to=data.get('date_to'),
+            type=data.get('type'), categories=data.get('category'),
+        )
+        try:
+            results, next_cursor = search.page(data['limit'], data.get('cursor'))
+        except InvalidCursor as e:
+            return Response({"cursor": [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {
+                "results": TransactionSearchResultSerializer(results, many=True).data,
+                "next_cursor": next_cursor,
+            },
+            headers={"Server-Timing": server_timing(search.timings)},
+        )
+
+
+class InsightsAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Answer a question about the user's spending as server-sent events:
+        `sources`, a `token` per generated chunk, then `done` with timings.
+        """
+        serializer = InsightQuestionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        events = answer_question(request.user, serializer.validated_data['question'])
+
+        def stream():
+            try:
+                for event, data in events:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            except Exception as e:
+                logger.error(f"Failed to answer insight question: {e}")
+                yield f"event: error\ndata: {json.dumps({'error': 'Failed to generate an answer.'})}\n\n"
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop proxies from buffering the stream until it ends
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -56,6 +56,7 @@ INSTALLED_APPS = [
     "apps.accounts.apps.AccountsConfig",
     "apps.categories.apps.CategoriesConfig",
     "apps.transactions.apps.TransactionsConfig",
+    "apps.jobs.apps.JobsConfig",
 ]
 
 MIDDLEWARE = [
@@ -148,15 +149,66 @@ PLAID_SECRET = os.getenv('PLAID_SECRET')
 PLAID_PRODUCTS = os.getenv('PLAID_PRODUCTS')
 PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
 PLAID_REDIRECT_URI="http://localhost:8000/tada"
+PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
 SUPPORTED_COUNTRIES = os.getenv('PLAID_COUNTRY_CODES')
+# Number of Plaid items synced at once, and the minimum gap between two
+# requests for the same item (seconds)
+PLAID_SYNC_CONCURRENCY = int(os.getenv('PLAID_SYNC_CONCURRENCY', 4))
+PLAID_ITEM_REQUEST_INTERVAL = float(os.getenv('PLAID_ITEM_REQUEST_INTERVAL', 0.2))
+# Seconds between routine syncs of an account that synced successfully
+PLAID_SYNC_REFRESH_INTERVAL = int(os.getenv('PLAID_SYNC_REFRESH_INTERVAL', 6 * 60 * 60))
+# Plaid HTTP client: kept-alive connections, (connect, read) timeouts in
+# seconds, retries for rate limits and server errors, and the circuit
+# breaker that stops calling Plaid while it keeps failing
+PLAID_POOL_SIZE = int(os.getenv('PLAID_POOL_SIZE', max(PLAID_SYNC_CONCURRENCY * 2, 10)))
+PLAID_CONNECT_TIMEOUT = float(os.getenv('PLAID_CONNECT_TIMEOUT', 5))
+PLAID_READ_TIMEOUT = float(os.getenv('PLAID_READ_TIMEOUT', 30))
+PLAID_MAX_RETRIES = int(os.getenv('PLAID_MAX_RETRIES', 3))
+PLAID_RETRY_BACKOFF = float(os.getenv('PLAID_RETRY_BACKOFF', 0.5))
+PLAID_RETRY_MAX_BACKOFF = float(os.getenv('PLAID_RETRY_MAX_BACKOFF', 10))
+PLAID_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('PLAID_CIRCUIT_FAILURE_THRESHOLD', 5))
+PLAID_CIRCUIT_RESET_SECONDS = float(os.getenv('PLAID_CIRCUIT_RESET_SECONDS', 30))
+
+# Seconds a process trusts its category tree before checking the shared
+# version key. Cross-worker invalidation needs a shared CACHES backend;
+# the default local-memory cache only invalidates within one process.
+CATEGORY_CACHE_CHECK_INTERVAL = float(os.getenv('CATEGORY_CACHE_CHECK_INTERVAL', 5))
 
 # MongoDB Settings
 MONGO_URI = os.getenv("MONGO_URI")
 VECTOR_DB_NAME = os.getenv("VECTOR_DB_NAME")
 VECTOR_COLLECTION_NAME = os.getenv("VECTOR_COLLECTION_NAME")
+# "atlas" stores vectors in MongoDB Atlas; "local" keeps a memory-mapped
+# index under LOCAL_VECTOR_DIR, for tests and offline deployments
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "atlas")
+# Atlas approximate search considers this many candidates per result
+VECTOR_SEARCH_CANDIDATES = int(os.getenv("VECTOR_SEARCH_CANDIDATES", 10))
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", BASE_DIR / "vector_index")
+# IVF lists probed per query in large local partitions
+LOCAL_VECTOR_NPROBE = int(os.getenv("LOCAL_VECTOR_NPROBE", 8))
+# Transaction search: results taken from each of the vector and keyword
+# rankings before fusion, and how long a ranking is kept for its cursors
+TRANSACTION_SEARCH_CANDIDATES = int(os.getenv("TRANSACTION_SEARCH_CANDIDATES", 100))
+TRANSACTION_SEARCH_CURSOR_TTL = int(os.getenv("TRANSACTION_SEARCH_CURSOR_TTL", 600))
+# Spending Q&A: transactions retrieved as context per question, and how long
+# an answer is reused while the user's transactions stay unchanged
+INSIGHTS_TOP_K = int(os.getenv("INSIGHTS_TOP_K", 20))
+INSIGHTS_CACHE_TTL = int(os.getenv("INSIGHTS_CACHE_TTL", 60 * 60))
 
 # AI Configuration
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+# Vector size of EMBEDDING_MODEL, declared in the Atlas vector search index
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 384))
+# When set, embeddings come from the `embedding_server` process at this URL
+# instead of a model loaded in every worker. The server groups concurrent
+# requests into batches of up to EMBEDDING_MAX_BATCH_SIZE texts, waiting at
+# most EMBEDDING_MAX_WAIT_MS for a batch to fill.
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", 30))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 64))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 10))
+# Vectors kept per process, keyed by a hash of the text and model; 0 disables
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
 
 LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
 LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
@@ -168,3 +220,11 @@ LLM_API_BASE = os.getenv("LLM_API_BASE")
 # Gemini settings
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL')
+# Receipt photos are shrunk to fit this many pixels per side and recompressed
+# before extraction; results are cached by upload hash for RECEIPT_CACHE_TTL
+RECEIPT_MAX_DIMENSION = int(os.getenv('RECEIPT_MAX_DIMENSION', 1600))
+RECEIPT_JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', 85))
+RECEIPT_CACHE_TTL = int(os.getenv('RECEIPT_CACHE_TTL', 7 * 24 * 60 * 60))
+# Batch uploads: receipts extracted at once, and the most files per request
+RECEIPT_BATCH_CONCURRENCY = int(os.getenv('RECEIPT_BATCH_CONCURRENCY', 4))
+RECEIPT_BATCH_MAX_FILES = int(os.getenv('RECEIPT_BATCH_MAX_FILES', 50))
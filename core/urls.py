@@ -25,6 +25,7 @@ v1_urls = [
     path('accounts/', include('apps.accounts.urls')),
     path('budgets/', include('apps.budget.urls')),
     path('transactions/', include('apps.transactions.urls')),
+    path('jobs/', include('apps.jobs.urls')),
 ]
 
 urlpatterns += [
@@ -1,41 +1,221 @@
 import logging
+import random
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator
 
-import plaid
 from django.conf import settings
-from plaid.api import plaid_api
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.country_code import CountryCode
-from plaid.model.item_public_token_exchange_request import \
-    ItemPublicTokenExchangeRequest
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.link_token_create_request_user import \
-    LinkTokenCreateRequestUser
-from plaid.model.products import Products
-from plaid.model.transactions_sync_request import TransactionsSyncRequest
+
+from utils import providers
 
 logger = logging.getLogger(__name__)
 
 
-class PlaidService:
-    """Service for handling Plaid API interactions."""
-    _configuration = plaid.Configuration(
-        host=plaid.Environment.Sandbox,
+class TransactionsNotReady(Exception):
+    """Plaid is still preparing the item's transaction history"""
+
+
+class PlaidUnavailable(Exception):
+    """Raised without calling Plaid while the circuit breaker is open"""
+    status = 503
+    body = None
+
+
+@providers.register('plaid')
+def build_client():
+    """
+    Create a Plaid API client for `PLAID_ENV`. The underlying urllib3 pool
+    keeps up to `PLAID_POOL_SIZE` connections alive, enough for every sync
+    worker to reuse its own. Retries are left to `PlaidService`.
+    """
+    import plaid
+    from plaid.api import plaid_api
+
+    configuration = plaid.Configuration(
+        host=getattr(plaid.Environment, settings.PLAID_ENV.capitalize()),
         api_key={
             'clientId': settings.PLAID_CLIENT_ID,
             'secret': settings.PLAID_SECRET,
             'plaidVersion': '2020-09-14'
         }
     )
-    _api_client = plaid.ApiClient(_configuration)
-    client = plaid_api.PlaidApi(_api_client)
+    configuration.connection_pool_maxsize = settings.PLAID_POOL_SIZE
+    configuration.retries = 0
+    return plaid_api.PlaidApi(plaid.ApiClient(configuration))
+
+
+class CircuitBreaker:
+    """
+    Stops calling Plaid after `failure_threshold` transient failures in a
+    row. Once `reset_seconds` have passed a single trial call is let
+    through; its success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                # Half-open: let this call through and hold the others back
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Plaid circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class EndpointStats:
+    """Thread-safe call, retry, error and latency counters per Plaid endpoint"""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float = 0.0, retried=False, failed=False):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {
+                'calls': 0, 'retries': 0, 'errors': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0,
+            })
+            counters['calls'] += 1
+            counters['retries'] += retried
+            counters['errors'] += failed
+            counters['total_seconds'] += seconds
+            counters['max_seconds'] = max(counters['max_seconds'], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    **counters,
+                    'mean_seconds': counters['total_seconds'] / counters['calls'],
+                }
+                for endpoint, counters in self._counters.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class PlaidService:
+    """
+    Service for handling Plaid API interactions.
+    The SDK is imported on first use, as it is slow to load.
+    """
+    # Replaces the shared client from `build_client` when set, e.g. with a stub
+    client = None
+
+    RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+    # Not idempotent: a retry after a lost response would exchange a used token
+    UNRETRIED_ENDPOINTS = {'item_public_token_exchange'}
+
+    breaker = CircuitBreaker(
+        settings.PLAID_CIRCUIT_FAILURE_THRESHOLD,
+        settings.PLAID_CIRCUIT_RESET_SECONDS
+    )
+    stats = EndpointStats()
+
+    @classmethod
+    def get_client(cls):
+        return cls.client or providers.get('plaid')
+
+    @classmethod
+    def _is_retryable(cls, error: Exception) -> bool:
+        import plaid
+        import urllib3
+
+        if isinstance(error, plaid.ApiException):
+            return error.status in cls.RETRYABLE_STATUSES
+        # Timeouts, refused and dropped connections
+        return isinstance(error, urllib3.exceptions.HTTPError)
+
+    @classmethod
+    def is_transient(cls, error: Exception) -> bool:
+        """Whether a failed call may succeed later: it was throttled, timed out or the circuit was open"""
+        return isinstance(error, PlaidUnavailable) or cls._is_retryable(error)
+
+    @classmethod
+    def _call(cls, endpoint: str, request):
+        """
+        Call a Plaid endpoint with the configured timeouts. Rate limits,
+        server errors and network failures are retried with jittered
+        exponential backoff, except on `UNRETRIED_ENDPOINTS`, and count
+        towards opening the circuit.
+        """
+        method = getattr(cls.get_client(), endpoint)
+        max_retries = 0 if endpoint in cls.UNRETRIED_ENDPOINTS else settings.PLAID_MAX_RETRIES
+        attempt = 0
+        while True:
+            if not cls.breaker.allow():
+                cls.stats.record(endpoint, failed=True)
+                raise PlaidUnavailable(f"Plaid circuit open, skipping {endpoint}")
+
+            started = time.monotonic()
+            try:
+                response = method(
+                    request,
+                    _request_timeout=(settings.PLAID_CONNECT_TIMEOUT, settings.PLAID_READ_TIMEOUT)
+                )
+            except Exception as e:
+                elapsed = time.monotonic() - started
+                if not cls._is_retryable(e):
+                    cls.stats.record(endpoint, elapsed, failed=True)
+                    raise
+
+                cls.breaker.record_failure()
+                if attempt >= max_retries:
+                    cls.stats.record(endpoint, elapsed, failed=True)
+                    raise
+
+                cls.stats.record(endpoint, elapsed, retried=True)
+                delay = random.uniform(0, min(
+                    settings.PLAID_RETRY_BACKOFF * 2 ** attempt, settings.PLAID_RETRY_MAX_BACKOFF
+                ))
+                logger.warning(f"Plaid {endpoint} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            cls.stats.record(endpoint, time.monotonic() - started)
+            cls.breaker.record_success()
+            return response
 
     @classmethod
     def create_link_token(cls, user) -> Dict[str, Any]:
         """
         Create a Plaid link token for a user.
         """
+        import plaid
+        from plaid.model.country_code import CountryCode
+        from plaid.model.link_token_create_request import \
+            LinkTokenCreateRequest
+        from plaid.model.link_token_create_request_user import \
+            LinkTokenCreateRequestUser
+        from plaid.model.products import Products
+
         user_id = str(user.id)
         logger.info(f"Creating Plaid link token for user_id: {user_id}")
 
@@ -51,12 +231,12 @@ class PlaidService:
 
             # Generate a new link token for adding a new institution
             request = LinkTokenCreateRequest(**request_params)
-            response = cls.client.link_token_create(request)
+            response = cls._call('link_token_create', request)
 
             logger.info(f"Successfully created link token for user_id: {user_id}")
             return response.to_dict()
 
-        except plaid.ApiException as e:
+        except (plaid.ApiException, PlaidUnavailable) as e:
             logger.error(
                 f"Failed to create Plaid link token for user_id: {user_id}. "
                 f"Error code: {e.status}, message: {e.body}",
@@ -69,16 +249,20 @@ class PlaidService:
         """
         Exchange a public token for an access token.
         """
+        import plaid
+        from plaid.model.item_public_token_exchange_request import \
+            ItemPublicTokenExchangeRequest
+
         logger.info("Initiating public token exchange")
         try:
             plaid_request = ItemPublicTokenExchangeRequest(
                 public_token=public_token
             )
 
-            response = cls.client.item_public_token_exchange(plaid_request)
+            response = cls._call('item_public_token_exchange', plaid_request)
             logger.info("Successfully exchanged public token for access token")
             return response.to_dict()
-        except plaid.ApiException as e:
+        except (plaid.ApiException, PlaidUnavailable) as e:
             logger.error(
                 "Failed to exchange public token. "
                 f"Error code: {e.status}, message: {e.body}",
@@ -87,70 +271,50 @@ class PlaidService:
             return {}
 
     @classmethod
-    def get_accounts(cls, access_token: str) -> Dict[str, Any]:
+    def get_accounts(cls, access_token: str) -> list[Dict[str, Any]]:
         """
-        Retrieve a list of user's accounts information
+        Retrieve a list of user's accounts information.
+        Errors are raised rather than swallowed, so callers can tell an
+        item without accounts from a failed call; see `is_transient`.
         """
-        try:
-            request = AccountsGetRequest(
-                access_token=access_token
-            )
-            accounts_response = cls.client.accounts_get(request)
-            logger.info(f"Successfully retrieved {len(accounts_response.accounts)} accounts")
-            return accounts_response.to_dict().get('accounts')
+        from plaid.model.accounts_get_request import AccountsGetRequest
 
-        except plaid.ApiException as e:
-            logger.error(
-                "Failed to retrieve accounts. "
-                f"Error code: {e.status}, message: {e.body}",
-                exc_info=True
-            )
-            return {}
+        request = AccountsGetRequest(
+            access_token=access_token
+        )
+        accounts_response = cls._call('accounts_get', request)
+        logger.info(f"Successfully retrieved {len(accounts_response.accounts)} accounts")
+        return accounts_response.to_dict().get('accounts')
 
     @classmethod
-    def get_transactions(cls, bank_account) -> List[Dict[str, Any]]:
+    def iter_transaction_pages(cls, access_token: str, cursor: str = '') -> Iterator[Dict[str, Any]]:
         """
-        Retrieve transactions for a user profile.
+        Yield /transactions/sync pages one at a time, starting after `cursor`.
+        Each page carries its `added`, `modified` and `removed` updates and the
+        `next_cursor` to resume from once the page has been stored.
+
+        Raises `TransactionsNotReady` instead of waiting while Plaid prepares
+        the history, so callers can retry later.
         """
-        cursor = bank_account.next_cursor or ''
-        access_token = bank_account.access_token
+        from plaid.model.transactions_sync_request import \
+            TransactionsSyncRequest
 
-        logger.info(f"Starting transaction sync for BankAccount ID: {bank_account.id}")
-        added = []  # New transaction updates since "cursor"
         has_more = True
+        while has_more:
+            request = TransactionsSyncRequest(
+                access_token=access_token,
+                cursor=cursor,
+            )
+            response = cls._call('transactions_sync', request).to_dict()
 
-        try:
-            # Iterate through each page of new transaction updates
-            while has_more:
-                request = TransactionsSyncRequest(
-                    access_token=access_token,
-                    cursor=cursor,
-                )
-                response = cls.client.transactions_sync(request).to_dict()
-                cursor = response['next_cursor']
-
-                # If no transactions are available yet, wait and poll the endpoint
-                if cursor == '':
-                    logger.debug("No transactions available yet, polling...")
-                    time.sleep(2)
-                    continue
-
-                added.extend(response['added'])
-                has_more = response['has_more']
-
-                logger.info(f"Retrieved {len(added)} new transactions. Has more: {has_more}")
-
-                # Save the cursor for future requests
-                bank_account.next_cursor = cursor
-                bank_account.save()
-
-            logger.info(f"Completed transaction sync. Total transactions retrieved: {len(added)}")
-            return added
+            if response['next_cursor'] == '':
+                raise TransactionsNotReady("No transactions available yet")
 
-        except plaid.ApiException as e:
-            logger.error(
-                f"Failed to export transactions for BankAccount ID: {bank_account.id}. "
-                f"Error code: {e.status}, message: {e.body}",
-                exc_info=True
+            cursor = response['next_cursor']
+            has_more = response['has_more']
+            logger.info(
+                f"Retrieved page with {len(response['added'])} added, "
+                f"{len(response['modified'])} modified, {len(response['removed'])} removed. "
+                f"Has more: {has_more}"
             )
-            return []
+            yield response
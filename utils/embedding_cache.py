@@ -0,0 +1,91 @@
+"""
+In-process cache of embedding vectors, keyed by a hash of the embedded
+text and the model that embedded it. Unchanged transactions and texts
+shared across users (subscription charges, transfers) skip inference.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry when full"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return self._entries[key]
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._entries),
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model, only sending it texts it has not embedded yet"""
+
+    def __init__(self, embeddings: Embeddings, model: str, max_size: int = 10000):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = LRUCache(max_size)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [text_hash(text, self.model) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+
+        # Identical texts within the batch are embedded once
+        missing = {key: text for key, text, vector in zip(keys, texts, vectors) if vector is None}
+        if missing:
+            embedded = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            for key, vector in embedded.items():
+                self.cache.set(key, vector)
+            vectors = [embedded[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        # Models such as BGE prefix queries with an instruction, so a query
+        # vector is cached apart from the document vector of the same text
+        key = text_hash(text, f"{self.model}\0query")
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
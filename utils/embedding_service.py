@@ -0,0 +1,172 @@
+"""
+Local embedding service: one long-lived process loads the embedding model
+and serves every worker over HTTP, grouping concurrent requests into
+batched inference calls.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingServiceError(Exception):
+    pass
+
+
+class MicroBatcher:
+    """
+    Feeds concurrent embedding requests to the model from a single thread.
+    Requests queued within `max_wait` seconds of each other are embedded
+    together, up to `max_batch_size` texts per inference call. Query
+    requests go through `embed_query`, which may prefix an instruction.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 64, max_wait: float = 0.01):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = {'requests': 0, 'documents': 0, 'queries': 0, 'batches': 0, 'inference_seconds': 0.0}
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='embedding-batcher', daemon=True).start()
+
+    def embed(self, texts: list[str], query: bool = False) -> list[list[float]]:
+        """Block until the texts have been embedded as part of some batch"""
+        future = Future()
+        self._queue.put((texts, query, future))
+        return future.result()
+
+    def _collect(self) -> list[tuple[list[str], bool, Future]]:
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            texts = [text for request_texts, query, _ in pending if not query for text in request_texts]
+            queries = [text for request_texts, query, _ in pending if query for text in request_texts]
+
+            started = time.perf_counter()
+            try:
+                vectors = []
+                # A single large request can exceed the batch size on its own
+                for start in range(0, len(texts), self.max_batch_size):
+                    vectors.extend(self.embeddings.embed_documents(texts[start:start + self.max_batch_size]))
+                # LangChain has no batched form of embed_query
+                query_vectors = [self.embeddings.embed_query(text) for text in queries]
+            except Exception as e:
+                logger.exception(f"Failed to embed a batch of {len(texts) + len(queries)} texts")
+                for _, _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.stats['requests'] += len(pending)
+            self.stats['documents'] += len(texts)
+            self.stats['queries'] += len(queries)
+            self.stats['batches'] += -(-len(texts) // self.max_batch_size)
+            self.stats['inference_seconds'] += time.perf_counter() - started
+
+            offsets = {False: 0, True: 0}
+            for request_texts, query, future in pending:
+                results = query_vectors if query else vectors
+                offset = offsets[query]
+                future.set_result(results[offset:offset + len(request_texts)])
+                offsets[query] += len(request_texts)
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests from the same worker
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != '/embed':
+            return self._respond(404, {'error': 'Not found'})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            texts = payload['texts']
+            query = payload.get('query', False)
+        except (ValueError, KeyError, AttributeError):
+            return self._respond(400, {'error': 'Expected a JSON body with "texts"'})
+        if not isinstance(query, bool):
+            return self._respond(400, {'error': '"query" must be true or false'})
+
+        try:
+            vectors = self.server.batcher.embed(texts, query)
+        except Exception as e:
+            return self._respond(500, {'error': str(e)})
+        self._respond(200, {'embeddings': vectors})
+
+    def do_GET(self):
+        if self.path == '/health':
+            return self._respond(200, {'status': 'ok'})
+        if self.path == '/stats':
+            return self._respond(200, self.server.batcher.stats)
+        self._respond(404, {'error': 'Not found'})
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def create_server(embeddings: Embeddings, host: str, port: int,
+                  max_batch_size: int = 64, max_wait: float = 0.01) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), EmbeddingRequestHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(embeddings, max_batch_size, max_wait)
+    return server
+
+
+class RemoteEmbeddings(Embeddings):
+    """LangChain embeddings backed by an `embedding_server` process"""
+
+    def __init__(self, url: str, timeout: float = 30.0, pool_size: int = 10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.http = urllib3.PoolManager(maxsize=pool_size)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self._embed(texts, query=False)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text], query=True)[0]
+
+    def _embed(self, texts: list[str], query: bool) -> list[list[float]]:
+        response = self.http.request(
+            'POST', f"{self.url}/embed",
+            body=json.dumps({'texts': texts, 'query': query}),
+            headers={'Content-Type': 'application/json'},
+            timeout=self.timeout,
+        )
+        if response.status != 200:
+            raise EmbeddingServiceError(
+                f"Embedding service returned {response.status}: {response.data[:200]!r}"
+            )
+        return json.loads(response.data)['embeddings']
@@ -0,0 +1,522 @@
+"""
+Vector index kept on local disk, for tests, benchmarks and deployments
+without MongoDB Atlas. Each user's documents form a partition: a float32
+matrix of normalised embeddings, memory-mapped from a .npy file, next to
+the documents' text and metadata, plus a log of rows upserted since it
+was written. Search is brute force over the rows that pass the metadata
+filter, or IVF over large partitions.
+
+Filters use the MongoDB query syntax accepted by Atlas `$vectorSearch`
+pre-filters (field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and/$or),
+so callers can pass the same filter to either backend.
+"""
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+TEXT_KEY = "text"
+# Partitions smaller than this are always searched by brute force
+IVF_MIN_SIZE = 4096
+# The IVF centroids are retrained once a partition doubles in size
+IVF_RETRAIN_GROWTH = 2
+KMEANS_ITERATIONS = 10
+# Upserts append to a partition's log until it would hold more than this many
+# rows and this fraction of the partition; the partition is then rewritten
+LOG_MIN_ROWS = 1024
+LOG_MAX_FRACTION = 0.25
+
+COMPARISONS = {
+    "$eq": lambda column, value: column == value,
+    "$ne": lambda column, value: column != value,
+    "$gt": lambda column, value: column > value,
+    "$gte": lambda column, value: column >= value,
+    "$lt": lambda column, value: column < value,
+    "$lte": lambda column, value: column <= value,
+    "$in": lambda column, value: np.isin(column, list(value)),
+    "$nin": lambda column, value: ~np.isin(column, list(value)),
+}
+
+
+def normalise(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _lock_file(file):
+    if fcntl:
+        fcntl.flock(file, fcntl.LOCK_EX)
+    else:
+        # Locks the first byte, retrying for up to 10 seconds
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(file):
+    if fcntl:
+        fcntl.flock(file, fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _matches(value, operator: str, operand) -> bool:
+    """Python fallback for one row, with MongoDB's any-element rule for arrays"""
+    if isinstance(value, list):
+        if operator in ("$ne", "$nin"):
+            return all(_matches(item, operator, operand) for item in value)
+        return any(_matches(item, operator, operand) for item in value)
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    try:
+        return bool(COMPARISONS[operator](value, operand))
+    except TypeError:
+        # Missing values never satisfy a range condition
+        return False
+
+
+def kmeans(vectors: np.ndarray, clusters: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids, trained on a sample of at most 256 rows per cluster"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), clusters * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(clusters):
+            members = sample[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalise(centroids)
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1).astype(np.int32)
+        for start in range(0, len(vectors), chunk_size)
+    ]) if len(vectors) else np.empty(0, dtype=np.int32)
+
+
+class Partition:
+    """
+    One user's documents, as loaded from a single generation on disk: the
+    rows written by its last rewrite, then the rows appended to its log
+    since. A log row replaces any earlier row for the same transaction.
+    """
+
+    def __init__(self, documents: list[dict], vectors: np.ndarray, ivf: dict = None,
+                 log_vectors: np.ndarray = None, generation: str = None, log_bytes: int = 0):
+        self.documents = documents
+        self.base = vectors
+        self.log = vectors[:0] if log_vectors is None else log_vectors
+        self.ivf = ivf
+        self.generation = generation
+        self.log_bytes = log_bytes
+        self.positions = {document["transaction_id"]: i for i, document in enumerate(documents)}
+        # Rows replaced in the log stay on disk until the next rewrite
+        self.live = np.zeros(len(documents), dtype=bool)
+        self.live[list(self.positions.values())] = True
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return np.vstack([self.base, self.log]) if len(self.log) else self.base
+
+    def extended(self, documents: list[dict], log_vectors: np.ndarray, log_bytes: int) -> 'Partition':
+        """This partition with the rows appended to its log since it was loaded"""
+        return Partition(
+            self.documents + documents, self.base, self.ivf, log_vectors, self.generation, log_bytes
+        )
+
+    def column(self, field: str) -> np.ndarray:
+        if field not in self._columns:
+            values = [document.get(field) for document in self.documents]
+            if any(value is None or isinstance(value, (list, dict)) for value in values):
+                column = np.empty(len(values), dtype=object)
+                column[:] = values
+            else:
+                column = np.array(values)
+            self._columns[field] = column
+        return self._columns[field]
+
+    def mask(self, filter: dict) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        for key, condition in (filter or {}).items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self.mask(clause)
+            elif key == "$or":
+                any_clause = np.zeros(len(self), dtype=bool)
+                for clause in condition:
+                    any_clause |= self.mask(clause)
+                mask &= any_clause
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def _field_mask(self, field: str, condition) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        column = self.column(field)
+        mask = np.ones(len(self), dtype=bool)
+        for operator, operand in condition.items():
+            if operator not in COMPARISONS:
+                raise ValueError(f"Unsupported filter operator {operator}")
+            if column.dtype == object:
+                mask &= np.fromiter(
+                    (_matches(value, operator, operand) for value in column), dtype=bool, count=len(column)
+                )
+            else:
+                mask &= COMPARISONS[operator](column, operand)
+        return mask
+
+    def rows(self, positions: np.ndarray) -> np.ndarray:
+        """Vectors at sorted `positions`, gathered from the base and the log"""
+        in_base = positions < len(self.base)
+        if in_base.all():
+            return self.base[positions]
+        return np.vstack([self.base[positions[in_base]], self.log[positions[~in_base] - len(self.base)]])
+
+    def search(self, query: np.ndarray, k: int, mask: np.ndarray, nprobe: int = None) -> list[tuple[int, float]]:
+        """Rows of the k best matches among those in `mask`, with their cosine similarity"""
+        candidates = np.flatnonzero(mask & self.live)
+        if nprobe and self.ivf is not None:
+            probed = np.argsort(self.ivf["centroids"] @ query)[::-1][:nprobe]
+            # The IVF lists cover the base rows; logged rows are always searched
+            in_probed = np.ones(len(candidates), dtype=bool)
+            in_base = candidates < len(self.ivf["assignments"])
+            in_probed[in_base] = np.isin(self.ivf["assignments"][candidates[in_base]], probed)
+            # A selective filter can leave too few rows in the probed lists,
+            # in which case exact search over the filtered rows is cheap anyway
+            if in_probed.sum() >= k:
+                candidates = candidates[in_probed]
+        if not len(candidates):
+            return []
+
+        # Gathering rows copies them; an unfiltered search reads the maps directly
+        if len(candidates) == len(self):
+            scores = np.concatenate([self.base @ query, self.log @ query]) if len(self.log) else self.base @ query
+        else:
+            scores = self.rows(candidates) @ query
+        if len(candidates) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+
+class LocalVectorIndex:
+    """
+    Per-user partitions under `root`. Upserts append to the partition's log
+    and commit it by rewriting the small `CURRENT` pointer, so their cost
+    follows the rows written rather than the partition size. Once the log
+    outgrows `log_min_rows` and a fraction of the partition, or on delete,
+    the partition is rewritten as a new generation of files and switched
+    to atomically. Readers in other processes never see a half-written
+    partition. Writers to one partition take a file lock.
+    """
+
+    def __init__(self, root, nprobe: int = 8, ivf_min_size: int = IVF_MIN_SIZE, log_min_rows: int = LOG_MIN_ROWS):
+        self.root = Path(root)
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size
+        self.log_min_rows = log_min_rows
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    # Storage
+
+    def _user_dir(self, user_id) -> Path:
+        return self.root / "users" / str(user_id)
+
+    def _user_ids(self) -> list[str]:
+        users = self.root / "users"
+        return [path.name for path in users.iterdir() if path.is_dir()] if users.exists() else []
+
+    def _state(self, user_id) -> tuple:
+        """The current generation, and the rows and bytes committed to its log"""
+        try:
+            generation, *log = (self._user_dir(user_id) / "CURRENT").read_text().split()
+        except FileNotFoundError:
+            return None, 0, 0
+        rows, size = map(int, log) if log else (0, 0)
+        return generation, rows, size
+
+    def partition(self, user_id) -> Partition:
+        """The user's partition, reloaded only when another write changed it"""
+        user_id = str(user_id)
+        while True:
+            state = self._state(user_id)
+            cached = self._partitions.get(user_id)
+            if cached and cached[0] == state:
+                return cached[1]
+            try:
+                partition = self._load(user_id, *state, cached=cached and cached[1])
+                break
+            except FileNotFoundError:
+                # A writer replaced the generation while it was being read
+                continue
+
+        with self._lock:
+            self._partitions[user_id] = (state, partition)
+        return partition
+
+    def _load(self, user_id: str, generation, log_rows: int, log_bytes: int, cached: Partition = None) -> Partition:
+        if generation is None:
+            return Partition([], np.empty((0, 0), dtype=np.float32))
+        directory = self._user_dir(user_id)
+        if cached is None or cached.generation != generation:
+            documents = json.loads((directory / f"documents-{generation}.json").read_text())
+            vectors = np.load(directory / f"vectors-{generation}.npy", mmap_mode="r")
+            ivf_path = directory / f"ivf-{generation}.npz"
+            ivf = dict(np.load(ivf_path)) if ivf_path.exists() else None
+            cached = Partition(documents, vectors, ivf, generation=generation)
+        if log_rows == len(cached.log):
+            return cached
+
+        # Only the rows logged since the cached copy was read are parsed
+        with open(directory / f"log-{generation}.jsonl", "rb") as log:
+            log.seek(cached.log_bytes)
+            documents = [json.loads(line) for line in log.read(log_bytes - cached.log_bytes).splitlines()]
+        log_vectors = np.memmap(
+            directory / f"log-{generation}.f32", dtype=np.float32, mode="r",
+            shape=(log_rows, cached.base.shape[1])
+        )
+        return cached.extended(documents, log_vectors, log_bytes)
+
+    @contextmanager
+    def _locked(self, user_id):
+        directory = self._user_dir(user_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / "LOCK", "w") as lock:
+            _lock_file(lock)
+            try:
+                yield directory
+            finally:
+                _unlock_file(lock)
+
+    def _commit(self, directory: Path, state: str):
+        pointer = directory / f"CURRENT.{uuid.uuid4().hex}"
+        pointer.write_text(state)
+        os.replace(pointer, directory / "CURRENT")
+
+    def _write(self, user_id, directory: Path, documents: list[dict], vectors: np.ndarray, ivf: dict = None):
+        previous = self._state(user_id)[0]
+        generation = uuid.uuid4().hex
+        (directory / f"documents-{generation}.json").write_text(json.dumps(documents))
+        np.save(directory / f"vectors-{generation}.npy", vectors)
+        if ivf is not None:
+            np.savez(directory / f"ivf-{generation}.npz", **ivf)
+        self._commit(directory, generation)
+
+        # Readers that still map the old files keep them until they let go
+        if previous:
+            for name in ("documents-{}.json", "vectors-{}.npy", "ivf-{}.npz", "log-{}.jsonl", "log-{}.f32"):
+                (directory / name.format(previous)).unlink(missing_ok=True)
+
+    def _append(self, directory: Path, partition: Partition, rows: list[tuple]):
+        """Add rows to the generation's log and commit them in `CURRENT`"""
+        data = "".join(json.dumps(document) + "\n" for document, _ in rows).encode()
+        vectors = np.array([vector for _, vector in rows], dtype=np.float32)
+        for name, committed, chunk in (
+            ("log-{}.jsonl", partition.log_bytes, data),
+            ("log-{}.f32", partition.log.nbytes, vectors.tobytes()),
+        ):
+            with open(directory / name.format(partition.generation), "ab") as log:
+                # Drop anything a writer that died mid-append left uncommitted
+                log.truncate(committed)
+                log.write(chunk)
+        rows, size = len(partition.log) + len(rows), partition.log_bytes + len(data)
+        self._commit(directory, f"{partition.generation} {rows} {size}")
+
+    def _rewrite(self, user_id, directory: Path, partition: Partition, rows: list[tuple] = (),
+                 deleted: set = frozenset()):
+        """
+        Write the partition as a new generation: its live rows, less the
+        `deleted` ones and those `rows` replace, followed by `rows`.
+        """
+        replaced = deleted | {document["transaction_id"] for document, _ in rows}
+        keep = partition.live & np.array(
+            [document["transaction_id"] not in replaced for document in partition.documents], dtype=bool
+        )
+        documents = [document for document, kept in zip(partition.documents, keep) if kept]
+        matrix = partition.vectors[keep]
+        if rows:
+            documents.extend(document for document, _ in rows)
+            appended = np.array([vector for _, vector in rows], dtype=np.float32)
+            matrix = np.vstack([matrix, appended]) if matrix.size else appended
+
+        ivf = partition.ivf
+        if ivf is not None:
+            # The kept base rows come first, so their assignments still line up
+            ivf = {**ivf, "assignments": ivf["assignments"][keep[:len(ivf["assignments"])]]}
+        self._write(user_id, directory, documents, matrix, self._build_ivf(matrix, ivf))
+
+    def _build_ivf(self, vectors: np.ndarray, ivf: dict = None):
+        """
+        Keep or extend the IVF lists, whose assignments cover the leading
+        rows, to the rest of `vectors`, or retrain them
+        """
+        if len(vectors) < self.ivf_min_size:
+            return None
+        if ivf is not None and len(vectors) < ivf["trained_size"] * IVF_RETRAIN_GROWTH:
+            # Only rows added since the last rewrite need assigning
+            kept = ivf["assignments"]
+            return {
+                **ivf,
+                "assignments": np.concatenate([kept, assign(vectors[len(kept):], ivf["centroids"])]),
+            }
+        centroids = kmeans(vectors, max(1, int(np.sqrt(len(vectors)))))
+        return {
+            "centroids": centroids,
+            "assignments": assign(vectors, centroids),
+            "trained_size": np.array(len(vectors)),
+        }
+
+    # Writes
+
+    def upsert(self, documents: list[dict], vectors):
+        """Insert or replace documents by transaction_id, grouped into user partitions"""
+        vectors = normalise(vectors)
+        by_user = {}
+        for document, vector in zip(documents, vectors):
+            by_user.setdefault(str(document["user_id"]), []).append((document, vector))
+
+        for user_id, rows in by_user.items():
+            with self._locked(user_id) as directory:
+                partition = self.partition(user_id)
+                if partition.generation is not None and len(partition.log) + len(rows) <= max(
+                    self.log_min_rows, len(partition.base) * LOG_MAX_FRACTION
+                ):
+                    self._append(directory, partition, rows)
+                else:
+                    self._rewrite(user_id, directory, partition, rows)
+
+    def _users(self, user_ids) -> list[str]:
+        """The given users' partitions, or every partition when they are not known"""
+        return self._user_ids() if user_ids is None else sorted({str(user_id) for user_id in user_ids})
+
+    def delete(self, transaction_ids, user_ids=None):
+        transaction_ids = {str(pk) for pk in transaction_ids}
+        for user in self._users(user_ids):
+            partition = self.partition(user)
+            if not transaction_ids & partition.positions.keys():
+                continue
+            with self._locked(user) as directory:
+                self._rewrite(user, directory, self.partition(user), deleted=transaction_ids)
+
+    # Reads
+
+    def stored_hashes(self, transaction_ids, hash_key: str, user_ids=None) -> dict[str, str]:
+        wanted = {str(pk) for pk in transaction_ids}
+        hashes = {}
+        for user_id in self._users(user_ids):
+            partition = self.partition(user_id)
+            for transaction_id in wanted & partition.positions.keys():
+                hashes[transaction_id] = partition.documents[partition.positions[transaction_id]].get(hash_key)
+        return hashes
+
+    def _filter_users(self, filter: dict) -> list[str]:
+        """Partitions a filter can match, from its user_id condition"""
+        condition = (filter or {}).get("user_id")
+        if condition is None:
+            return self._user_ids()
+        if isinstance(condition, dict):
+            if "$eq" in condition:
+                return [str(condition["$eq"])]
+            if "$in" in condition:
+                return [str(user_id) for user_id in condition["$in"]]
+            return self._user_ids()
+        return [str(condition)]
+
+    def search(self, query_vector, k: int = 4, filter: dict = None, exact: bool = False) -> list[dict]:
+        """
+        Top-k documents by cosine similarity among those matching `filter`.
+        Each result is the stored document with a `score`. Partitions with
+        IVF lists probe the `nprobe` closest lists unless `exact` is set.
+        """
+        query = normalise(query_vector)
+        results = []
+        for user_id in self._filter_users(filter):
+            partition = self.partition(user_id)
+            if not len(partition):
+                continue
+            mask = partition.mask(filter)
+            for position, score in partition.search(query, k, mask, None if exact else self.nprobe):
+                results.append({**partition.documents[position], "score": score})
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:k]
+
+    def count(self) -> int:
+        return sum(len(self.partition(user_id).positions) for user_id in self._user_ids())
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain interface over `LocalVectorIndex`, as returned by `get_vector_store`"""
+
+    def __init__(self, embedding, index: LocalVectorIndex):
+        self._embedding = embedding
+        self.index = index
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, **kwargs) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        # Documents are stored and searched per user partition
+        if not all(metadata.get("user_id") for metadata in metadatas):
+            raise ValueError("Every document needs a user_id in its metadata")
+        documents = [
+            {TEXT_KEY: text, "transaction_id": str(uuid.uuid4()), **metadata}
+            for text, metadata in zip(texts, metadatas)
+        ]
+        self.index.upsert(documents, self._embedding.embed_documents(texts))
+        return [document["transaction_id"] for document in documents]
+
+    def delete(self, ids=None, **kwargs):
+        self.index.delete(ids or [])
+        return True
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None, **kwargs):
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k, filter
+        )
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, filter: dict = None):
+        matches = []
+        for result in self.index.search(embedding, k, filter):
+            score = result.pop("score")
+            matches.append((Document(page_content=result.pop(TEXT_KEY), metadata=result), score))
+        return matches
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, index: LocalVectorIndex = None, **kwargs):
+        store = cls(embedding, index)
+        store.add_texts(texts, metadatas)
+        return store
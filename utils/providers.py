@@ -0,0 +1,46 @@
+"""
+Process-wide registry of external clients (MongoDB, LLMs, embedding models,
+Plaid). Each client is built by its factory the first time it is needed, so
+importing a module that uses one costs nothing until it is actually called.
+"""
+import threading
+from typing import Any, Callable
+
+_factories: dict[str, Callable[[], Any]] = {}
+_instances: dict[str, Any] = {}
+# Re-entrant, as factories may look up the providers they build on
+_lock = threading.RLock()
+
+
+def register(name: str):
+    """Register the decorated function as the factory for provider `name`"""
+    def decorator(factory: Callable[[], Any]):
+        _factories[name] = factory
+        return factory
+    return decorator
+
+
+def get(name: str) -> Any:
+    """The client for `name`, created on first use and shared afterwards"""
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _instances:
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def is_loaded(name: str) -> bool:
+    return name in _instances
+
+
+def reset(name: str = None):
+    """Drop created clients (all of them by default) so the next use rebuilds them"""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
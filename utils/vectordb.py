@@ -1,20 +1,32 @@
-from functools import lru_cache
+import logging
 
 from django.conf import settings
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
-from langchain_openai.chat_models import ChatOpenAI
-from pymongo import MongoClient
 
-# Connect to MongoDB
-client = MongoClient(settings.MONGO_URI)
-database = client[settings.VECTOR_DB_NAME]
-vectors_collection = database[settings.VECTOR_COLLECTION_NAME]
+from utils import providers
 
+# Field names used by MongoDBAtlasVectorSearch for stored documents
+TEXT_KEY = "text"
+EMBEDDING_KEY = "embedding"
+# Hash of the embedded text and metadata, to skip rewriting unchanged documents
+HASH_KEY = "content_hash"
+TRANSACTION_ID_INDEX = "transaction_id_unique"
+VECTOR_INDEX_NAME = "default"
+# Metadata fields queries pre-filter on (see `TransactionSearch.vector_filter`);
+# Atlas rejects a `$vectorSearch` filter on any path not declared in the index
+VECTOR_FILTER_PATHS = ["user_id", "date", "type", "categories"]
 
-@lru_cache(maxsize=1)
-def get_llm():
+logger = logging.getLogger(__name__)
+
+
+@providers.register("mongo")
+def _mongo_client():
+    from pymongo import MongoClient
+    return MongoClient(settings.MONGO_URI)
+
+
+@providers.register("llm")
+def _llm():
+    from langchain_openai.chat_models import ChatOpenAI
     return ChatOpenAI(
         model=settings.LLM_MODEL,
         api_key=settings.LLM_API_KEY,
@@ -22,8 +34,9 @@ def get_llm():
     )
 
 
-@lru_cache(maxsize=1)
-def get_embeddings():
+def load_local_embeddings():
+    """Load the embedding model into this process"""
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
     return HuggingFaceBgeEmbeddings(
         model_name=settings.EMBEDDING_MODEL,
         model_kwargs={"device": "cpu"},
@@ -31,12 +44,237 @@ def get_embeddings():
     )
 
 
-@lru_cache(maxsize=1)
-def get_vector_store():
-    embeddings = get_embeddings()
+@providers.register("embeddings")
+def _embeddings():
+    if settings.EMBEDDING_SERVICE_URL:
+        from utils.embedding_service import RemoteEmbeddings
+        embeddings = RemoteEmbeddings(
+            settings.EMBEDDING_SERVICE_URL, timeout=settings.EMBEDDING_SERVICE_TIMEOUT
+        )
+    else:
+        embeddings = load_local_embeddings()
+
+    if settings.EMBEDDING_CACHE_SIZE <= 0:
+        return embeddings
+    from utils.embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(embeddings, settings.EMBEDDING_MODEL, settings.EMBEDDING_CACHE_SIZE)
+
+
+@providers.register("vector_store")
+def _vector_store():
+    if settings.VECTOR_STORE_BACKEND == "local":
+        from utils.local_vectors import LocalVectorStore
+        return LocalVectorStore(get_embeddings(), get_vector_backend())
+
+    from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
     return MongoDBAtlasVectorSearch(
-        embedding=embeddings,
-        collection=vectors_collection,
-        index_name="default",
+        embedding=get_embeddings(),
+        collection=get_vectors_collection(),
+        index_name=VECTOR_INDEX_NAME,
         relevance_score_fn="cosine",
     )
+
+
+def get_vectors_collection():
+    return providers.get("mongo")[settings.VECTOR_DB_NAME][settings.VECTOR_COLLECTION_NAME]
+
+
+def get_llm():
+    return providers.get("llm")
+
+
+def get_embeddings():
+    return providers.get("embeddings")
+
+
+def get_vector_store():
+    return providers.get("vector_store")
+
+
+class AtlasVectorBackend:
+    """
+    Vector documents in a MongoDB Atlas collection, one per transaction,
+    with the metadata stored alongside the text and embedding. Searches use
+    `$vectorSearch`; fields used in filters must be declared as `filter`
+    fields in the Atlas vector index definition.
+    """
+
+    def stored_hashes(self, transaction_ids, hash_key: str, user_ids=None) -> dict[str, str]:
+        # The transaction_id index already narrows the lookup to these documents
+        return {
+            document["transaction_id"]: document.get(hash_key)
+            for document in get_vectors_collection().find(
+                {"transaction_id": {"$in": [str(pk) for pk in transaction_ids]}},
+                {"transaction_id": 1, hash_key: 1},
+            )
+        }
+
+    def upsert(self, documents: list[dict], vectors):
+        """
+        Write pre-embedded documents in one bulk_write, replacing the document
+        stored for each transaction in place. A transaction is never missing
+        from search while it is rewritten.
+        """
+        from pymongo import ReplaceOne
+
+        operations = [
+            ReplaceOne(
+                {"transaction_id": document["transaction_id"]},
+                {**document, EMBEDDING_KEY: list(vector)},
+                upsert=True,
+            )
+            for document, vector in zip(documents, vectors)
+        ]
+        providers.get("vector_indexes")
+        get_vectors_collection().bulk_write(operations, ordered=False)
+
+    def delete(self, transaction_ids, user_ids=None):
+        get_vectors_collection().delete_many(
+            {"transaction_id": {"$in": [str(pk) for pk in transaction_ids]}}
+        )
+
+    def search(self, query_vector, k: int = 4, filter: dict = None, exact: bool = False) -> list[dict]:
+        stage = {
+            "index": VECTOR_INDEX_NAME,
+            "path": EMBEDDING_KEY,
+            "queryVector": list(query_vector),
+            "limit": k,
+        }
+        if exact:
+            stage["exact"] = True
+        else:
+            stage["numCandidates"] = k * settings.VECTOR_SEARCH_CANDIDATES
+        if filter:
+            stage["filter"] = filter
+        return list(get_vectors_collection().aggregate([
+            {"$vectorSearch": stage},
+            {"$addFields": {"score": {"$meta": "vectorSearchScore"}}},
+            {"$project": {"_id": 0, EMBEDDING_KEY: 0}},
+        ]))
+
+
+@providers.register("vector_backend")
+def _vector_backend():
+    if settings.VECTOR_STORE_BACKEND == "local":
+        from utils.local_vectors import LocalVectorIndex
+        return LocalVectorIndex(settings.LOCAL_VECTOR_DIR, nprobe=settings.LOCAL_VECTOR_NPROBE)
+    return AtlasVectorBackend()
+
+
+def get_vector_backend():
+    return providers.get("vector_backend")
+
+
+def get_stored_hashes(transaction_ids, user_ids=None) -> dict[str, str]:
+    """
+    Content hash of the stored document for each transaction id. Passing
+    the owners' `user_ids` lets the local backend read only their partitions.
+    """
+    if not transaction_ids:
+        return {}
+    return get_vector_backend().stored_hashes(transaction_ids, HASH_KEY, user_ids)
+
+
+def upsert_vector_documents(documents, vectors):
+    """Write pre-embedded documents, replacing any stored for the same transaction"""
+    if documents:
+        get_vector_backend().upsert(
+            [{TEXT_KEY: document.page_content, **document.metadata} for document in documents],
+            vectors,
+        )
+
+
+def delete_vector_documents(transaction_ids, user_ids=None):
+    if transaction_ids:
+        get_vector_backend().delete(transaction_ids, user_ids)
+
+
+def search_vectors(query_vector, k: int = 4, filter: dict = None, exact: bool = False) -> list[dict]:
+    """
+    Top-k stored documents by similarity to `query_vector`, each with a
+    `score`. `filter` is a MongoDB-style condition on the metadata fields,
+    applied before ranking by either backend.
+    """
+    return get_vector_backend().search(query_vector, k, filter, exact)
+
+
+@providers.register("vector_indexes")
+def _vector_indexes():
+    """
+    Create the unique index on transaction_id and the vector search index
+    once per process. The unique index makes each upsert atomic and stops
+    duplicates from coming back, but cannot be built while duplicates exist;
+    `compact_vectors` removes them and builds it.
+    """
+    from pymongo.errors import OperationFailure
+    try:
+        ensure_vector_search_index()
+    except OperationFailure as e:
+        logger.warning(f"Could not create or update the Atlas vector search index: {e}")
+    try:
+        ensure_vector_indexes()
+    except OperationFailure as e:
+        logger.warning(f"Vector collection has no unique transaction_id index, run compact_vectors: {e}")
+        return False
+    return True
+
+
+def ensure_vector_indexes():
+    get_vectors_collection().create_index(
+        "transaction_id", unique=True, name=TRANSACTION_ID_INDEX
+    )
+
+
+def vector_search_index_definition() -> dict:
+    """Atlas vector search index over the embeddings, with the filter paths"""
+    return {
+        "fields": [
+            {
+                "type": "vector",
+                "path": EMBEDDING_KEY,
+                "numDimensions": settings.EMBEDDING_DIMENSIONS,
+                "similarity": "cosine",
+            },
+            *({"type": "filter", "path": path} for path in VECTOR_FILTER_PATHS),
+        ]
+    }
+
+
+def ensure_vector_search_index():
+    """Create the vector search index, or update it if its definition changed"""
+    from pymongo.operations import SearchIndexModel
+
+    collection = get_vectors_collection()
+    definition = vector_search_index_definition()
+    existing = next(iter(collection.list_search_indexes(VECTOR_INDEX_NAME)), None)
+    if existing is None:
+        collection.create_search_index(
+            SearchIndexModel(definition, name=VECTOR_INDEX_NAME, type="vectorSearch")
+        )
+    elif existing.get("latestDefinition") != definition:
+        collection.update_search_index(VECTOR_INDEX_NAME, definition)
+
+
+def find_duplicate_vector_documents() -> list:
+    """
+    Ids of documents that share a transaction_id with a newer document.
+    The most recently inserted copy of each transaction is kept.
+    """
+    duplicates = get_vectors_collection().aggregate([
+        {"$match": {"transaction_id": {"$exists": True}}},
+        {"$sort": {"_id": -1}},
+        {"$group": {"_id": "$transaction_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    return [pk for group in duplicates for pk in group["ids"][1:]]
+
+
+def collection_stats() -> dict:
+    """Document count and storage sizes, in bytes, of the vectors collection"""
+    collection = get_vectors_collection()
+    stats = collection.database.command("collStats", collection.name)
+    return {
+        "documents": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "index_size": stats.get("totalIndexSize", 0),
+    }